@@ -0,0 +1,92 @@
+"""
+Builds several components with a single invocation of the compiler script.
+
+Each component has its own build.xml. Instead of running the compiler
+script once per component, an aggregate build file is generated which
+calls the build file of every component, then the final link, so the
+start up of the build is paid once.
+
+This is used instead of a resident build host. The compiler script
+starts its own JVM and sets up the toolchain on each call, and this tool
+has no Ant of its own to keep running between the builds.
+
+The paths of a partial compile are canonicalized first: the duplicates
+are dropped, and so are the components inside another listed component,
+which are built with it anyway.
+"""
+import os
+import xml.etree.ElementTree as ElementTree
+
+BUILD_FILE = "build.xml"
+# The name of the aggregate project
+PROJECT_NAME = "batch"
+
+
+def canonicalize(paths):
+    """Returns the components of given paths in the given order, each one
+    once, without the ones nested in another component"""
+    components = {}
+    for path in paths:
+        path = os.path.normpath(path.strip().replace('\\', '/'))
+        if path == os.curdir:
+            continue
+        key = tuple(os.path.normcase(path).replace('\\', '/').split('/'))
+        components.setdefault(key, path)
+
+    return [
+        path for key, path in components.items()
+        if not any(
+            key[:length] in components for length in range(1, len(key))
+        )
+    ]
+
+
+def parse_arguments(arguments):
+    """Returns the target and the properties of the command line of the
+    compiler script, e.g., "target -Dbuild.parallel=true" """
+    target = None
+    properties = {}
+    for argument in arguments.split():
+        if argument.startswith("-D"):
+            name, _, value = argument[2:].partition('=')
+            properties[name] = value
+        elif target is None:
+            target = argument
+    return target, properties
+
+
+def _add_call(parent, directory, arguments):
+    "adds a call of the build file in given directory"
+    target, properties = parse_arguments(arguments)
+    call = ElementTree.SubElement(parent, "ant", {
+        "dir": directory,
+        "antfile": BUILD_FILE,
+        "inheritAll": "false",
+    })
+    if target:
+        call.set("target", target)
+    for name, value in properties.items():
+        ElementTree.SubElement(call, "property", {
+            "name": name, "value": value
+        })
+
+
+def write_build_file(directory, target, components, compile_arguments,
+                     link=None):
+    """Writes the aggregate build file to given directory, returns its path.
+    Its target builds the components with the compile arguments, then
+    runs the final link if link is given as (directory, arguments)."""
+    project = ElementTree.Element("project", {
+        "name": PROJECT_NAME, "default": target
+    })
+    batch = ElementTree.SubElement(project, "target", {"name": target})
+    for component in components:
+        _add_call(batch, component, compile_arguments)
+    if link is not None:
+        _add_call(batch, *link)
+
+    path = os.path.join(directory, BUILD_FILE)
+    ElementTree.ElementTree(project).write(
+        path, encoding="utf-8", xml_declaration=True
+    )
+    return path
@@ -0,0 +1,227 @@
+"""
+The local artifact cache.
+
+The executables built from the same sources with the same options are
+the same. So, they are stored by a key of the checked out commits, the
+state of the work trees, the target and the compile type, and the patches.
+A build with a known key restores the executables instead of compiling.
+The files are stored by their content, least recently used ones are
+evicted when the cache grows beyond its size.
+"""
+import os
+import json
+import time
+import glob
+import shutil
+import hashlib
+import threading
+
+from compiler_config import CONFIGURATIONS
+from compiler_git import find_git_dir, find_repositories, get_head, \
+    get_worktree_digest, GitError
+
+CACHE_DIR = os.path.join(
+    os.path.expanduser("~"),
+    ".compiler_cache"
+)
+CACHE_MAX_SIZE = CONFIGURATIONS.get("cache_max_size", 4 * 1024 ** 3)
+ARTIFACT_PATTERN = "CPU*.elf"
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def get_cache_key(root, target_type, compile_type, patches=None,
+                  excluded=()):
+    """Returns the key of a build of given root, None if the sources
+    cannot be identified, e.g., there is no git repository. The untracked
+    files in excluded, e.g., the log file, are not a part of the key."""
+    digest = hashlib.sha256()
+    digest.update("{0}|{1}\n".format(
+        target_type.name, compile_type.name
+    ).encode())
+
+    repositories = find_repositories(root)
+    if not repositories:
+        return None
+
+    try:
+        for repository in repositories:
+            _, git_dir = find_git_dir(repository)
+            digest.update("{0}|{1}|{2}\n".format(
+                os.path.relpath(repository, root).replace(os.sep, '/'),
+                get_head(git_dir),
+                get_worktree_digest(repository, excluded)
+            ).encode())
+    except (GitError, OSError):
+        return None
+
+    for path, patch in sorted((patches or {}).items()):
+        if not _is_inside(path, root):
+            # Patched in another checkout, it is not a part of this build
+            continue
+        digest.update("{0}|{1}\n".format(
+            os.path.relpath(path, root).replace(os.sep, '/'), patch
+        ).encode())
+
+    return digest.hexdigest()
+
+
+def _is_inside(path, root):
+    "returns True if given path is in given directory"
+    path = os.path.normcase(os.path.abspath(path))
+    root = os.path.normcase(os.path.abspath(root))
+    try:
+        return os.path.commonpath([path, root]) == root
+    except ValueError:
+        # On different drives
+        return False
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(_COPY_BUFFER_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _copy_atomic(source, destination):
+    "copies the file to a temporary file and moves it over the destination"
+    temp_file = "{0}.{1}.tmp".format(destination, os.getpid())
+    shutil.copyfile(source, temp_file)
+    os.replace(temp_file, destination)
+
+
+class ArtifactCache:
+    "Stores the built executables by the build key"
+
+    def __init__(self, directory=CACHE_DIR, max_size=CACHE_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self._objects = os.path.join(directory, "objects")
+        self._index_file = os.path.join(directory, "index.json")
+        self._lock = threading.Lock()
+
+    def _read_index(self):
+        try:
+            with open(self._index_file) as index_file:
+                index = json.loads(index_file.read())
+        except (FileNotFoundError, json.JSONDecodeError, OSError):
+            return {}
+        return index if isinstance(index, dict) else {}
+
+    def _write_index(self, index):
+        temp_file = "{0}.{1}.tmp".format(self._index_file, os.getpid())
+        with open(temp_file, 'w') as index_file:
+            index_file.write(json.dumps(index, indent=4))
+        os.replace(temp_file, self._index_file)
+
+    def _object_path(self, digest):
+        return os.path.join(self._objects, digest[:2], digest)
+
+    def lookup(self, key):
+        "returns the entry of given key, None if it is not cached"
+        with self._lock:
+            entry = self._read_index().get(key)
+        if entry is None:
+            return None
+
+        for digest in entry["files"].values():
+            if not os.path.isfile(self._object_path(digest)):
+                return None
+        return entry
+
+    def restore(self, key, destination):
+        "copies the cached files to given directory, returns their paths"
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+
+        os.makedirs(destination, exist_ok=True)
+        restored = []
+        for name, digest in entry["files"].items():
+            path = os.path.join(destination, name)
+            _copy_atomic(self._object_path(digest), path)
+            restored.append(path)
+
+        with self._lock:
+            index = self._read_index()
+            if key in index:
+                index[key]["last_used"] = time.time()
+                self._write_index(index)
+
+        return restored
+
+    def store(self, key, files, **metadata):
+        "stores given files by given key, evicts the old entries if needed"
+        stored = {}
+        size = 0
+        for path in files:
+            digest = _hash_file(path)
+            object_path = self._object_path(digest)
+            if not os.path.isfile(object_path):
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                _copy_atomic(path, object_path)
+            stored[os.path.basename(path)] = digest
+            size += os.path.getsize(path)
+
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            index = self._read_index()
+            index[key] = {
+                "files": stored,
+                "size": size,
+                "created": time.time(),
+                "last_used": time.time(),
+                "metadata": metadata,
+            }
+            self._evict(index)
+            self._write_index(index)
+
+    def _evict(self, index):
+        "removes the least recently used entries and the unused files"
+        used = {}
+        for entry in index.values():
+            for digest in entry["files"].values():
+                used[digest] = os.path.getsize(self._object_path(digest)) \
+                    if os.path.isfile(self._object_path(digest)) else 0
+
+        total = sum(used.values())
+        for key in sorted(index, key=lambda key: index[key]["last_used"]):
+            if total <= self.max_size or len(index) == 1:
+                break
+            entry = index.pop(key)
+            remaining = {
+                digest for other in index.values()
+                for digest in other["files"].values()
+            }
+            for digest in set(entry["files"].values()) - remaining:
+                total -= used.pop(digest, 0)
+
+        for path in glob.glob(os.path.join(self._objects, '*', '*')):
+            if os.path.basename(path) not in used:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def get_size(self):
+        "returns the total size of the stored files"
+        return sum(
+            os.path.getsize(path)
+            for path in glob.glob(os.path.join(self._objects, '*', '*'))
+        )
+
+    def clear(self):
+        "removes everything in the cache"
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def get_artifacts(directory, since=None):
+    "returns the executables in given directory, modified after since"
+    return [
+        path for path in sorted(glob.glob(
+            os.path.join(directory, ARTIFACT_PATTERN)
+        ))
+        if since is None or os.path.getmtime(path) >= since
+    ]
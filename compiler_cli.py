@@ -0,0 +1,470 @@
+"""
+The command line interface of the compiler tool.
+
+Runs the operations without the GUI, e.g., on the CI agents and for the
+nightly builds. The flags are the ones produced by the GUI, so a command
+line copied from the GUI runs the same operation. tkinter, the layouts
+and pyperclip are never imported here.
+
+    compiler_cli.py --target IPC --compile-type UNOPTIMIZED-AND-LINK \\
+        --parallel --edit-linker AUTO --output build_out.txt \\
+        transfer --target-type WINDOWS --ip-address 10.0.0.2 --reboot
+
+Several targets are built and transferred in a pipeline, each executable
+is uploaded while the next target is compiling:
+
+    compiler_cli.py --target IPC --target OC2 \\
+        transfer --ip-address 10.0.0.2 --ip-address 10.0.0.3
+"""
+import sys
+import os
+import json
+import argparse
+import subprocess
+
+import colorama
+
+from compiler_helper import TargetTypes, CompileTypes, AutoBoolType, \
+    TargetMachines, CPUTypes, CopyActions, ExitCodes, \
+    CompilerConfig, TransferConfig, Lock, \
+    LINKER_DFT_EXPAND_SIZE, EXECUTABLE_FILE_PATH, \
+    DEFAULT_USERNAME, DEFAULT_PASSWORD
+from compiler_gui_support import start_operation, plan_operation, \
+    format_plan, CompilerError, Colored
+from compiler_pipeline import Variant, start_pipeline
+from compiler_daemon import DaemonClient, DaemonError, follow
+
+
+def _enum_type(enumeration):
+    "returns an argparse type which converts the names, e.g., OPTIMIZED-AND-LINK"
+    def to_enum(name):
+        name = name.replace("-", "_").upper()
+        for item in enumeration:
+            if item.name == name:
+                return item
+        raise argparse.ArgumentTypeError(
+            "invalid choice: {0!r} (choose from {1})".format(
+                name, ", ".join(_names(enumeration))
+            )
+        )
+    to_enum.__name__ = enumeration.__name__
+    return to_enum
+
+
+def _names(enumeration):
+    return [item.name.replace("_", "-") for item in enumeration]
+
+
+def _positive_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            "should be a positive integer: {0!r}".format(value)
+        )
+    return number
+
+
+def _size(value):
+    "sizes can be given in decimal or hexadecimal"
+    try:
+        return int(value, 0)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid size: {0!r}".format(value))
+
+
+def _add_compile_arguments(parser):
+    parser.add_argument(
+        "--git-path", default=os.getcwd(),
+        help="the directory containing the repositories, "
+        "defaults to the current directory"
+    )
+    parser.add_argument(
+        "--target", type=_enum_type(TargetTypes), required=True,
+        action="append",
+        metavar="{" + ",".join(_names(TargetTypes)) + "}",
+        help="the target type, repeated ones are built in a pipeline"
+    )
+    parser.add_argument(
+        "--skip-build", action="store_true",
+        help="skips the build, only transfers"
+    )
+    parser.add_argument(
+        "--compile-type", type=_enum_type(CompileTypes),
+        default=list(CompileTypes)[0],
+        metavar="{" + ",".join(_names(CompileTypes)) + "}",
+        help="the compile type"
+    )
+    parser.add_argument(
+        "--parallel", action="store_true",
+        help="compiles the filesets in parallel"
+    )
+    parser.add_argument(
+        "--build-jobs", type=_positive_int,
+        help="job count of the parallel builds, chosen by the machine "
+             "load and the history if not given"
+    )
+    parser.add_argument(
+        "--normal-priority", action="store_true",
+        help="builds with the normal priority instead of a lower one"
+    )
+    parser.add_argument(
+        "--partial-compile", nargs="+", metavar="PATH",
+        help="compiles only given components, relative to the git path"
+    )
+    parser.add_argument(
+        "--jobs", type=_positive_int, default=1,
+        help="number of components compiled at the same time"
+    )
+    failure_group = parser.add_mutually_exclusive_group()
+    failure_group.add_argument(
+        "--fail-fast", action="store_true",
+        help="stops the build on the first compiler error"
+    )
+    failure_group.add_argument(
+        "--keep-going", action="store_true",
+        help="builds all the components even if some fail, "
+             "then reports the failures together"
+    )
+    parser.add_argument(
+        "--no-environment-cache", action="store_true",
+        help="lets the compiler script set up the toolchain on each build"
+    )
+    parser.add_argument(
+        "--batch", action="store_true",
+        help="compiles the components and links in one invocation, "
+             "--jobs is not used, --keep-going cannot be used"
+    )
+    parser.add_argument(
+        "--skip-unchanged", action="store_true",
+        help="skips the components which are not changed since their last "
+             "build, configure shared_include_dirs for the headers which "
+             "their build files do not refer to"
+    )
+    parser.add_argument(
+        "--worktree", action="store_true",
+        help="builds in the worktree of the variant, next to the git path"
+    )
+    parser.add_argument(
+        "--cache", action="store_true",
+        help="restores the executables from the artifact cache if it has "
+             "them, the object files are not rebuilt then"
+    )
+    parser.add_argument(
+        "--edit-linker", type=_enum_type(AutoBoolType),
+        default=AutoBoolType.AUTO,
+        metavar="{" + ",".join(_names(AutoBoolType)) + "}",
+        help="edits the linker script for the unoptimized builds"
+    )
+    parser.add_argument(
+        "--linker-expand-size", type=_size, default=LINKER_DFT_EXPAND_SIZE,
+        help="the size which the linker regions are expanded"
+    )
+    parser.add_argument(
+        "--output", default="build_out.txt",
+        help="the log file, relative to the git path"
+    )
+    parser.add_argument(
+        "--non-interactive", action="store_true",
+        help="accepted for the command lines of the GUI, "
+        "the operation never asks for input"
+    )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="runs even if another instance of the tool is running"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="prints what would be done and its estimated time, "
+        "runs nothing"
+    )
+    parser.add_argument(
+        "--json", action="store_true",
+        help="prints the plan of --dry-run as JSON"
+    )
+    parser.add_argument(
+        "--daemon", action="store_true",
+        help="submits the operation to the running build daemon "
+        "and follows its output"
+    )
+
+
+def _add_transfer_arguments(parser):
+    parser.add_argument(
+        "--target-type", type=_enum_type(TargetMachines),
+        default=list(TargetMachines)[0],
+        metavar="{" + ",".join(_names(TargetMachines)) + "}",
+        help="the operating system of the target"
+    )
+    parser.add_argument(
+        "--cpu-type", type=_enum_type(CPUTypes), action="append",
+        metavar="{" + ",".join(_names(CPUTypes)) + "}",
+        help="the CPU type, selects the default executable file, "
+        "may be repeated"
+    )
+    parser.add_argument(
+        "--ip-address", required=True, action="append",
+        help="the IP address of the target, may be repeated "
+        "for each CPU type or target type"
+    )
+    parser.add_argument("--username", default=DEFAULT_USERNAME)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument(
+        "--destination",
+        help="the directory on the target, "
+        "defaults to the one of the target type"
+    )
+    parser.add_argument(
+        "--executable-file",
+        help="the file to transfer, relative to the git path, "
+        "defaults to the one of the target and the CPU type"
+    )
+    parser.add_argument(
+        "--action", type=_enum_type(CopyActions),
+        default=list(CopyActions)[0],
+        metavar="{" + ",".join(_names(CopyActions)) + "}",
+        help="what to do with the existing file on the target"
+    )
+    parser.add_argument(
+        "--reboot", action="store_true",
+        help="reboots the target after the transfer"
+    )
+
+
+def get_parser():
+    "returns the argument parser"
+    parser = argparse.ArgumentParser(
+        description="Builds and transfers the executable without the GUI."
+    )
+    _add_compile_arguments(parser)
+
+    subparsers = parser.add_subparsers(dest="command")
+    transfer_parser = subparsers.add_parser(
+        "transfer", help="transfers the executable after the build"
+    )
+    _add_transfer_arguments(transfer_parser)
+
+    return parser
+
+
+def get_compiler_config(args, target_type=None):
+    "returns the compiler configurations of given arguments"
+    return CompilerConfig(
+        target_type=target_type or args.target[0],
+        skip_build=args.skip_build,
+        compile_type=args.compile_type,
+        parallel_compile=args.parallel,
+        partial_compile=args.partial_compile,
+        edit_linker=args.edit_linker,
+        expand_size=args.linker_expand_size,
+        output=args.output,
+        partial_jobs=args.jobs,
+        skip_unchanged=args.skip_unchanged,
+        use_cache=args.cache,
+        use_worktree=args.worktree,
+        build_jobs=args.build_jobs,
+        low_priority=not args.normal_priority,
+        batch_build=args.batch,
+        use_environment_cache=not args.no_environment_cache,
+        fail_fast=args.fail_fast,
+        keep_going=args.keep_going
+    )
+
+
+def _get_cpu_types(args):
+    return args.cpu_type or [list(CPUTypes)[0]]
+
+
+def get_transfer_config(args, target_type=None, cpu_type=None,
+                        ip_address=None):
+    "returns the transfer configurations of given arguments"
+    if args.command != "transfer":
+        return TransferConfig(
+            skip_transfer=True,
+            target_machine=list(TargetMachines)[0],
+            cpu_type=list(CPUTypes)[0],
+            ip_address="",
+            username=DEFAULT_USERNAME,
+            password=DEFAULT_PASSWORD,
+            destination="",
+            target_file="",
+            action=list(CopyActions)[0],
+            reboot=False
+        )
+
+    target_type = target_type or args.target[0]
+    cpu_type = cpu_type or _get_cpu_types(args)[0]
+    target_file = args.executable_file
+    if target_file is None:
+        target_file = os.path.join(
+            EXECUTABLE_FILE_PATH.format(target_type.value),
+            cpu_type.value
+        )
+
+    return TransferConfig(
+        skip_transfer=False,
+        target_machine=args.target_type,
+        cpu_type=cpu_type,
+        ip_address=ip_address or args.ip_address[0],
+        username=args.username,
+        password=args.password,
+        destination=args.destination or args.target_type.value,
+        target_file=target_file,
+        action=args.action,
+        reboot=args.reboot
+    )
+
+
+def get_variants(args):
+    """Returns the build variants of given arguments, a variant per target
+    type. The transfers, i.e., the pairs of the CPU types and the IP
+    addresses, belong to the only target or to the targets in order.
+    Raises ValueError if they do not match."""
+    if args.command != "transfer":
+        return [
+            Variant(get_compiler_config(args, target_type))
+            for target_type in args.target
+        ]
+
+    cpu_types = _get_cpu_types(args)
+    count = max(len(cpu_types), len(args.ip_address))
+    for values in (cpu_types, args.ip_address):
+        if len(values) not in (1, count):
+            raise ValueError(
+                "--cpu-type and --ip-address should have the same count "
+                "of values, or one value"
+            )
+    transfers = [
+        (cpu_types[index % len(cpu_types)],
+         args.ip_address[index % len(args.ip_address)])
+        for index in range(count)
+    ]
+
+    if len(args.target) == 1:
+        groups = [transfers]
+    elif len(transfers) == len(args.target):
+        groups = [[transfer] for transfer in transfers]
+    else:
+        raise ValueError(
+            "each target should have a transfer, "
+            "give an IP address per target"
+        )
+
+    return [
+        Variant(get_compiler_config(args, target_type), [
+            get_transfer_config(args, target_type, cpu_type, ip_address)
+            for cpu_type, ip_address in group
+        ])
+        for target_type, group in zip(args.target, groups)
+    ]
+
+
+def get_plans(args, variants):
+    """returns the plans of the variants, each build is planned once
+    although it has several transfers"""
+    plans = []
+    for variant in variants:
+        compiler_config = variant.compiler_config
+        for transfer_config in variant.transfer_configs or \
+                [get_transfer_config(args)]:
+            plans.append(plan_operation(
+                compiler_config, transfer_config, args.git_path
+            ))
+            compiler_config = CompilerConfig.from_dict(
+                dict(compiler_config.to_dict(), skip_build=True)
+            )
+    return plans
+
+
+def _is_another_instance_running():
+    "the running instances can only be listed on Windows"
+    if os.name != "nt":
+        return False
+    try:
+        return Lock.is_locked()
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+
+def _submit_to_daemon(args):
+    "the daemon queues the operations, so there is no need to lock"
+    client = DaemonClient()
+    try:
+        responses = client.submit(
+            get_compiler_config(args), get_transfer_config(args),
+            args.git_path, attach=True
+        )
+        job = next(responses)
+        Colored.info("Submitted as job {0}, {1} job(s) ahead.".format(
+            job["job"], job["position"]
+        ))
+        return follow(responses)
+    except DaemonError as error:
+        Colored.error(error)
+        return ExitCodes.UNKNOWN.value
+
+
+def main(argv=None):
+    "starts from here, returns the exit code"
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.keep_going and args.batch:
+        parser.error("--keep-going cannot be used with --batch, "
+                     "the batch stops on the first failure")
+    try:
+        variants = get_variants(args)
+    except ValueError as error:
+        parser.error(str(error))
+    is_pipeline = len(variants) > 1 or \
+        len(variants[0].transfer_configs) > 1
+    colorama.init()
+
+    if args.dry_run:
+        plans = get_plans(args, variants)
+        if args.json:
+            print(json.dumps(plans, indent=4))
+        else:
+            for plan in plans:
+                Colored.info(format_plan(plan))
+        return ExitCodes.SUCCESS.value
+
+    if args.daemon:
+        if is_pipeline:
+            parser.error("the daemon runs a target with a transfer at a time")
+        return _submit_to_daemon(args)
+
+    if not args.force and _is_another_instance_running():
+        Colored.error(
+            "Another instance is running. Use --force to run anyway."
+        )
+        return ExitCodes.ALREADY_RUNNING.value
+
+    try:
+        if is_pipeline:
+            start_pipeline(variants, stdout=sys.stdout, root=args.git_path)
+        else:
+            start_operation(
+                get_compiler_config(args),
+                get_transfer_config(args),
+                stdout=sys.stdout,
+                root=args.git_path
+            )
+    except CompilerError as error:
+        Colored.error(
+            "\nOperation finished with error code {0}".format(
+                error.exit_code.value
+            )
+        )
+        return error.exit_code.value
+    except KeyboardInterrupt:
+        Colored.error("\nOperation canceled by user!")
+        return ExitCodes.CANCELED.value
+
+    Colored.info("\nOperation finished successfully.")
+    return ExitCodes.SUCCESS.value
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,557 @@
+"""
+The build daemon.
+
+A long-lived process which keeps the modules imported and runs the
+submitted operations one by one. The GUI and the CLI talk to it over a
+local socket with JSON lines, so the start up cost is paid once and
+several front-ends can share one build machine without colliding.
+
+Requests and responses are single line JSON objects:
+    {"command": "submit", "compiler": {...}, "transfer": {...}, "root": ...}
+    {"command": "status"}
+    {"command": "attach", "job": 1, "from": 0}
+    {"command": "cancel", "job": 1}
+    {"command": "shutdown"}
+Attached clients receive {"output": "..."} until {"state": ..., ...}.
+
+Only the last finished jobs are kept, and their output is dropped after
+a while. The summaries of such jobs tell that their output has expired.
+
+Every request carries the token of the daemon, {"token": ..., ...}. The
+daemon writes a new one to the home directory of the user at each start,
+which only the user can read, so the other users of the machine cannot
+run the operations in the name of the user.
+"""
+import sys
+import os
+import hmac
+import json
+import time
+import queue
+import socket
+import secrets
+import argparse
+import threading
+import socketserver
+
+from compiler_config import CONFIGURATIONS
+from compiler_helper import CompilerConfig, TransferConfig, ExitCodes
+from compiler_gui_support import start_operation, CompilerError, Colored
+
+DAEMON_HOST = "127.0.0.1"
+DAEMON_PORT = CONFIGURATIONS.get("daemon_port", 50550)
+# The port is appended, each daemon has its own token
+DAEMON_TOKEN_FILE = os.path.join(
+    os.path.expanduser("~"),
+    ".compiler_daemon_token"
+)
+# Output of a job which is kept for the clients attaching later
+MAX_JOB_OUTPUT = 16 * 1024 * 1024
+# The finished jobs which are kept, the older ones are forgotten
+MAX_FINISHED_JOBS = CONFIGURATIONS.get("daemon_finished_jobs", 50)
+# Seconds after which the output of a finished job is dropped
+JOB_OUTPUT_TTL = CONFIGURATIONS.get("daemon_job_output_ttl", 3600)
+ENCODING = "utf-8"
+
+
+class DaemonError(Exception):
+    "raises when the daemon cannot be reached or rejects a request"
+
+
+def get_token_file(port=DAEMON_PORT):
+    "returns the token file of the daemon on given port"
+    return "{0}_{1}".format(DAEMON_TOKEN_FILE, port)
+
+
+def write_token(filename):
+    """Writes a new token to given file, returns it. The file is created
+    for the owner only. On Windows, the profile directory of the user is
+    not readable by the others already."""
+    token = secrets.token_hex(32)
+    try:
+        os.unlink(filename)
+    except FileNotFoundError:
+        pass
+    descriptor = os.open(
+        filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600
+    )
+    with os.fdopen(descriptor, 'w') as token_file:
+        token_file.write(token)
+    return token
+
+
+def read_token(filename):
+    "returns the token in given file"
+    try:
+        with open(filename) as token_file:
+            return token_file.read().strip()
+    except OSError as error:
+        raise DaemonError(
+            "Build daemon token cannot be read: {0}".format(error)
+        )
+
+
+class JobStates:
+    "States of a job"
+    # pylint: disable=too-few-public-methods
+    QUEUED = "queued"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELED = "canceled"
+
+    FINISHED = (SUCCEEDED, FAILED, CANCELED)
+
+
+class Job:
+    "An operation submitted to the daemon, collects its output"
+
+    def __init__(self, job_id, compiler_config, transfer_config, root,
+                 submitter=None):
+        self.job_id = job_id
+        self.compiler_config = compiler_config
+        self.transfer_config = transfer_config
+        self.root = root
+        self.submitter = submitter
+        self.state = JobStates.QUEUED
+        self.exit_code = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.cancel_event = threading.Event()
+        self.expired = False
+
+        self._chunks = []
+        self._first_chunk = 0
+        self._size = 0
+        self._changed = threading.Condition()
+
+    def write(self, text):
+        "file-like interface for start_operation"
+        if not text:
+            return 0
+
+        with self._changed:
+            self._chunks.append(text)
+            self._size += len(text)
+            while self._size > MAX_JOB_OUTPUT and len(self._chunks) > 1:
+                self._size -= len(self._chunks.pop(0))
+                self._first_chunk += 1
+            self._changed.notify_all()
+        return len(text)
+
+    def flush(self):
+        "file-like interface for start_operation"
+
+    def set_state(self, state, exit_code=None):
+        "updates the state, wakes up the attached clients"
+        with self._changed:
+            self.state = state
+            if state == JobStates.RUNNING:
+                self.started = time.time()
+            if state in JobStates.FINISHED:
+                self.finished = time.time()
+                self.exit_code = exit_code
+            self._changed.notify_all()
+
+    def expire(self):
+        "drops the output of the finished job"
+        with self._changed:
+            self._first_chunk += len(self._chunks)
+            self._chunks = []
+            self._size = 0
+            self.expired = True
+
+    def read(self, start, timeout=None):
+        """Returns the output chunks from given index, the next index and
+        whether the job is finished. Waits for the output if there is not."""
+        with self._changed:
+            start = max(start, self._first_chunk)
+            if start - self._first_chunk >= len(self._chunks) \
+                    and self.state not in JobStates.FINISHED:
+                self._changed.wait(timeout)
+                start = max(start, self._first_chunk)
+
+            chunks = self._chunks[start - self._first_chunk:]
+            return chunks, start + len(chunks), \
+                self.state in JobStates.FINISHED
+
+    def to_dict(self):
+        "returns the summary of the job"
+        return {
+            "job": self.job_id,
+            "state": self.state,
+            "exit_code": self.exit_code,
+            "submitter": self.submitter,
+            "root": self.root,
+            "target_type": self.compiler_config.target_type.name,
+            "compile_type": self.compiler_config.compile_type.name,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "expired": self.expired,
+        }
+
+
+class BuildDaemon:
+    "Queues the jobs and runs them one by one in this process"
+
+    def __init__(self):
+        self._jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._next_id = 1
+        # The last forgotten job, the older ones are forgotten too
+        self._forgotten = 0
+        self._worker = threading.Thread(
+            target=self._work, name="build-daemon-worker", daemon=True
+        )
+        self._worker.start()
+
+    def submit(self, compiler_config, transfer_config, root, submitter=None):
+        "queues a new job, returns it"
+        with self._lock:
+            job = Job(
+                self._next_id, compiler_config, transfer_config,
+                root, submitter
+            )
+            self._jobs[job.job_id] = job
+            self._next_id += 1
+            self._prune()
+        self._queue.put(job)
+        return job
+
+    def _prune(self):
+        """forgets the oldest finished jobs, drops the output of the ones
+        finished before the TTL. Called with the lock"""
+        finished = [
+            self._jobs[job_id] for job_id in sorted(self._jobs)
+            if self._jobs[job_id].state in JobStates.FINISHED
+        ]
+        forgotten = max(len(finished) - MAX_FINISHED_JOBS, 0)
+        for job in finished[:forgotten]:
+            del self._jobs[job.job_id]
+            self._forgotten = max(self._forgotten, job.job_id)
+
+        deadline = time.time() - JOB_OUTPUT_TTL
+        for job in finished[forgotten:]:
+            if not job.expired and job.finished < deadline:
+                job.expire()
+
+    def get_job(self, job_id):
+        "returns the job with given id"
+        with self._lock:
+            self._prune()
+            try:
+                return self._jobs[job_id]
+            except KeyError:
+                if 0 < job_id <= self._forgotten:
+                    raise DaemonError("Job {0} has expired".format(job_id))
+                raise DaemonError("No such job: {0}".format(job_id))
+
+    def get_jobs(self):
+        "returns all jobs in the submission order"
+        with self._lock:
+            self._prune()
+            return [self._jobs[job_id] for job_id in sorted(self._jobs)]
+
+    def get_position(self, job):
+        "returns the number of the jobs which run before given one"
+        return sum(
+            1 for other in self.get_jobs()
+            if other.job_id < job.job_id
+            and other.state in (JobStates.QUEUED, JobStates.RUNNING)
+        )
+
+    def cancel(self, job_id):
+        """cancels given job, the build processes of a running job are
+        stopped. Returns False if the job has finished already."""
+        job = self.get_job(job_id)
+        with self._lock:
+            if job.state == JobStates.QUEUED:
+                job.set_state(JobStates.CANCELED, ExitCodes.CANCELED.value)
+                return True
+            if job.state != JobStates.RUNNING:
+                return False
+            job.cancel_event.set()
+        return True
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.state != JobStates.QUEUED:
+                    continue
+                job.set_state(JobStates.RUNNING)
+            self._run(job)
+            with self._lock:
+                self._prune()
+
+    @staticmethod
+    def _run(job):
+        # pylint: disable=broad-except
+        try:
+            start_operation(
+                job.compiler_config, job.transfer_config,
+                stdout=job, root=job.root, cancel_event=job.cancel_event
+            )
+        except CompilerError as error:
+            job.set_state(
+                JobStates.CANCELED
+                if error.exit_code == ExitCodes.CANCELED else JobStates.FAILED,
+                error.exit_code.value
+            )
+        except Exception as error:
+            Colored.error(error)
+            job.set_state(JobStates.FAILED, ExitCodes.UNKNOWN.value)
+        else:
+            job.set_state(JobStates.SUCCEEDED, ExitCodes.SUCCESS.value)
+        finally:
+            Colored.file = sys.stdout
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    "Serves the requests of a connection"
+
+    def _send(self, message):
+        self.wfile.write((json.dumps(message) + '\n').encode(ENCODING))
+        self.wfile.flush()
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line.decode(ENCODING))
+                command = request["command"]
+                handler = getattr(self, "_handle_" + command)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                self._send({"error": "Invalid request: {0!r}".format(line)})
+                continue
+
+            if not hmac.compare_digest(
+                    str(request.get("token", "")), self.server.token):
+                self._send({"error": "Unauthorized request"})
+                return
+
+            try:
+                handler(request)
+            except (DaemonError, KeyError, TypeError, ValueError) as error:
+                self._send({"error": str(error)})
+            except OSError:
+                # The client has gone
+                return
+
+    def _handle_submit(self, request):
+        job = self.server.build_daemon.submit(
+            CompilerConfig.from_dict(request["compiler"]),
+            TransferConfig.from_dict(request["transfer"]),
+            request["root"],
+            request.get("submitter")
+        )
+        response = job.to_dict()
+        response["position"] = self.server.build_daemon.get_position(job)
+        self._send(response)
+
+        if request.get("attach"):
+            self._stream(job, 0)
+
+    def _handle_status(self, _):
+        jobs = self.server.build_daemon.get_jobs()
+        self._send({"jobs": [job.to_dict() for job in jobs]})
+
+    def _handle_attach(self, request):
+        job = self.server.build_daemon.get_job(request["job"])
+        if job.expired:
+            raise DaemonError(
+                "Output of job {0} has expired".format(job.job_id)
+            )
+        self._stream(job, request.get("from", 0))
+
+    def _handle_cancel(self, request):
+        self._send({
+            "job": request["job"],
+            "canceled": self.server.build_daemon.cancel(request["job"])
+        })
+
+    def _handle_shutdown(self, _):
+        self._send({"shutdown": True})
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def _stream(self, job, index):
+        finished = False
+        while not finished:
+            chunks, index, finished = job.read(index, timeout=1)
+            if chunks:
+                self._send({"output": ''.join(chunks), "next": index})
+        self._send(job.to_dict())
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, daemon, token):
+        super().__init__(address, _RequestHandler)
+        self.build_daemon = daemon
+        self.token = token
+
+
+def serve(port=DAEMON_PORT):
+    "runs the daemon until a shutdown request comes"
+    token_file = get_token_file(port)
+    try:
+        with _Server((DAEMON_HOST, port), BuildDaemon(),
+                     write_token(token_file)) as server:
+            print("Build daemon is listening on {0}:{1}".format(
+                DAEMON_HOST, port
+            ))
+            server.serve_forever()
+    finally:
+        try:
+            os.unlink(token_file)
+        except OSError:
+            pass
+
+
+class DaemonClient:
+    "Talks to the build daemon"
+
+    def __init__(self, port=DAEMON_PORT, timeout=5, token_file=None):
+        self.port = port
+        self.timeout = timeout
+        self.token_file = token_file or get_token_file(port)
+
+    def _connect(self):
+        try:
+            connection = socket.create_connection(
+                (DAEMON_HOST, self.port), timeout=self.timeout
+            )
+        except OSError as error:
+            raise DaemonError(
+                "Build daemon is not running on port {0}: {1}".format(
+                    self.port, error
+                )
+            )
+        return connection
+
+    def _request(self, request):
+        "sends the request, yields the responses until the connection closes"
+        # The daemon writes a new token when it restarts
+        request = dict(request, token=read_token(self.token_file))
+        with self._connect() as connection:
+            connection.sendall((json.dumps(request) + '\n').encode(ENCODING))
+            connection.shutdown(socket.SHUT_WR)
+            # Attached builds may be silent for a long time
+            connection.settimeout(None)
+            with connection.makefile('rb') as responses:
+                for line in responses:
+                    response = json.loads(line.decode(ENCODING))
+                    if "error" in response:
+                        raise DaemonError(response["error"])
+                    yield response
+
+    def is_running(self):
+        "returns True if the daemon accepts the connections"
+        try:
+            self._connect().close()
+        except DaemonError:
+            return False
+        return True
+
+    def submit(self, compiler_config, transfer_config, root, attach=False):
+        """Submits a job, returns its summary. If attach is True, yields
+        the summary, the output chunks and the final summary instead."""
+        responses = self._request({
+            "command": "submit",
+            "compiler": compiler_config.to_dict(),
+            "transfer": transfer_config.to_dict(),
+            "root": os.path.abspath(root),
+            "submitter": "{0}@{1}".format(
+                os.environ.get("USERNAME", os.environ.get("USER", "")),
+                os.getpid()
+            ),
+            "attach": attach,
+        })
+        if attach:
+            return responses
+        return next(responses)
+
+    def status(self):
+        "returns the summaries of the jobs"
+        return next(self._request({"command": "status"}))["jobs"]
+
+    def attach(self, job_id, start=0):
+        "yields the output chunks and the final summary of given job"
+        return self._request({"command": "attach", "job": job_id, "from": start})
+
+    def cancel(self, job_id):
+        "cancels given job, stops it if it is running"
+        return next(self._request({"command": "cancel", "job": job_id}))
+
+    def shutdown(self):
+        "stops the daemon"
+        return next(self._request({"command": "shutdown"}))
+
+
+def follow(responses, file=sys.stdout):
+    "writes the streamed output to given file, returns the exit code"
+    summary = {}
+    for response in responses:
+        if "output" in response:
+            file.write(response["output"])
+            file.flush()
+        else:
+            summary = response
+
+    if summary.get("state") not in JobStates.FINISHED:
+        return ExitCodes.UNKNOWN.value
+    return summary["exit_code"]
+
+
+def main(argv=None):
+    "starts from here, returns the exit code"
+    parser = argparse.ArgumentParser(description="The build daemon.")
+    parser.add_argument("--port", type=int, default=DAEMON_PORT)
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("serve", help="runs the daemon")
+    subparsers.add_parser("status", help="lists the jobs")
+    attach_parser = subparsers.add_parser(
+        "attach", help="follows the output of a job"
+    )
+    attach_parser.add_argument("job", type=int)
+    cancel_parser = subparsers.add_parser(
+        "cancel", help="cancels a queued or a running job"
+    )
+    cancel_parser.add_argument("job", type=int)
+    subparsers.add_parser("shutdown", help="stops the daemon")
+    args = parser.parse_args(argv)
+
+    if args.command in (None, "serve"):
+        serve(args.port)
+        return ExitCodes.SUCCESS.value
+
+    client = DaemonClient(args.port)
+    try:
+        if args.command == "status":
+            for job in client.status():
+                print("{job:>4} {state:<10} {target_type:<4} "
+                      "{compile_type:<21} {root}{0}".format(
+                          " (output expired)" if job.get("expired") else "",
+                          **job
+                      ))
+        elif args.command == "attach":
+            return follow(client.attach(args.job))
+        elif args.command == "cancel":
+            if not client.cancel(args.job)["canceled"]:
+                print("Job {0} has finished already.".format(args.job))
+                return ExitCodes.UNKNOWN.value
+        else:
+            client.shutdown()
+    except DaemonError as error:
+        print(error, file=sys.stderr)
+        return ExitCodes.UNKNOWN.value
+
+    return ExitCodes.SUCCESS.value
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Extracts the compiler diagnostics from the build output while it streams.
+
+Lines are first checked with a cheap substring test, the patterns run
+only for the lines that may contain a diagnostic. So, the extraction
+keeps up with the full speed output of the build.
+"""
+import re
+import enum
+import threading
+import collections
+
+MAX_DIAGNOSTICS = 10000
+
+# The task prefix of ant, e.g., "     [cc] "
+_TASK_PREFIX = r'^\s*(?:\[[\w.-]+\]\s*)?'
+_SEVERITY = r'(?P<severity>fatal error|error|warning)'
+
+PATTERNS = (
+    # MSVC like: file.c(12) : error C2065: message
+    re.compile(
+        _TASK_PREFIX +
+        r'(?P<file>[^\s"(][^"(]*?)\((?P<line>\d+)(?:,\d+)?\)\s*:\s*' +
+        _SEVERITY + r'(?:\s+(?P<code>\w+))?\s*:\s*(?P<message>.*)$',
+        re.IGNORECASE
+    ),
+    # GCC like: file.c:12:5: error: message
+    re.compile(
+        _TASK_PREFIX +
+        r'(?P<file>(?:[A-Za-z]:)?[^:"\s][^:"]*?):(?P<line>\d+):(?:\d+:)?\s*' +
+        _SEVERITY + r'(?:\s*\((?P<code>[^)]*)\))?\s*:\s*(?P<message>.*)$',
+        re.IGNORECASE
+    ),
+    # Diab like: "file.c", line 12: error (dcc:1525): message
+    re.compile(
+        _TASK_PREFIX +
+        r'"(?P<file>[^"]+)",\s*line\s+(?P<line>\d+)(?:\.\d+)?\s*:\s*' +
+        _SEVERITY + r'(?:\s*\((?P<code>[^)]*)\))?\s*:?\s*(?P<message>.*)$',
+        re.IGNORECASE
+    ),
+)
+COMPILE_HEADER = re.compile(
+    r'Compiling fileset "(?P<fileset>.*)" in "(?P<directory>.*)" for ".*"'
+)
+
+
+class Severity(enum.Enum):
+    "Severity of a diagnostic"
+    ERROR = "error"
+    WARNING = "warning"
+
+    @classmethod
+    def from_text(cls, text):
+        "returns the severity for given compiler text"
+        if "error" in text.lower():
+            return cls.ERROR
+        return cls.WARNING
+
+
+Diagnostic = collections.namedtuple(
+    "Diagnostic", ("file", "line", "severity", "message", "component")
+)
+
+
+def _may_contain_diagnostic(line):
+    "a cheap check before the patterns run"
+    return "rror" in line or "RROR" in line \
+        or "arning" in line or "ARNING" in line
+
+
+def parse_line(line, component=None):
+    "returns the diagnostic in given line, None if there is not"
+    if not _may_contain_diagnostic(line):
+        return None
+
+    for pattern in PATTERNS:
+        match = pattern.match(line)
+        if match:
+            return Diagnostic(
+                file=match.group("file").strip(),
+                line=int(match.group("line")),
+                severity=Severity.from_text(match.group("severity")),
+                message=match.group("message").strip(),
+                component=component,
+            )
+
+    return None
+
+
+class DiagnosticIndex:
+    "Keeps the diagnostics of a build, can be fed line by line"
+
+    def __init__(self, component=None, max_diagnostics=MAX_DIAGNOSTICS):
+        self.component = component
+        self._current_component = component
+        self.max_diagnostics = max_diagnostics
+        self.dropped = 0
+        self._diagnostics = []
+        self._seen = set()
+        self._lock = threading.Lock()
+
+    def feed(self, line):
+        "processes the next line of the output, returns the diagnostic if any"
+        if "Compiling fileset" in line:
+            # On full builds, the fileset is the component
+            match = COMPILE_HEADER.search(line)
+            if match and self.component is None:
+                self._current_component = match.group("fileset")
+            return None
+
+        diagnostic = parse_line(line, self._current_component)
+        if diagnostic is not None:
+            self.add(diagnostic)
+
+        return diagnostic
+
+    def add(self, diagnostic):
+        "adds given diagnostic if it is not added before"
+        key = diagnostic[:4]
+        with self._lock:
+            if key in self._seen:
+                return
+            if len(self._diagnostics) >= self.max_diagnostics:
+                self.dropped += 1
+                return
+            self._seen.add(key)
+            self._diagnostics.append(diagnostic)
+
+    def merge(self, other):
+        "adds the diagnostics of given index"
+        for diagnostic in other:
+            self.add(diagnostic)
+        self.dropped += other.dropped
+
+    def query(self, *, severity=None, component=None, file=None):
+        "returns the diagnostics matching given filters, in order"
+        with self._lock:
+            diagnostics = list(self._diagnostics)
+
+        return [
+            diagnostic for diagnostic in diagnostics
+            if (severity is None or diagnostic.severity is severity)
+            and (component is None or diagnostic.component == component)
+            and (file is None or diagnostic.file == file)
+        ]
+
+    def errors(self):
+        "returns the errors"
+        return self.query(severity=Severity.ERROR)
+
+    def warnings(self):
+        "returns the warnings"
+        return self.query(severity=Severity.WARNING)
+
+    def first_error(self):
+        "returns the first error, None if there is not"
+        errors = self.errors()
+        return errors[0] if errors else None
+
+    def by_component(self):
+        "returns the diagnostics grouped by the component"
+        groups = collections.OrderedDict()
+        for diagnostic in self:
+            groups.setdefault(diagnostic.component, []).append(diagnostic)
+        return groups
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._diagnostics))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._diagnostics)
+
+
+def format_diagnostic(diagnostic):
+    "returns the diagnostic as a single line"
+    text = "{0}({1}): {2}: {3}".format(
+        diagnostic.file, diagnostic.line,
+        diagnostic.severity.value, diagnostic.message
+    )
+    if diagnostic.component:
+        text = "[{0}] {1}".format(diagnostic.component, text)
+    return text
@@ -0,0 +1,181 @@
+"""
+The cached environment of the toolchain.
+
+The compiler script sets up the environment of the toolchain, e.g., the
+PATH and the compiler variables, on every call, then runs the build. When
+the setup script and the build command are configured, the environment
+is captured once by running only the setup, and kept on disk. The builds
+then run the build command directly with it.
+
+A snapshot is keyed by the hashes of the compiler script and the setup
+script. It is captured again if they change, or if the build program
+which it resolves to is replaced, e.g., by a toolchain update.
+"""
+import os
+import sys
+import json
+import time
+import shlex
+import shutil
+import hashlib
+import threading
+import subprocess
+
+from compiler_config import CONFIGURATIONS
+from compiler_process import check_output, COMMAND_TIMEOUT
+
+ENVIRONMENT_FILE = os.path.join(
+    os.path.expanduser("~"),
+    ".compiler_environment"
+)
+# The script next to the compiler script which only sets up the environment
+ENVIRONMENT_SCRIPT = CONFIGURATIONS.get("environment_script", None)
+# The build which the compiler script runs after the setup, e.g., "ant"
+BUILD_COMMAND = CONFIGURATIONS.get("build_command", None)
+_DUMP = "import os, json; print(json.dumps(dict(os.environ)))"
+
+
+class SnapshotError(Exception):
+    "raises when the environment cannot be captured"
+
+
+def _hash_files(paths):
+    "returns the hash of the content of given files, missing ones included"
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.normcase(path).encode() + b"\0")
+        try:
+            with open(path, 'rb') as file:
+                digest.update(hashlib.sha256(file.read()).digest())
+        except FileNotFoundError:
+            digest.update(b"missing")
+    return digest.hexdigest()
+
+
+def _get_stamp(path):
+    "returns the size and the modification time of given file"
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Snapshot:
+    "The environment of the toolchain and the build program it resolves to"
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, key, variables, program):
+        self.key = key
+        self.variables = variables
+        self.program = program
+
+    def get_command(self, compile_string):
+        "returns the argv of the build with given arguments"
+        return [self.program] + BUILD_COMMAND.split()[1:] + \
+            compile_string.split()
+
+
+class EnvironmentCache:
+    "The captured environments, keyed by the hashes of the scripts"
+
+    def __init__(self, filename=ENVIRONMENT_FILE):
+        self._filename = filename
+        self._lock = threading.Lock()
+        self._entries = self._read()
+
+    def _read(self):
+        try:
+            with open(self._filename) as environment_file:
+                entries = json.loads(environment_file.read())
+        except (FileNotFoundError, json.JSONDecodeError, OSError):
+            return {}
+
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def save(self):
+        "writes the snapshots to the file"
+        with self._lock:
+            content = json.dumps(self._entries)
+
+        temp_file = "{0}.{1}.tmp".format(self._filename, os.getpid())
+        with open(temp_file, 'w') as environment_file:
+            environment_file.write(content)
+        os.replace(temp_file, self._filename)
+
+    def lookup(self, key):
+        """returns the snapshot of given key, None if it is not cached or
+        its build program is replaced"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or _get_stamp(entry["program"]) != entry["stamp"]:
+            return None
+        return Snapshot(key, entry["variables"], entry["program"])
+
+    def store(self, snapshot):
+        "keeps given snapshot"
+        with self._lock:
+            self._entries[snapshot.key] = {
+                "variables": snapshot.variables,
+                "program": snapshot.program,
+                "stamp": _get_stamp(snapshot.program),
+                "created": time.time(),
+            }
+
+
+def capture(script, cwd, timeout=COMMAND_TIMEOUT):
+    "runs given setup script, returns the environment that it leaves"
+    if os.name == "nt":
+        command = 'call "{0}" > NUL && {1}'.format(
+            script, subprocess.list2cmdline([sys.executable, "-c", _DUMP])
+        )
+    else:
+        command = '. {0} > /dev/null && {1}'.format(
+            shlex.quote(script),
+            ' '.join(shlex.quote(arg) for arg in (sys.executable, "-c", _DUMP))
+        )
+
+    try:
+        output = check_output(command, cwd=cwd, timeout=timeout)
+    except (subprocess.SubprocessError, OSError) as error:
+        raise SnapshotError(
+            "Environment of {0} cannot be captured: {1}".format(script, error)
+        )
+    try:
+        return json.loads(output.strip().splitlines()[-1])
+    except (ValueError, IndexError) as error:
+        raise SnapshotError(
+            "Environment of {0} cannot be read: {1}".format(script, error)
+        )
+
+
+def get_snapshot(compiler_dir, compiler_name, cache=None):
+    """Returns the environment snapshot of the toolchain in given directory,
+    captures and caches it if needed. None if it is not configured."""
+    if not ENVIRONMENT_SCRIPT or not BUILD_COMMAND:
+        return None
+
+    script = os.path.join(compiler_dir, ENVIRONMENT_SCRIPT)
+    if not os.path.isfile(script):
+        raise SnapshotError("No such file: {0}".format(script))
+    key = _hash_files([os.path.join(compiler_dir, compiler_name), script])
+
+    cache = EnvironmentCache() if cache is None else cache
+    snapshot = cache.lookup(key)
+    if snapshot is not None:
+        return snapshot
+
+    variables = capture(script, compiler_dir)
+    program = shutil.which(
+        BUILD_COMMAND.split()[0], path=variables.get("PATH")
+    )
+    if program is None:
+        raise SnapshotError("{0} is not found in the environment of "
+                            "{1}".format(BUILD_COMMAND.split()[0], script))
+
+    snapshot = Snapshot(key, variables, program)
+    cache.store(snapshot)
+    cache.save()
+    return snapshot
@@ -0,0 +1,476 @@
+"""
+Git helpers which work in process, without spawning git.
+"""
+import os
+import re
+import glob
+import struct
+import hashlib
+import threading
+import collections
+
+INDEX_SIGNATURE = b"DIRC"
+_ENTRY_HEADER = struct.Struct(">10I")
+_EXTENDED_FLAG = 0x4000
+_MODE_SYMLINK = 0o120000
+_MODE_GITLINK = 0o160000
+IGNORE_FILE = ".gitignore"
+_CHUNK_SIZE = 1024 * 1024
+
+
+class GitError(Exception):
+    "raises when the git repository cannot be read"
+
+
+def find_git_dir(path):
+    """Returns the work tree and the git directory of given path.
+    Submodules and worktrees, whose .git is a file, are supported."""
+    directory = os.path.abspath(path)
+    if not os.path.isdir(directory):
+        directory = os.path.dirname(directory)
+
+    while True:
+        dot_git = os.path.join(directory, ".git")
+        if os.path.isdir(dot_git):
+            return directory, dot_git
+        if os.path.isfile(dot_git):
+            with open(dot_git) as git_file:
+                content = git_file.read().strip()
+            if not content.startswith("gitdir:"):
+                raise GitError("Invalid .git file: {0}".format(dot_git))
+            git_dir = content[len("gitdir:"):].strip()
+            return directory, os.path.normpath(
+                os.path.join(directory, git_dir)
+            )
+
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            raise GitError("Not a git repository: {0}".format(path))
+        directory = parent
+
+
+def _get_common_dir(git_dir):
+    "worktrees share the config of the main repository"
+    try:
+        with open(os.path.join(git_dir, "commondir")) as common_file:
+            return os.path.normpath(
+                os.path.join(git_dir, common_file.read().strip())
+            )
+    except FileNotFoundError:
+        return git_dir
+
+
+def get_hash_algorithm(git_dir):
+    "returns the name of the object hash of the repository"
+    try:
+        with open(os.path.join(_get_common_dir(git_dir), "config")) as config:
+            for line in config:
+                key, _, value = line.partition("=")
+                if key.strip().lower() == "objectformat":
+                    return value.strip().lower()
+    except FileNotFoundError:
+        pass
+    return "sha1"
+
+
+def _read_varint(data, offset):
+    "reads the offset encoded integer of index v4"
+    byte = data[offset]
+    offset += 1
+    value = byte & 0x7F
+    while byte & 0x80:
+        byte = data[offset]
+        offset += 1
+        value = ((value + 1) << 7) | (byte & 0x7F)
+    return value, offset
+
+
+IndexEntry = collections.namedtuple(
+    "IndexEntry", ("name", "object_id", "mode", "mtime_ns", "size")
+)
+
+
+def iter_index(git_dir):
+    """Yields the entries of the index, names are relative to the work
+    tree and separated by slashes. Nothing is yielded without an index."""
+    try:
+        with open(os.path.join(git_dir, "index"), 'rb') as index_file:
+            data = index_file.read()
+    except FileNotFoundError:
+        return
+
+    if data[:4] != INDEX_SIGNATURE:
+        raise GitError("Invalid index file in {0}".format(git_dir))
+
+    version, count = struct.unpack(">II", data[4:12])
+    if version not in (2, 3, 4):
+        raise GitError("Unsupported index version: {0}".format(version))
+
+    hash_size = 32 if get_hash_algorithm(git_dir) == "sha256" else 20
+    previous_name = b''
+    offset = 12
+
+    for _ in range(count):
+        entry_start = offset
+        header = _ENTRY_HEADER.unpack_from(data, offset)
+        offset += _ENTRY_HEADER.size
+        object_id = data[offset:offset + hash_size]
+        offset += hash_size
+        flags, = struct.unpack(">H", data[offset:offset + 2])
+        offset += 2
+        if version >= 3 and flags & _EXTENDED_FLAG:
+            offset += 2
+
+        if version == 4:
+            strip, offset = _read_varint(data, offset)
+            end = data.index(b'\0', offset)
+            entry_name = previous_name[:len(previous_name) - strip] + \
+                data[offset:end]
+            offset = end + 1
+            previous_name = entry_name
+        else:
+            end = data.index(b'\0', offset)
+            entry_name = data[offset:end]
+            # Entries are padded with NULs to a multiple of eight bytes
+            entry_length = end - entry_start + 1
+            offset = entry_start + ((entry_length + 7) // 8) * 8
+
+        yield IndexEntry(
+            name=entry_name.decode(errors="surrogateescape"),
+            object_id=object_id.hex(),
+            mode=header[6],
+            mtime_ns=header[2] * 10 ** 9 + header[3],
+            size=header[9],
+        )
+
+
+def find_index_entry(git_dir, name):
+    """Returns the object id of given path in the index, None if it is not
+    tracked. name is relative to the work tree, separated by slashes."""
+    for entry in iter_index(git_dir):
+        if entry.name == name:
+            # Only stage 0 is compared, conflicts are not expected here
+            return entry.object_id
+
+    return None
+
+
+def hash_blob(content, algorithm="sha1"):
+    "returns the object id of given content as git does"
+    digest = hashlib.new(algorithm)
+    digest.update(b"blob %d\0" % len(content))
+    digest.update(content)
+    return digest.hexdigest()
+
+
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def is_modified(path):
+    """Returns True if given file differs from its blob in the git index,
+    same as 'git diff <path>' produces an output. Results are cached by
+    the modification time and the size of the file and the index."""
+    path = os.path.abspath(path)
+    work_tree, git_dir = find_git_dir(path)
+
+    try:
+        stat = os.stat(path)
+        index_stat = os.stat(os.path.join(git_dir, "index"))
+    except FileNotFoundError as error:
+        raise GitError(error)
+
+    key = (
+        path, stat.st_mtime_ns, stat.st_size,
+        index_stat.st_mtime_ns, index_stat.st_size
+    )
+    with _CACHE_LOCK:
+        cached_key, modified = _CACHE.get(path, (None, None))
+    if cached_key == key:
+        return modified
+
+    name = os.path.relpath(path, work_tree).replace(os.sep, '/')
+    object_id = find_index_entry(git_dir, name)
+    if object_id is None:
+        # Untracked files have no diff
+        modified = False
+    else:
+        with open(path, 'rb') as file:
+            content = file.read()
+        algorithm = get_hash_algorithm(git_dir)
+        modified = hash_blob(content, algorithm) != object_id
+        if modified and b"\r\n" in content:
+            # core.autocrlf converts the line endings when staging
+            modified = hash_blob(
+                content.replace(b"\r\n", b"\n"), algorithm
+            ) != object_id
+
+    with _CACHE_LOCK:
+        _CACHE[path] = (key, modified)
+    return modified
+
+
+def _read_ref(git_dir, ref):
+    "returns the object id of given ref, None if it does not exist"
+    common_dir = _get_common_dir(git_dir)
+    for directory in (git_dir, common_dir):
+        try:
+            with open(os.path.join(directory, *ref.split('/'))) as ref_file:
+                return ref_file.read().strip()
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+
+    try:
+        with open(os.path.join(common_dir, "packed-refs")) as packed_refs:
+            for line in packed_refs:
+                if line.startswith(('#', '^')):
+                    continue
+                object_id, _, name = line.strip().partition(' ')
+                if name == ref:
+                    return object_id
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def get_head(git_dir):
+    "returns the object id of the checked out commit, None if there is not"
+    with open(os.path.join(git_dir, "HEAD")) as head_file:
+        head = head_file.read().strip()
+
+    # Symbolic refs may point to the other refs
+    for _ in range(5):
+        if not head.startswith("ref:"):
+            return head
+        head = _read_ref(git_dir, head[len("ref:"):].strip())
+        if head is None:
+            return None
+    raise GitError("Too deep symbolic refs in {0}".format(git_dir))
+
+
+def _is_same_mtime(mtime_ns, index_mtime_ns):
+    "some git builds store the modification time in seconds"
+    if index_mtime_ns % 10 ** 9:
+        return mtime_ns == index_mtime_ns
+    return mtime_ns // 10 ** 9 == index_mtime_ns // 10 ** 9
+
+
+def _is_stat_clean(stat, entry, index_mtime_ns):
+    "files changed right after the staging are not trusted, as git does"
+    return stat.st_size == entry.size \
+        and _is_same_mtime(stat.st_mtime_ns, entry.mtime_ns) \
+        and stat.st_mtime_ns < index_mtime_ns
+
+
+def _get_index_mtime_ns(git_dir):
+    try:
+        return os.stat(os.path.join(git_dir, "index")).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+
+def iter_modified_entries(path):
+    """Yields the index entries whose files may differ from the index,
+    i.e., their size or modification time do not match, or are deleted.
+    The content is not compared, gitlinks are not yielded."""
+    work_tree, git_dir = find_git_dir(path)
+    index_mtime_ns = _get_index_mtime_ns(git_dir)
+
+    for entry in iter_index(git_dir):
+        if entry.mode == _MODE_GITLINK:
+            continue
+        try:
+            stat = os.lstat(os.path.join(work_tree, *entry.name.split('/')))
+        except OSError:
+            yield entry
+            continue
+        if not _is_stat_clean(stat, entry, index_mtime_ns):
+            yield entry
+
+
+def find_repositories(root):
+    "returns the git repositories of the root and its direct children"
+    repositories = []
+    for path in [root] + sorted(glob.glob(os.path.join(root, '*', ''))):
+        path = os.path.normpath(path)
+        if os.path.exists(os.path.join(path, ".git")):
+            repositories.append(path)
+    return repositories
+
+
+def _translate_pattern(pattern):
+    "returns the regular expression of given ignore pattern"
+    expression = ''
+    index = 0
+    while index < len(pattern):
+        if pattern.startswith("**/", index):
+            expression += "(?:.*/)?"
+            index += 3
+        elif pattern.startswith("/**", index) and index + 3 == len(pattern):
+            expression += "/.*"
+            index += 3
+        elif pattern[index] == '*':
+            expression += "[^/]*"
+            index += 1
+        elif pattern[index] == '?':
+            expression += "[^/]"
+            index += 1
+        elif pattern[index] == '[' and ']' in pattern[index + 2:]:
+            end = pattern.index(']', index + 2)
+            expression += "[{0}]".format(
+                pattern[index + 1:end].replace('!', '^', 1)
+                if pattern[index + 1] == '!' else pattern[index + 1:end]
+            )
+            index = end + 1
+        else:
+            if pattern[index] == '\\' and index + 1 < len(pattern):
+                index += 1
+            expression += re.escape(pattern[index])
+            index += 1
+    return re.compile(expression + r'\Z', re.DOTALL)
+
+
+class IgnoreRules:
+    """The patterns of the ignore files, .gitignore of each directory and
+    info/exclude of the repository. The global excludes file is not read."""
+
+    def __init__(self):
+        self._rules = []
+
+    def add_file(self, path, base=''):
+        """reads the patterns of given file, they are relative to base, the
+        directory of the file in the work tree"""
+        try:
+            with open(path, encoding="utf-8", errors="surrogateescape") \
+                    as ignore_file:
+                lines = ignore_file.read().splitlines()
+        except OSError:
+            return
+
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negated = line.startswith('!')
+            if negated:
+                line = line[1:]
+            directory_only = line.endswith('/')
+            line = line.rstrip('/')
+            if not line:
+                continue
+            anchored = '/' in line
+            self._rules.append((
+                base, _translate_pattern(line.lstrip('/')),
+                negated, directory_only, anchored
+            ))
+
+    def is_ignored(self, name, is_directory):
+        "returns True if given path of the work tree is ignored"
+        ignored = False
+        for base, expression, negated, directory_only, anchored in \
+                self._rules:
+            if base and not name.startswith(base + '/'):
+                continue
+            if directory_only and not is_directory:
+                continue
+            relative = name[len(base) + 1:] if base else name
+            if not anchored:
+                relative = relative.rsplit('/', 1)[-1]
+            if expression.match(relative):
+                ignored = not negated
+        return ignored
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_untracked_files(path, excluded=()):
+    """Yields the names of the files in the work tree of given path which
+    are neither in the index nor ignored. The nested repositories are
+    not walked, they are repositories of their own. The files in excluded,
+    absolute paths, and the ones named after them, e.g., the backups of a
+    log file, are not yielded either."""
+    excluded = [
+        os.path.normcase(os.path.abspath(file_path)) for file_path in excluded
+    ]
+    work_tree, git_dir = find_git_dir(path)
+    tracked = {entry.name for entry in iter_index(git_dir)}
+    rules = IgnoreRules()
+    rules.add_file(os.path.join(_get_common_dir(git_dir), "info", "exclude"))
+
+    for directory, directories, filenames in os.walk(work_tree):
+        base = os.path.relpath(directory, work_tree).replace(os.sep, '/')
+        base = '' if base == os.curdir else base
+        prefix = base + '/' if base else ''
+        rules.add_file(os.path.join(directory, IGNORE_FILE), base)
+
+        directories[:] = sorted(
+            name for name in directories
+            if name != ".git"
+            and not os.path.exists(os.path.join(directory, name, ".git"))
+            and not rules.is_ignored(prefix + name, True)
+        )
+        for filename in sorted(filenames):
+            name = prefix + filename
+            full_path = os.path.normcase(os.path.join(directory, filename))
+            if name not in tracked and not rules.is_ignored(name, False) \
+                    and not any(
+                        full_path == file_path
+                        or full_path.startswith(file_path + '.')
+                        for file_path in excluded
+                    ):
+                yield name
+
+
+def get_worktree_digest(path, excluded=()):
+    """Returns a digest of the files in the work tree of given path.
+    Tracked files whose size and modification time match the index are
+    taken from the index, the others are hashed. So are the untracked
+    files which are not ignored, the builds compile them too, except the
+    ones in excluded, see iter_untracked_files."""
+    work_tree, git_dir = find_git_dir(path)
+    algorithm = get_hash_algorithm(git_dir)
+    modified = {entry.name for entry in iter_modified_entries(path)}
+
+    digest = hashlib.sha256()
+    for entry in iter_index(git_dir):
+        file_path = os.path.join(work_tree, *entry.name.split('/'))
+        object_id = entry.object_id
+
+        if entry.mode == _MODE_GITLINK:
+            try:
+                object_id = get_head(find_git_dir(file_path)[1]) or object_id
+            except (GitError, OSError):
+                pass
+        elif entry.name in modified:
+            try:
+                if entry.mode == _MODE_SYMLINK:
+                    content = os.readlink(file_path).encode()
+                else:
+                    with open(file_path, 'rb') as file:
+                        content = file.read()
+            except OSError:
+                object_id = "deleted"
+            else:
+                object_id = hash_blob(content, algorithm)
+
+        digest.update("{0}\0{1}\n".format(
+            entry.name, object_id
+        ).encode(errors="surrogateescape"))
+
+    for name in iter_untracked_files(path, excluded):
+        try:
+            file_hash = _hash_file(os.path.join(work_tree, *name.split('/')))
+        except OSError:
+            # Removed while walking
+            continue
+        digest.update("untracked\0{0}\0{1}\n".format(
+            name, file_hash
+        ).encode(errors="surrogateescape"))
+
+    return digest.hexdigest()
@@ -0,0 +1,175 @@
+"""
+Picks the parallelism of the builds.
+
+The job count is limited by the idle cores and the available memory of
+the machine at the start of each build. A few job counts, derived from
+the number of the cores, are tried below that limit. Their wall-clock
+times per compiled fileset are recorded in the build history, then the
+fastest one is used. So, every machine converges on its own best setting,
+and follows it when the load changes.
+"""
+import os
+import time
+
+from compiler_config import CONFIGURATIONS
+
+MEMORY_PER_JOB = CONFIGURATIONS.get("memory_per_job", 1536 * 1024 ** 2)
+# The property of antmake which takes the job count
+BUILD_JOBS_PROPERTY = CONFIGURATIONS.get(
+    "build_jobs_property", "build.threads"
+)
+# Each job count is tried this many times before the best one is chosen
+TRIALS = CONFIGURATIONS.get("parallelism_trials", 2)
+_LOAD_INTERVAL = 0.25
+
+
+def get_cpu_count():
+    "returns the number of the logical cores"
+    return os.cpu_count() or 1
+
+
+def _get_windows_memory():
+    # pylint: disable=import-outside-toplevel,too-few-public-methods
+    import ctypes
+
+    class MEMORYSTATUSEX(ctypes.Structure):
+        "The memory status of the system"
+        _fields_ = [
+            ("dwLength", ctypes.c_ulong),
+            ("dwMemoryLoad", ctypes.c_ulong),
+            ("ullTotalPhys", ctypes.c_ulonglong),
+            ("ullAvailPhys", ctypes.c_ulonglong),
+            ("ullTotalPageFile", ctypes.c_ulonglong),
+            ("ullAvailPageFile", ctypes.c_ulonglong),
+            ("ullTotalVirtual", ctypes.c_ulonglong),
+            ("ullAvailVirtual", ctypes.c_ulonglong),
+            ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+        ]
+
+    status = MEMORYSTATUSEX()
+    status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+    if not ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+        return None
+    return status.ullAvailPhys
+
+
+def get_free_memory():
+    "returns the available memory in bytes, None if it is unknown"
+    if os.name == "nt":
+        return _get_windows_memory()
+
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _get_windows_load(interval):
+    "returns the number of the busy cores, sampled over given interval"
+    # pylint: disable=import-outside-toplevel
+    import ctypes
+
+    def sample():
+        idle, kernel, user = (ctypes.c_ulonglong() for _ in range(3))
+        ctypes.windll.kernel32.GetSystemTimes(
+            ctypes.byref(idle), ctypes.byref(kernel), ctypes.byref(user)
+        )
+        # The kernel time includes the idle time
+        return idle.value, kernel.value + user.value
+
+    idle_before, total_before = sample()
+    time.sleep(interval)
+    idle_after, total_after = sample()
+
+    total = total_after - total_before
+    if total <= 0:
+        return 0.0
+    busy = 1 - (idle_after - idle_before) / total
+    return busy * get_cpu_count()
+
+
+def get_load(interval=_LOAD_INTERVAL):
+    "returns the number of the busy cores, None if it is unknown"
+    if os.name == "nt":
+        try:
+            return _get_windows_load(interval)
+        except (AttributeError, OSError):
+            return None
+    try:
+        return os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+def get_job_limit(memory_per_job=MEMORY_PER_JOB):
+    "returns the number of the jobs that the machine can run now"
+    cpu_count = get_cpu_count()
+    limit = cpu_count
+
+    load = get_load()
+    if load is not None:
+        limit = min(limit, cpu_count - int(round(load)))
+
+    free_memory = get_free_memory()
+    if free_memory is not None and memory_per_job:
+        limit = min(limit, int(free_memory // memory_per_job))
+
+    return max(limit, 1)
+
+
+class Governor:
+    "Chooses the job count of a build from the resources and the history"
+
+    def __init__(self, history=None, memory_per_job=MEMORY_PER_JOB,
+                 trials=TRIALS):
+        self.history = history
+        self.memory_per_job = memory_per_job
+        self.trials = trials
+
+    @staticmethod
+    def get_candidates(cpu_count=None):
+        """returns the job counts worth trying, they do not depend on the
+        load, so their samples are comparable"""
+        cpu_count = cpu_count or get_cpu_count()
+        return sorted({
+            cpu_count, max(cpu_count * 3 // 4, 1), max(cpu_count // 2, 1)
+        }, reverse=True)
+
+    def choose(self, target_type, compile_type, workers=1, explore=True):
+        """Returns the job count of each build, the resources are shared
+        by given number of the builds which run at the same time.
+        The untried job counts are chosen only if explore is True,
+        i.e., the duration of the build will be recorded."""
+        limit = max(get_job_limit(self.memory_per_job) // max(workers, 1), 1)
+        if self.history is None or workers > 1:
+            # The durations of the concurrent builds are not comparable
+            return limit
+
+        candidates = [jobs for jobs in self.get_candidates() if jobs <= limit]
+        if not candidates:
+            # The machine is too busy for any of them
+            return limit
+
+        estimates = self.history.get_parallelism(target_type, compile_type)
+        if explore:
+            for jobs in candidates:
+                if jobs not in estimates \
+                        or estimates[jobs].samples < self.trials:
+                    return jobs
+
+        known = [jobs for jobs in candidates if jobs in estimates]
+        if not known:
+            return limit
+        return min(known, key=lambda jobs: estimates[jobs].duration)
+
+    def record(self, target_type, compile_type, jobs, duration, filesets):
+        """stores the wall-clock time of a successful build, the ones which
+        have not compiled any filesets tell nothing"""
+        if self.history is not None and filesets:
+            self.history.record_parallelism(
+                target_type, compile_type, jobs, duration, filesets
+            )
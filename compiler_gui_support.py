@@ -5,21 +5,53 @@ Compiles the files and done operation for given arguments.
 import sys
 import os
 import subprocess
-import fileinput
+import tempfile
+import sqlite3
+import collections
 import time
 import glob
+import shutil
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import paramiko
 from colorama import Fore
 
+from compiler_config import CONFIGURATIONS
+from compiler_process import execute, check_output, get_environment, \
+    cancel_on, reset_cancel, Canceled, COMMAND_TIMEOUT
+from compiler_manifest import BuildManifest, SHARED_INCLUDE_DIRS, \
+    get_include_dirs
+from compiler_log import LogWriter
+from compiler_diagnostics import DiagnosticIndex, Severity, \
+    format_diagnostic
+from compiler_timing import start_timeline, span, get_report_path
+from compiler_git import is_modified, GitError
+from compiler_patch import PatchEngine
+from compiler_cache import ArtifactCache, get_cache_key, get_artifacts
+from compiler_worktree import WorktreeManager
+from compiler_batch import canonicalize, parse_arguments, write_build_file
+from compiler_environment import get_snapshot, SnapshotError
+from compiler_governor import Governor, BUILD_JOBS_PROPERTY
+from compiler_remote_cache import get_remote_cache, RemoteCacheError, \
+    REMOTE_CACHE_UPLOAD
+from compiler_history import BuildHistory, Estimate, Progress, \
+    record_current_run, format_duration
 from compiler_helper import CompileTypes, \
     TargetMachines, AutoBoolType, \
     ExitCodes, CopyActions, UnknownType, \
     CONFIG_FILE_PATH, LINKER_FILE_PATH, \
     CompilerConfig, TransferConfig, \
-    COMPILER_PATH, COMPILER_NAME, \
+    COMPILER_PATH, COMPILER_NAME, EXECUTABLE_FILE_PATH, \
     PARTIAL_COMPILE_POSTFIX, CPUTypes
 
+OUTPUT_TAIL_SIZE = 200
+COMPONENT_OUTPUT_MEMORY_SIZE = 1024 * 1024
+MAX_PRINTED_DIAGNOSTICS = 10
+# The last lines of a failed component are reported if it has no errors
+FAILURE_TAIL_SIZE = 5
+# The build is stopped forcefully after it on fail fast
+FAIL_FAST_TIMEOUT = CONFIGURATIONS.get("fail_fast_timeout", 0.5)
 
 class Colored:
     """
@@ -27,6 +59,7 @@ class Colored:
     print functionalty may be used.
     """
     file = sys.stdout
+    log = None
     allow_color = True
 
     @classmethod
@@ -44,6 +77,15 @@ class Colored:
 
         print(text, file=file, **kwargs)
 
+        if cls.log is not None and file is cls.file:
+            try:
+                cls.log.write(text + kwargs.get("end", "\n"))
+            except OSError as error:
+                # The output goes on without the log
+                cls.log = None
+                print("Log file is not written anymore: {0}".format(error),
+                      file=file, flush=True)
+
         return text
 
     @classmethod
@@ -123,61 +165,116 @@ class CompilerError(Exception):
         return self._message
 
 
+class BuildOutput:
+    """Follows the output of a build while it streams.
+    Decides the result on the fly and keeps only the last lines."""
+    SUCCESS_MARKER = "BUILD SUCCESSFUL"
+    FAILURE_MARKER = "BUILD FAILED"
+    FILESET_MARKER = "Compiling fileset"
+
+    def __init__(self, tail_size=OUTPUT_TAIL_SIZE, component=None,
+                 progress=None):
+        self.tail = collections.deque(maxlen=tail_size)
+        self.diagnostics = DiagnosticIndex(component)
+        self.progress = progress
+        self.line_count = 0
+        self.fileset_count = 0
+        self.return_code = None
+        self.first_error = None
+        # True if the build is stopped before it finished
+        self.stopped = False
+        self._result = None
+
+    def feed(self, line):
+        "processes the next line of the output"
+        self.line_count += 1
+        self.tail.append(line)
+        diagnostic = self.diagnostics.feed(line)
+        if diagnostic is not None and self.first_error is None \
+                and diagnostic.severity is Severity.ERROR:
+            self.first_error = diagnostic
+
+        if self.FILESET_MARKER in line:
+            self.fileset_count += 1
+            if self.progress is not None:
+                self.progress.update(self.fileset_count)
+        elif self.SUCCESS_MARKER in line:
+            self._result = True
+        elif self.FAILURE_MARKER in line:
+            self._result = False
+
+    @property
+    def successful(self):
+        "returns True if the build reported success"
+        return bool(self._result)
+
+    @property
+    def finished(self):
+        "returns True if the build reported its result, it is exiting"
+        return self._result is not None
+
+    def __str__(self):
+        return ''.join(self.tail)
+
+
 class WMIC:
     "Executes the commands via WMIC command with given credentials"
 
-    def __init__(self, ip_address, username, password):
+    def __init__(self, ip_address, username, password, *, cwd):
         self.ip_address = ip_address
         self.username = username
         self.password = password
+        self.cwd = cwd
 
-        self._command = r'WMIC.exe ' \
-            r'/node:{ip} /USER:"\{username}" ' \
-            r'/PASSWORD:"{password}" ' \
-            r'process call create "{{command}}"'.format(
-                ip=ip_address,
-                username=username,
-                password=password
-            )
+    def _get_command(self, command):
+        return [
+            "WMIC.exe",
+            "/node:{0}".format(self.ip_address),
+            "/USER:\\{0}".format(self.username),
+            "/PASSWORD:{0}".format(self.password),
+            "process", "call", "create", command
+        ]
 
     def execute(self, command, **kwargs):
         "Executes the given command on the system. Yields the output"
-        popen = subprocess.Popen(
-            self._command.format(command=command),
-            stdout=subprocess.PIPE,
-            stdin=subprocess.PIPE,
-            stderr=kwargs.pop("stderr", subprocess.PIPE),
-            shell=True,
-            universal_newlines=True,
-            **kwargs
-        )
-        for stdout_line in iter(popen.stdout.readline, ""):
-            yield stdout_line
-        popen.stdout.close()
-        return_code = popen.wait()
+        return_code = None
+        for stdout_line, return_code in execute(
+                self._get_command(command),
+                cwd=self.cwd,
+                timeout=kwargs.pop("timeout", COMMAND_TIMEOUT),
+                **kwargs):
+            if stdout_line:
+                yield stdout_line
 
         return return_code
 
     def execute2(self, command, exit_code, **kwargs):
         "Executes the given command on the system. Returns the output"
         try:
-            output = subprocess.check_output(
-                self._command.format(command=command),
-                stdin=subprocess.PIPE,
-                stderr=kwargs.pop("stderr", subprocess.PIPE),
-                shell=True,
-                universal_newlines=True,
+            output = check_output(
+                self._get_command(command),
+                cwd=self.cwd,
+                timeout=kwargs.pop("timeout", COMMAND_TIMEOUT),
                 **kwargs
             )
             return output
         except subprocess.CalledProcessError as error:
             raise CompilerError(error.stderr, exit_code)
+        except subprocess.TimeoutExpired as error:
+            raise CompilerError(error, exit_code)
+
+
+def _import_paramiko():
+    "paramiko is slow to import, it is needed only for the Linux targets"
+    import paramiko  # pylint: disable=import-outside-toplevel
+    return paramiko
 
 
 class SSH:
     "The SSH connection class"
 
     def __init__(self, hostname, username, password):
+        paramiko = _import_paramiko()
         self.ssh = paramiko.SSHClient()
         self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
 
@@ -187,6 +284,7 @@ class SSH:
 
     def connect(self):
         "Connect to an SSH server"
+        paramiko = _import_paramiko()
         try:
             self.ssh.connect(
                 hostname=self._hostname,
@@ -216,133 +314,1086 @@ class SSH:
         return self.ssh.open_sftp()
 
 
-def execute(command, **kwargs):
-    "Executes the given command on the system. Yields the output"
-    popen = subprocess.Popen(
-        command,
-        stdout=subprocess.PIPE,
-        stdin=subprocess.PIPE,
-        stderr=kwargs.pop("stderr", subprocess.PIPE),
-        shell=True,
-        universal_newlines=True,
-        **kwargs
-    )
-    for stdout_line in iter(popen.stdout.readline, ""):
-        yield stdout_line, None
-    popen.stdout.close()
-    popen.wait()
+def _report_cancel(alive):
+    "reports the processes which could not be stopped on cancel"
+    if alive:
+        Colored.error("\nProcesses could not be stopped: {0}".format(
+            ", ".join(str(pid) for pid in sorted(alive))
+        ))
+    else:
+        Colored.warning("\nAll build processes are stopped.")
+
+
+@contextlib.contextmanager
+def operation(compiler_config, stdout=sys.stdout, root=None,
+              cancel_event=None, name="operation", record=True, **metadata):
+    """Prepares the output, the log, the timeline and the cancellation of
+    an operation, reports them at the end. Yields the absolute root.
+    The run is stored in the build history if record is True."""
+    Colored.file = stdout
+    root = os.path.abspath(os.getcwd() if root is None else root)
 
-    yield '', popen.returncode
+    if compiler_config.output:
+        log_file = os.path.join(root, compiler_config.output)
+    else:
+        log_file = None
 
+    timeline = start_timeline(name, root=root, **metadata)
+    successful = False
+    reset_cancel()
+    watcher = None if cancel_event is None else \
+        cancel_on(cancel_event, _report_cancel)
+    try:
+        if log_file is not None:
+            try:
+                Colored.log = LogWriter(log_file)
+            except OSError as error:
+                raise CompilerError(
+                    "Log file cannot be written: {0}".format(error),
+                    ExitCodes.NO_SUCH_FILE
+                )
+        yield root
+        successful = True
+    except Canceled:
+        raise CompilerError("Operation canceled.", ExitCodes.CANCELED)
+    finally:
+        if watcher is not None:
+            watcher.set()
+        timeline.finish()
+        _report_timeline(timeline, log_file)
+        if record:
+            record_current_run(
+                compiler_config.target_type,
+                compiler_config.compile_type,
+                successful
+            )
 
-def start_operation(compiler_config, transfer_config, stdout=sys.stdout):
-    "the main function for compiler tool"
+        if Colored.log is not None:
+            log, Colored.log = Colored.log, None
+            try:
+                log.close()
+            except OSError as error:
+                Colored.warning("Log file is incomplete: {0}".format(error))
+
+
+def start_operation(compiler_config, transfer_config,
+                    stdout=sys.stdout, root=None, cancel_event=None,
+                    dry_run=False):
+    """the main function for compiler tool.
+    root is the directory that contains the repositories,
+    current directory is used if not given.
+    The running commands are stopped with their child processes
+    when cancel_event is set.
+    If dry_run is True, nothing is run, the plan is printed and returned."""
     if not isinstance(compiler_config, CompilerConfig):
         raise UnknownType(compiler_config, CompilerConfig)
 
     if not isinstance(transfer_config, TransferConfig):
         raise UnknownType(transfer_config, TransferConfig)
 
-    Colored.file = stdout
+    if dry_run:
+        Colored.file = stdout
+        plan = plan_operation(compiler_config, transfer_config, root)
+        Colored.info(format_plan(plan))
+        return plan
+
+    with operation(
+            compiler_config, stdout, root, cancel_event,
+            target_type=compiler_config.target_type.name,
+            compile_type=compiler_config.compile_type.name,
+            skip_build=compiler_config.skip_build,
+            skip_transfer=transfer_config.skip_transfer) as root:
+        build_root = get_build_root(compiler_config, root)
+
+        if compiler_config.skip_build:
+            Colored.warning("\nBuild skipped.\n")
+        else:
+            with span("compile"):
+                start_compile(compiler_config, build_root)
+
+        if transfer_config.skip_transfer:
+            Colored.warning("\nTransfer skipped.\n")
+        else:
+            with span("transfer", target_ip=transfer_config.ip_address,
+                      target_machine=transfer_config.target_machine.name):
+                start_transfer(transfer_config, build_root)
+
+
+def _add_step(steps, phase, action, estimate=None, **details):
+    "appends a step to the plan, estimate is an Estimate of the history"
+    steps.append(dict(
+        phase=phase,
+        action=action,
+        estimate=round(estimate.duration, 1)
+        if estimate is not None and estimate.duration is not None else None,
+        **details
+    ))
+
+
+def _plan_patch(steps, patches, path, patch, phase):
+    "the patch is written unless the file has it already"
+    if patches.is_applied(path, patch):
+        _add_step(steps, phase, "up to date", file=path)
+    else:
+        _add_step(steps, phase, "patch", file=path, patch=patch)
+
+
+def _plan_compile(steps, session):
+    "adds the steps of the compile, nothing is run or written"
+    compiler_config = session.compiler_config
+    root = session.root
+    patches = PatchEngine()
+    pending_patches = False
+
+    if CompileTypes.is_unoptimized(compiler_config.compile_type):
+        linker_file = os.path.join(
+            root, LINKER_FILE_PATH.format(compiler_config.target_type.value)
+        )
+        try:
+            # Not _need_edit_linker, its errors are printed when raised
+            need_edit_linker = \
+                compiler_config.edit_linker is AutoBoolType.ALWAYS or (
+                    compiler_config.edit_linker is AutoBoolType.AUTO and (
+                        patches.is_applied(linker_file)
+                        or not is_modified(linker_file)
+                    )
+                )
+        except (GitError, OSError) as error:
+            _add_step(steps, "linker edit", "unknown", file=linker_file,
+                      reason=str(error))
+        else:
+            if need_edit_linker:
+                _plan_patch(steps, patches, linker_file,
+                            "expand linker 0x{0:X}".format(
+                                int(compiler_config.expand_size)
+                            ), "linker edit")
+            else:
+                _add_step(steps, "linker edit", "skip", file=linker_file)
+
+        config_file = os.path.join(
+            root, CONFIG_FILE_PATH.format(compiler_config.target_type.value)
+        )
+        _plan_patch(steps, patches, config_file, "uart debugging",
+                    "config edit")
+        pending_patches = any(
+            step["action"] == "patch" for step in steps
+        )
+
+    if (not compiler_config.compile_type == CompileTypes.LINK_ONLY
+            and compiler_config.partial_compile):
+        paths = []
+        context = session.get_manifest_context() \
+            if session.manifest is not None else None
+        for path in canonicalize(compiler_config.partial_compile):
+            if context is not None and session.is_unchanged(path, context):
+                _add_step(steps, "component", "skip, unchanged",
+                          component=path)
+            else:
+                paths.append(path)
+
+        if compiler_config.batch_build and paths:
+            for path in paths:
+                _add_step(steps, "component", "in the batch",
+                          component=path)
+            _add_step(steps, "batch build", "build and link" if
+                      CompileTypes.need_final_link(compiler_config.compile_type)
+                      else "build", session.estimate("batch build"))
+            return
+
+        for path in paths:
+            _add_step(steps, "component", "build",
+                      session.estimate("component", path), component=path)
+
+        if CompileTypes.need_final_link(compiler_config.compile_type):
+            _add_step(steps, "final link", "link",
+                      session.estimate("final link"))
+        else:
+            _add_step(steps, "final link", "skip")
+        return
+
+    if session.cache is not None and not pending_patches:
+        cache_key = session.get_cache_key()
+        if cache_key is not None and session.cache.lookup(cache_key):
+            _add_step(steps, "cache restore", "restore",
+                      session.estimate("cache restore"), key=cache_key)
+            return
+        if cache_key is not None and session.remote_cache is not None:
+            _add_step(steps, "remote cache fetch", "fetch if cached",
+                      session.estimate("remote cache fetch"), key=cache_key)
+
+    _add_step(steps, "full build", "build", session.estimate("full build"))
+    if session.cache is not None:
+        _add_step(steps, "cache store", "store",
+                  session.estimate("cache store"))
+        if session.remote_cache is not None and REMOTE_CACHE_UPLOAD:
+            _add_step(steps, "remote cache upload", "upload",
+                      session.estimate("remote cache upload"))
+
+
+def _plan_transfer(steps, session, transfer_config):
+    "adds the steps of the transfer, the target is not contacted"
+    target_ip = transfer_config.ip_address
+    if transfer_config.target_machine == TargetMachines.WINDOWS:
+        _add_step(steps, "share access", "try the shared folder",
+                  session.estimate("share access"), target_ip=target_ip)
+        _add_step(steps, "grant permissions", "if the share fails",
+                  session.estimate("grant permissions"), target_ip=target_ip)
+    else:
+        _add_step(steps, "ssh connect", "connect",
+                  session.estimate("ssh connect"), target_ip=target_ip)
+
+    _add_step(steps, "copy action", transfer_config.action.name.lower(),
+              session.estimate("copy action"),
+              destination=transfer_config.destination)
+    _add_step(steps, "upload", "upload", session.estimate("upload"),
+              file=transfer_config.target_file, target_ip=target_ip)
+    if transfer_config.reboot:
+        _add_step(steps, "reboot", "reboot", session.estimate("reboot"),
+                  target_ip=target_ip)
+
+
+def plan_operation(compiler_config, transfer_config, root=None):
+    """Returns what the operation would do and how long each step would
+    take, from the history. No command is run, no file is written.
+    The plan is JSON serializable."""
+    root = os.path.abspath(os.getcwd() if root is None else root)
+    steps = []
+
+    build_root = root
+    if compiler_config.use_worktree:
+        manager = WorktreeManager(root)
+        build_root = manager.get_path(manager.get_variant(
+            compiler_config.target_type, compiler_config.compile_type
+        ))
+    session = CompileSession(compiler_config, build_root)
+
+    if compiler_config.use_worktree and not compiler_config.skip_build:
+        _add_step(steps, "worktree sync",
+                  "sync" if os.path.isdir(build_root) else "create",
+                  session.estimate("worktree sync"), root=build_root)
 
     if compiler_config.skip_build:
-        Colored.warning("\nBuild skipped.\n")
+        _add_step(steps, "compile", "skip")
     else:
-        start_compile(compiler_config)
+        _plan_compile(steps, session)
 
     if transfer_config.skip_transfer:
-        Colored.warning("\nTransfer skipped.\n")
+        _add_step(steps, "transfer", "skip")
     else:
-        start_transfer(transfer_config)
+        _plan_transfer(steps, session, transfer_config)
+
+    estimates = [step["estimate"] for step in steps
+                 if step["estimate"] is not None]
+    return {
+        "root": build_root,
+        "target_type": compiler_config.target_type.name,
+        "compile_type": compiler_config.compile_type.name,
+        "steps": steps,
+        "estimate": round(sum(estimates), 1),
+        "unknown_estimates": sum(
+            1 for step in steps if step["estimate"] is None
+            and step["action"] not in ("skip", "skip, unchanged",
+                                       "up to date", "in the batch")
+        ),
+    }
+
+
+def format_plan(plan):
+    "returns the plan as text for the console"
+    lines = ["Plan for {0} {1} in {2}".format(
+        plan["target_type"], plan["compile_type"], plan["root"]
+    )]
+    for step in plan["steps"]:
+        detail = step.get("component") or step.get("file") or \
+            step.get("target_ip") or step.get("reason") or ''
+        estimate = "~" + format_duration(step["estimate"]) \
+            if step["estimate"] is not None else ''
+        lines.append("  {0:<20}{1:<22}{2:>9}  {3}".format(
+            step["phase"], step["action"], estimate, detail
+        ).rstrip())
+
+    total = "Estimated: ~{0}".format(format_duration(plan["estimate"]))
+    if plan["unknown_estimates"]:
+        total += ", {0} step(s) without history".format(
+            plan["unknown_estimates"]
+        )
+    lines.append(total)
+    return '\n'.join(lines)
+
 
+def get_build_root(compiler_config, root):
+    "returns the root which the variant is built in"
+    if not compiler_config.use_worktree:
+        return root
 
-def start_compile(compiler_config):
+    with span("worktree sync"):
+        return _get_worktree(compiler_config, root)
+
+
+def _get_worktree(compiler_config, root):
+    """returns the root of the worktree of the build variant,
+    synchronizes it with the root unless the build is skipped"""
+    manager = WorktreeManager(root, patches=PatchEngine())
+    if compiler_config.skip_build:
+        return manager.get_path(manager.get_variant(
+            compiler_config.target_type, compiler_config.compile_type
+        ))
+
+    try:
+        build_root = manager.prepare(
+            compiler_config.target_type, compiler_config.compile_type
+        )
+    except (GitError, OSError) as error:
+        raise CompilerError(error, ExitCodes.GIT_ERROR)
+
+    Colored.info("Building in the worktree {0}".format(build_root))
+    return build_root
+
+
+def _report_timeline(timeline, log_file):
+    "prints the top level phases, saves the JSON report next to the log"
+    Colored.info("\nTiming: {0:.1f}s in total".format(
+        timeline.to_dict()["duration"]
+    ))
+    for record in timeline.get_spans():
+        if record["parent"] in (None, "compile", "transfer") \
+                and record["duration"] is not None:
+            Colored.info("  {0:<24}{1:>9.1f}s".format(
+                record["name"], record["duration"]
+            ))
+
+    if log_file is None:
+        return
+
+    report_path = get_report_path(log_file)
+    try:
+        timeline.save(report_path)
+    except OSError as error:
+        Colored.warning("Timing report could not be saved: {0}".format(error))
+    else:
+        Colored.info("Timing report saved to {0}".format(report_path))
+
+
+class CompileSession:
+    "The state of a single compile operation"
+
+    def __init__(self, compiler_config, root):
+        self.compiler_config = compiler_config
+        self.root = root
+        self.diagnostics = DiagnosticIndex()
+
+        try:
+            self.history = BuildHistory()
+        except sqlite3.Error:
+            self.history = None
+
+        if compiler_config.skip_unchanged:
+            self.manifest = BuildManifest()
+        else:
+            self.manifest = None
+        # The contents of the components to build, taken before the build
+        self._manifest_states = {}
+        # The cached environment of the toolchain, set on setup
+        self.environment = None
+        # Set on the first error, the running builds are stopped
+        self.stop_event = threading.Event() if compiler_config.fail_fast \
+            else None
+        # Set when the failure report has listed the errors already
+        self.errors_reported = False
+
+        if self.is_cacheable():
+            self.cache = ArtifactCache()
+            self.remote_cache = get_remote_cache()
+        else:
+            self.cache = None
+            self.remote_cache = None
+
+    def is_cacheable(self):
+        """Only the full builds are cached, the partial builds and the
+        links depend on the object files of the previous builds"""
+        compiler_config = self.compiler_config
+        return compiler_config.use_cache \
+            and not compiler_config.partial_compile \
+            and compiler_config.compile_type is not CompileTypes.LINK_ONLY \
+            and CompileTypes.need_final_link(compiler_config.compile_type)
+
+    def get_executable_dir(self):
+        "returns the directory of the built executables"
+        return os.path.join(self.root, EXECUTABLE_FILE_PATH.format(
+            self.compiler_config.target_type.value
+        ))
+
+    def get_cache_key(self):
+        "returns the artifact cache key of the build, None if not cacheable"
+        if self.cache is None:
+            return None
+
+        # The log file and its timing report are written meanwhile
+        excluded = []
+        if self.compiler_config.output:
+            log_file = os.path.join(self.root, self.compiler_config.output)
+            excluded = [log_file, get_report_path(log_file)]
+
+        return get_cache_key(
+            self.root,
+            self.compiler_config.target_type,
+            self.compiler_config.compile_type,
+            PatchEngine().get_state(),
+            excluded
+        )
+
+    def get_jobs(self):
+        """returns the job count of each build, None if the filesets
+        are not compiled in parallel"""
+        compiler_config = self.compiler_config
+        if not compiler_config.parallel_compile:
+            return None
+        if compiler_config.build_jobs:
+            return int(compiler_config.build_jobs)
+
+        workers = 1
+        if compiler_config.partial_compile:
+            workers = min(int(compiler_config.partial_jobs),
+                          len(compiler_config.partial_compile))
+        # Only the durations of the full builds are recorded
+        args = (compiler_config.target_type, compiler_config.compile_type,
+                workers, not compiler_config.partial_compile)
+        try:
+            return Governor(self.history).choose(*args)
+        except sqlite3.Error:
+            return Governor().choose(*args)
+
+    def record_jobs(self, jobs, duration, filesets):
+        """stores the duration of a full build with given job count and
+        the number of its compiled filesets"""
+        if jobs is None or self.history is None:
+            return
+
+        try:
+            Governor(self.history).record(
+                self.compiler_config.target_type,
+                self.compiler_config.compile_type,
+                jobs, duration, filesets
+            )
+        except sqlite3.Error:
+            pass
+
+    def load_environment(self):
+        """uses the cached environment of the toolchain if it is configured,
+        the compiler script sets it up on each build otherwise"""
+        if not self.compiler_config.use_environment_cache:
+            return
+
+        try:
+            self.environment = get_snapshot(
+                os.path.join(self.root, COMPILER_PATH), COMPILER_NAME
+            )
+        except SnapshotError as error:
+            Colored.warning("{0}, the compiler script is used.".format(error))
+
+    def is_unchanged(self, path, context):
+        """returns True if the component did not change since its last
+        build, keeps its content to record once it is built otherwise"""
+        args = (
+            os.path.join(self.root, path),
+            self.compiler_config.target_type,
+            self.compiler_config.compile_type
+        )
+        # The headers which only this component includes
+        context = self.manifest.get_context(context, get_include_dirs(args[0]))
+        state = self.manifest.get_state(*args, context=context)
+        if self.manifest.is_unchanged(*args, state):
+            return True
+
+        self._manifest_states[path] = state
+        return False
+
+    def get_manifest_context(self):
+        "returns the digest of what all the components are built with"
+        return self.manifest.get_context(
+            _get_compile_param(self.compiler_config),
+            [os.path.join(self.root, path) for path in SHARED_INCLUDE_DIRS]
+        )
+
+    def update_manifest(self, path, successful):
+        """records the component with its content before the build if it is
+        built, forgets otherwise"""
+        if self.manifest is None:
+            return
+
+        args = (
+            os.path.join(self.root, path),
+            self.compiler_config.target_type,
+            self.compiler_config.compile_type
+        )
+        state = self._manifest_states.pop(path, None)
+        if successful and state is not None:
+            self.manifest.record(*args, state)
+        else:
+            self.manifest.forget(*args)
+
+        self.manifest.save()
+
+    def estimate(self, name, component=None):
+        "returns the expected duration and fileset count from the history"
+        if self.history is None:
+            return Estimate()
+
+        try:
+            return self.history.estimate(
+                name,
+                self.compiler_config.target_type,
+                self.compiler_config.compile_type,
+                component
+            )
+        except sqlite3.Error:
+            return Estimate()
+
+    def get_progress(self, name, component=None, label=""):
+        "returns a progress reporter for given phase"
+        return Progress(
+            self.estimate(name, component),
+            report=Colored.verbose,
+            label=label
+        )
+
+
+def start_compile(compiler_config, root):
     "Starts the compile"
+    session = CompileSession(compiler_config, root)
 
-    compile_string = get_compile_string(compiler_config)
+    try:
+        _start_compile(session)
+    finally:
+        _print_diagnostics(session.diagnostics, session.errors_reported)
+
+
+def _start_compile(session):
+    compiler_config = session.compiler_config
+    low_priority = compiler_config.low_priority
+    if compiler_config.batch_build and compiler_config.keep_going \
+            and compiler_config.partial_compile:
+        # The build file of the batch stops on the first failure
+        raise CompilerError(
+            "Batch builds cannot keep going, disable one of them.",
+            ExitCodes.UNKNOWN
+        )
+    with span("setup") as record:
+        jobs = session.get_jobs()
+        record["jobs"] = jobs
+        session.load_environment()
+        record["environment_cache"] = session.environment is not None
+        compile_string = get_compile_string(compiler_config, session.root,
+                                            jobs)
 
     if (not compiler_config.compile_type == CompileTypes.LINK_ONLY
             and compiler_config.partial_compile):
 
-        for path in compiler_config.partial_compile:
-            Colored.info("Build started for {0}".format(
-                os.path.basename(path)
-            ))
-            output = _compile(compile_string, path=path)
-            if "BUILD SUCCESSFUL" in output:
-                Colored.info("Build successful for {0}\n".format(
-                    os.path.basename(path)
-                ))
-            else:
-                raise CompilerError("Build failed.", ExitCodes.BUILD_FAILURE)
+        with span("change detection"):
+            paths = _get_changed_components(session)
 
-        if  CompileTypes.need_final_link(compiler_config.compile_type):
-            # Final link
-            Colored.info("Final linking")
-            final_link_command = compiler_config.target_type.value + CompileTypes.LINK_ONLY.value
-            output = _compile(final_link_command)
+        if compiler_config.batch_build and paths:
+            with span("batch build", components=len(paths)) as record:
+                output = _batch_compile(session, paths, compile_string)
+                record["successful"] = output.successful
+                record["filesets"] = output.fileset_count
+            session.diagnostics.merge(output.diagnostics)
         else:
-            Colored.warning("\nFinal link skipped.\n")
+            with span("partial compile", components=len(paths),
+                      jobs=int(compiler_config.partial_jobs)) as record:
+                if int(compiler_config.partial_jobs) > 1 and len(paths) > 1:
+                    failures = _concurrent_partial_compile(
+                        session, paths, compile_string
+                    )
+                else:
+                    failures = _sequential_partial_compile(
+                        session, paths, compile_string
+                    )
+                record["failed"] = len(failures)
+
+            if failures:
+                # Only on keep going, the others raise on the first failure
+                if CompileTypes.need_final_link(compiler_config.compile_type):
+                    Colored.warning("\nFinal link skipped, {0} component(s) "
+                                    "failed.".format(len(failures)))
+                session.errors_reported = True
+                _raise_failures(failures, len(paths))
+
+            if  CompileTypes.need_final_link(compiler_config.compile_type):
+                # Final link
+                Colored.info("Final linking")
+                final_link_command = compiler_config.target_type.value + CompileTypes.LINK_ONLY.value
+                with span("final link") as record:
+                    output = _compile(
+                        final_link_command, root=session.root,
+                        progress=session.get_progress("final link"),
+                        low_priority=low_priority,
+                        environment=session.environment,
+                        stop=session.stop_event
+                    )
+                    record["successful"] = output.successful
+                    record["filesets"] = output.fileset_count
+                session.diagnostics.merge(output.diagnostics)
+            else:
+                Colored.warning("\nFinal link skipped.\n")
+                output = None
     else:
-        Colored.info("Build started")
-        output = _compile(compile_string)
-
-    if "BUILD SUCCESSFUL" not in output:
-        raise CompilerError("Build failed.", ExitCodes.BUILD_FAILURE)
+        with span("cache lookup") as record:
+            cache_key = session.get_cache_key()
+            record["hit"] = cache_key is not None and \
+                session.cache.lookup(cache_key) is not None
+
+        if record["hit"]:
+            with span("cache restore"):
+                _restore_artifacts(session, cache_key)
+            output = None
+        elif cache_key is not None and _fetch_artifacts(session, cache_key):
+            output = None
+        else:
+            Colored.info("Build started")
+            started = time.time()
+            with span("full build", jobs=jobs) as record:
+                output = _compile(
+                    compile_string, root=session.root,
+                    progress=session.get_progress("full build"),
+                    low_priority=low_priority,
+                    environment=session.environment,
+                    stop=session.stop_event
+                )
+                record["successful"] = output.successful
+                record["filesets"] = output.fileset_count
+            session.diagnostics.merge(output.diagnostics)
+
+            if output.successful:
+                session.record_jobs(
+                    jobs, time.time() - started, output.fileset_count
+                )
+
+            if output.successful and cache_key is not None:
+                with span("cache store"):
+                    _store_artifacts(session, cache_key, started)
+
+    if output is not None and not output.successful:
+        _raise_failure(output)
 
     Colored.info("Build successful!")
 
 
-def _compile(compile_string, *, path=None):
-    main_path = os.getcwd()
+def _restore_artifacts(session, cache_key):
+    "copies the cached executables of an identical build"
+    for path in session.cache.restore(cache_key, session.get_executable_dir()):
+        Colored.info("Restored from the artifact cache: {0}".format(path))
+    Colored.warning(
+        "The object files are not rebuilt, "
+        "run a full build before the partial builds."
+    )
 
-    if path is None:
-        # Full compile
-        os.chdir(os.path.join(
-            os.getcwd(),
-            COMPILER_PATH
+
+def _fetch_artifacts(session, cache_key):
+    "downloads the executables from the shared cache, returns True on a hit"
+    if session.remote_cache is None:
+        return False
+
+    with span("remote cache fetch") as record:
+        try:
+            paths = session.remote_cache.fetch(
+                cache_key, session.get_executable_dir()
+            )
+        except (RemoteCacheError, OSError) as error:
+            Colored.warning("Shared cache is not available: {0}".format(error))
+            paths = None
+        record["hit"] = paths is not None
+
+    if paths is None:
+        return False
+
+    for path in paths:
+        Colored.info("Restored from the shared cache: {0}".format(path))
+    Colored.warning(
+        "The object files are not rebuilt, "
+        "run a full build before the partial builds."
+    )
+
+    try:
+        session.cache.store(cache_key, paths)
+    except OSError as error:
+        Colored.warning("Artifact cache is not updated: {0}".format(error))
+    return True
+
+
+def _store_artifacts(session, cache_key, started):
+    "stores the executables produced by the build"
+    # Modification times may be rounded by the file system
+    artifacts = get_artifacts(session.get_executable_dir(), since=started - 2)
+    if not artifacts:
+        return
+
+    metadata = {
+        "target_type": session.compiler_config.target_type.name,
+        "compile_type": session.compiler_config.compile_type.name,
+    }
+    try:
+        session.cache.store(cache_key, artifacts, **metadata)
+    except OSError as error:
+        Colored.warning("Artifact cache is not updated: {0}".format(error))
+
+    if session.remote_cache is None or not REMOTE_CACHE_UPLOAD:
+        return
+
+    with span("remote cache upload"):
+        try:
+            session.remote_cache.store(cache_key, artifacts, **metadata)
+        except (RemoteCacheError, OSError) as error:
+            Colored.warning("Shared cache is not updated: {0}".format(error))
+
+
+def _print_diagnostics(diagnostics, errors_reported=False,
+                       limit=MAX_PRINTED_DIAGNOSTICS):
+    """prints the summary of the diagnostics, only the counts if the errors
+    are reported already"""
+    errors = diagnostics.errors()
+    warnings = diagnostics.warnings()
+    if not errors and not warnings:
+        return
+
+    Colored.info("\nDiagnostics: {0} error(s), {1} warning(s)".format(
+        len(errors), len(warnings)
+    ))
+    if errors_reported:
+        return
+    for diagnostic in errors[:limit]:
+        Colored.error("  " + format_diagnostic(diagnostic))
+    if len(errors) > limit:
+        Colored.error("  ... and {0} more".format(len(errors) - limit))
+    if diagnostics.dropped:
+        Colored.warning("  {0} diagnostic(s) dropped.".format(
+            diagnostics.dropped
         ))
 
-        compiler_real_path = COMPILER_NAME
-    else:
-        # Partial compile
-        os.chdir(path)
-        compiler_real_path = os.path.join(
-            main_path,
-            COMPILER_PATH,
-            COMPILER_NAME
+
+def _get_changed_components(session):
+    "returns the components that changed since their last successful build"
+    compiler_config = session.compiler_config
+    if session.manifest is None:
+        return canonicalize(compiler_config.partial_compile)
+
+    paths = []
+    context = session.get_manifest_context()
+    for path in canonicalize(compiler_config.partial_compile):
+        if session.is_unchanged(path, context):
+            Colored.warning("Build skipped for {0}, no changes.".format(
+                os.path.basename(path)
+            ))
+        else:
+            paths.append(path)
+
+    return paths
+
+
+def _sequential_partial_compile(session, paths, compile_string):
+    """Builds the components one after another. Stops on first error
+    unless it keeps going, returns the failures then"""
+    low_priority = session.compiler_config.low_priority
+    failures = []
+    for path in paths:
+        Colored.info("Build started for {0}".format(
+            os.path.basename(path)
+        ))
+        with span("component", component=path) as record:
+            output = _compile(
+                compile_string, root=session.root, path=path,
+                progress=session.get_progress(
+                    "component", path, os.path.basename(path)
+                ),
+                low_priority=low_priority,
+                environment=session.environment, stop=session.stop_event
+            )
+            record["successful"] = output.successful
+            record["filesets"] = output.fileset_count
+        session.diagnostics.merge(output.diagnostics)
+        session.update_manifest(path, output.successful)
+
+        if output.successful:
+            Colored.info("Build successful for {0}\n".format(
+                os.path.basename(path)
+            ))
+        elif session.compiler_config.keep_going:
+            Colored.error("Build failed for {0}, going on\n".format(
+                os.path.basename(path)
+            ))
+            failures.append((path, output))
+        else:
+            _raise_failure(output)
+
+    return failures
+
+
+def _batch_compile(session, paths, compile_string):
+    """Builds the components, then runs the final link if it is needed,
+    with one invocation of the compiler script"""
+    compiler_config = session.compiler_config
+    link = None
+    if CompileTypes.need_final_link(compiler_config.compile_type):
+        link = (
+            os.path.join(session.root, COMPILER_PATH),
+            compiler_config.target_type.value + CompileTypes.LINK_ONLY.value
+        )
+    target, _ = parse_arguments(compile_string)
+
+    Colored.info("Build started for {0} components in a batch{1}".format(
+        len(paths), " with the final link" if link else ""
+    ))
+    # Out of the repositories, the build file refers to them by absolute paths
+    directory = tempfile.mkdtemp(prefix="compiler_batch_")
+    try:
+        write_build_file(
+            directory, target,
+            [os.path.join(session.root, path) for path in paths],
+            compile_string, link
+        )
+        # The properties are passed to each component by the build file
+        output = _compile(
+            target, root=session.root, cwd=directory,
+            progress=session.get_progress("batch build"),
+            low_priority=compiler_config.low_priority,
+            environment=session.environment, stop=session.stop_event
+        )
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    # The components are not told apart in the output
+    for path in paths:
+        session.update_manifest(path, output.successful)
+    return output
+
+
+def _raise_failure(output, message="Build failed."):
+    """raises the failure of the build, its first error is the result
+    if the build is stopped on it"""
+    if output is not None and output.stopped \
+            and output.first_error is not None:
+        message = "Build stopped on the first error:\n  {0}".format(
+            format_diagnostic(output.first_error)
         )
-    command = "{0} {1}".format(compiler_real_path, compile_string)
+    raise CompilerError(message, ExitCodes.BUILD_FAILURE)
+
+
+def _raise_failures(failures, total, limit=MAX_PRINTED_DIAGNOSTICS):
+    """prints the report of the components which failed while the build
+    kept going, raises the overall result"""
+    Colored.error("\nFailure report: {0} of {1} component(s) failed".format(
+        len(failures), total
+    ))
+    for path, output in failures:
+        errors = output.diagnostics.errors()
+        Colored.error("  {0}: {1} error(s)".format(path, len(errors)))
+        for diagnostic in errors[:limit]:
+            Colored.error("    " + format_diagnostic(diagnostic))
+        if len(errors) > limit:
+            Colored.error("    ... and {0} more".format(len(errors) - limit))
+        if not errors:
+            # The reason is in the last lines of its output
+            for line in list(output.tail)[-FAILURE_TAIL_SIZE:]:
+                Colored.error("    " + line.rstrip())
+
+    raise CompilerError(
+        "Build failed for {0}.".format(", ".join(
+            os.path.basename(path) for path, _ in failures
+        )),
+        ExitCodes.BUILD_FAILURE
+    )
 
-    output = ""
-    for line, _ in execute(command, stderr=subprocess.STDOUT):
-        output += line
-        Colored.default(line, end='')
 
-    os.chdir(main_path)
+def _compile_component(compile_string, root, path, low_priority=False,
+                       environment=None, stop=None):
+    """Builds a component, keeps its output in a separate buffer.
+    The buffer is moved from memory to a file if it gets large."""
+    buffer = tempfile.SpooledTemporaryFile(
+        max_size=COMPONENT_OUTPUT_MEMORY_SIZE, mode='w+'
+    )
+    with span("component", component=path, parent="partial compile") as record:
+        output = _compile(compile_string, root=root, path=path, file=buffer,
+                          low_priority=low_priority, environment=environment,
+                          stop=stop)
+        record["successful"] = output.successful
+        record["filesets"] = output.fileset_count
+    buffer.seek(0)
+
+    return output, buffer
+
+
+def _print_component_output(buffer):
+    "prints the buffer of a component in large chunks and closes it"
+    with buffer:
+        for chunk in iter(lambda: buffer.read(COMPONENT_OUTPUT_MEMORY_SIZE), ''):
+            Colored.default(chunk, end='')
+
+
+def _concurrent_partial_compile(session, paths, compile_string):
+    """Builds the components in parallel with a bounded worker pool.
+    The output of each component is printed as a whole once it is done.
+    Pending components are canceled on first error unless it keeps going,
+    returns the failures then."""
+    jobs = int(session.compiler_config.partial_jobs)
+
+    Colored.info("Build started for {0} components with {1} workers\n".format(
+        len(paths), jobs
+    ))
+
+    # Filesets of the finished components are counted
+    estimates = [session.estimate("component", path) for path in paths]
+    progress = Progress(
+        Estimate(
+            duration=sum(
+                estimate.duration or 0 for estimate in estimates
+            ) / min(jobs, len(paths)),
+            filesets=sum(estimate.filesets or 0 for estimate in estimates),
+            samples=min(estimate.samples for estimate in estimates)
+        ),
+        report=Colored.verbose,
+        label="components"
+    )
+    filesets = 0
+
+    failed = []
+    failures = []
+    # The component whose first error has stopped the others
+    stopped_output = None
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = {
+            pool.submit(
+                _compile_component, compile_string, session.root, path,
+                session.compiler_config.low_priority, session.environment,
+                session.stop_event
+            ): path
+            for path in paths
+        }
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+
+            path = futures[future]
+            name = os.path.basename(path)
+            output, component_output = future.result()
+
+            Colored.info("Build output of {0}".format(name))
+            _print_component_output(component_output)
+
+            session.diagnostics.merge(output.diagnostics)
+            session.update_manifest(path, output.successful)
+
+            filesets += output.fileset_count
+            progress.update(filesets)
+
+            if output.successful:
+                Colored.info("Build successful for {0}\n".format(name))
+            else:
+                Colored.error("Build failed for {0}\n".format(name))
+                if session.compiler_config.keep_going:
+                    failures.append((path, output))
+                    continue
+
+                failed.append(name)
+                if stopped_output is None and output.first_error is not None:
+                    stopped_output = output
+                for pending in futures:
+                    pending.cancel()
+
+    if failed:
+        _raise_failure(
+            stopped_output, "Build failed for {0}.".format(", ".join(failed))
+        )
+
+    # In the given order, as the sequential build reports them
+    return sorted(failures, key=lambda failure: paths.index(failure[0]))
+
+
+def _compile(compile_string, *, root, path=None, cwd=None, file=None,
+             progress=None, low_priority=False, environment=None, stop=None):
+    """Runs the compiler script, returns its BuildOutput. If stop, an event,
+    is given, the build fails fast: it is stopped on its first error or
+    when the event is set, e.g., by the first error of another build."""
+    compiler_real_path = os.path.join(
+        root,
+        COMPILER_PATH,
+        COMPILER_NAME
+    )
+
+    if path is None:
+        # Full compile, or a batch in given directory
+        cwd = cwd or os.path.join(root, COMPILER_PATH)
+        output = BuildOutput(progress=progress)
+    else:
+        # Partial compile
+        cwd = os.path.join(root, path)
+        output = BuildOutput(
+            component=os.path.basename(path), progress=progress
+        )
+    if environment is None:
+        command = [compiler_real_path] + compile_string.split()
+        env = get_environment()
+    else:
+        # The build runs directly in the cached environment of the toolchain
+        command = environment.get_command(compile_string)
+        env = environment.variables
+
+    # A failing build is not given time to finish its filesets
+    options = {} if stop is None else {"stop_timeout": FAIL_FAST_TIMEOUT}
+    lines = execute(command, cwd=cwd, env=env, stderr=subprocess.STDOUT,
+                    low_priority=low_priority, **options)
+    for line, return_code in lines:
+        if return_code is not None:
+            output.return_code = return_code
+            break
+
+        if file is None:
+            Colored.default(line, end='')
+        else:
+            Colored.default(line, end='', file=file)
+        output.feed(line)
+
+        # The builds which have reported their result are let finish
+        if stop is not None and not output.finished and (
+                output.first_error is not None or stop.is_set()):
+            stop.set()
+            output.stopped = True
+            # Stops the process tree
+            lines.close()
+            message = "Build stopped{0}.".format(
+                " on the first error" if output.first_error is not None
+                else ", another build has failed"
+            )
+            if file is None:
+                Colored.error(message)
+            else:
+                Colored.error(message, file=file)
+            break
 
     return output
 
 
-def _subprocess(command, exit_code, **kwargs):
+def _subprocess(command, exit_code, *, cwd, **kwargs):
     try:
-        output = subprocess.check_output(
-            command,
-            stdin=subprocess.PIPE,
-            stderr=kwargs.pop("stderr", subprocess.PIPE),
-            shell=True,
-            universal_newlines=True,
-            **kwargs
+        output = check_output(
+            command, cwd=cwd,
+            timeout=kwargs.pop("timeout", COMMAND_TIMEOUT), **kwargs
         )
         return output
     except subprocess.CalledProcessError as error:
         if exit_code is None:
             return error.output
         raise CompilerError(error.output, exit_code)
+    except subprocess.TimeoutExpired as error:
+        if exit_code is None:
+            return ''
+        raise CompilerError(error, exit_code)
 
 
-def start_transfer(transfer_config: TransferConfig):
+def start_transfer(transfer_config: TransferConfig, root):
     "Copies files to the target if necessary"
+    transfer_config.target_file = os.path.join(
+        root, transfer_config.target_file
+    )
 
     filename = os.path.basename(transfer_config.target_file)
     if any(filename == item.value for item in CPUTypes):
@@ -351,23 +1402,26 @@ def start_transfer(transfer_config: TransferConfig):
 
     if transfer_config.target_machine == TargetMachines.WINDOWS:
         transfer_config.destination += f"\\{filename}*"
-        _win_copy_file(transfer_config)
+        _win_copy_file(transfer_config, root)
     if transfer_config.target_machine == TargetMachines.LINUX:
         transfer_config.destination += f"/{filename}"
         _linux_copy_file(transfer_config)
 
 
-def _windows_grant_permissions(transfer_config, access_path):
+def _windows_grant_permissions(transfer_config, access_path, root):
     Colored.info("Granting access permissions")
 
     return_code = None
-    access_generator = execute("net use {access_path} /USER:{username} {password}".format(
-        access_path=access_path,
-        username=transfer_config.username,
-        password=transfer_config.password
-    ), stderr=subprocess.STDOUT)
-    for _, return_code in access_generator:
-        pass
+    access_generator = execute([
+        "net", "use", access_path,
+        "/USER:{0}".format(transfer_config.username),
+        transfer_config.password
+    ], cwd=root, stderr=subprocess.STDOUT, timeout=COMMAND_TIMEOUT)
+    try:
+        for _, return_code in access_generator:
+            pass
+    except subprocess.TimeoutExpired:
+        return_code = None
 
     if return_code != ExitCodes.SUCCESS.value:
         raise CompilerError(
@@ -376,26 +1430,27 @@ def _windows_grant_permissions(transfer_config, access_path):
         )
 
 
-def _windows_copy_action_handler(transfer_config, access_path):
+def _windows_copy_action_handler(transfer_config, access_path, root):
     if (transfer_config.action == CopyActions.BACKUP
             or transfer_config.action == CopyActions.KEEP_LAST):
         filename = access_path + "\\" + \
             os.path.basename(transfer_config.target_file)
         backup_file = filename + time.strftime("_%Y%m%d_%H%M%S")
 
-        _subprocess(
-            "move {0} {1}".format(filename, backup_file),
-            exit_code=None
-        )
+        try:
+            os.replace(filename, backup_file)
+        except OSError:
+            # Nothing to back up
+            pass
 
         if transfer_config.action == CopyActions.KEEP_LAST:
             files = glob.glob("{0}*".format(filename))
             for file_ in files:
                 if backup_file != file_:
-                    _subprocess(
-                        "del {0}".format(file_),
-                        exit_code=None
-                    )
+                    try:
+                        os.unlink(file_)
+                    except OSError:
+                        pass
     elif transfer_config.action == CopyActions.OVERWRITE:
         # No need to take any action
         pass
@@ -403,11 +1458,12 @@ def _windows_copy_action_handler(transfer_config, access_path):
         raise UnknownType(transfer_config.action, CopyActions)
 
 
-def _win_reboot_handler(transfer_config):
+def _win_reboot_handler(transfer_config, root):
     wmic = WMIC(
         ip_address=transfer_config.ip_address,
         username=transfer_config.username,
-        password=transfer_config.password
+        password=transfer_config.password,
+        cwd=root
     )
     wmic.execute2(
         r"C:\Program Files (x86)\Siemens\Automation\CPU "
@@ -420,19 +1476,25 @@ def _win_reboot_handler(transfer_config):
     )
 
 
-def _win_copy_file(transfer_config):
+def _get_file_size(path):
+    "returns the size of given file, None if it does not exist"
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def _win_copy_file(transfer_config, root):
     drive, folder = transfer_config.destination.split(':')
 
     Colored.info("Trying to access path over shared folder")
     try:
-        _subprocess(
-            r"dir \\{hostname}\{drive}".format(
+        with span("share access", target_ip=transfer_config.ip_address):
+            os.listdir(r"\\{hostname}\{drive}".format(
                 hostname=transfer_config.ip_address,
                 drive=drive.lower(),
-            ),
-            exit_code=ExitCodes.WINDOWS_PERMISSION_ERROR
-        )
-    except CompilerError:
+            ))
+    except OSError:
         Colored.warning("Could not connect over shared folder.\n")
         use_wmic = True
     else:
@@ -452,25 +1514,29 @@ def _win_copy_file(transfer_config):
         )
 
     if use_wmic:
-        _windows_grant_permissions(transfer_config, access_path)
+        with span("grant permissions", target_ip=transfer_config.ip_address):
+            _windows_grant_permissions(transfer_config, access_path, root)
 
     Colored.info("Access granted\n")
 
-    _windows_copy_action_handler(transfer_config, access_path)
+    with span("copy action", action=transfer_config.action.name):
+        _windows_copy_action_handler(transfer_config, access_path, root)
 
     # /Y option overwrites the file if exist
-    output = _subprocess(
-        "xcopy {path} {access_path} /Y".format(
-            path=transfer_config.target_file.replace('/', '\\'),
-            access_path=access_path,
-        ),
-        exit_code=ExitCodes.WINDOWS_COPY_ERROR,
-    )
+    with span("upload", target_ip=transfer_config.ip_address,
+              bytes_sent=_get_file_size(transfer_config.target_file)):
+        output = _subprocess(
+            ["xcopy", transfer_config.target_file.replace('/', '\\'),
+             access_path, "/Y"],
+            exit_code=ExitCodes.WINDOWS_COPY_ERROR,
+            cwd=root
+        )
 
     Colored.info(output)
 
     if transfer_config.reboot:
-        _win_reboot_handler(transfer_config)
+        with span("reboot", target_ip=transfer_config.ip_address):
+            _win_reboot_handler(transfer_config, root)
 
 
 def _linux_copy_action_handler(transfer_config, ssh, destination):
@@ -499,6 +1565,7 @@ def _linux_copy_action_handler(transfer_config, ssh, destination):
 
 
 def _linux_copy_file(transfer_config):
+    paramiko = _import_paramiko()
     basename = os.path.basename(transfer_config.target_file)
     temp_file = "/tmp/" + basename
 
@@ -511,15 +1578,19 @@ def _linux_copy_file(transfer_config):
         password=transfer_config.password
     )
 
-    ssh.connect()
+    with span("ssh connect", target_ip=transfer_config.ip_address):
+        ssh.connect()
 
-    _linux_copy_action_handler(transfer_config, ssh, destination)
+    with span("copy action", action=transfer_config.action.name):
+        _linux_copy_action_handler(transfer_config, ssh, destination)
 
     sftp = ssh.open_sftp()
 
     Colored.info("\nFile transfering to {0}".format(destination))
     try:
-        sftp.put(transfer_config.target_file, temp_file)
+        with span("upload", target_ip=transfer_config.ip_address) as record:
+            attributes = sftp.put(transfer_config.target_file, temp_file)
+            record["bytes_sent"] = attributes.st_size
         ssh.execute(
             "sudo mv {0} {1}".format(temp_file, destination),
             exit_code=ExitCodes.LINUX_COPY_ERROR
@@ -537,7 +1608,8 @@ def _linux_copy_file(transfer_config):
 
     try:
         if transfer_config.reboot:
-            ssh.execute("sudo reboot")
+            with span("reboot", target_ip=transfer_config.ip_address):
+                ssh.execute("sudo reboot")
     except paramiko.SSHException as error:
         sftp.close()
         ssh.close()
@@ -548,27 +1620,21 @@ def _linux_copy_file(transfer_config):
 
 
 def _is_linker_editted(linker_file):
-    current_path = os.getcwd()
-
-    os.chdir("s7p.cpu1500")
-
+    "compares the linker file with its blob in the git index"
     try:
-        output = _subprocess(
-            "git diff {0}".format(linker_file),
-            exit_code=ExitCodes.GIT_ERROR
-        )
-    finally:
-        os.chdir(current_path)
+        return is_modified(linker_file)
+    except (GitError, OSError) as error:
+        raise CompilerError(error, ExitCodes.GIT_ERROR)
 
-    return bool(output)
 
-
-def _need_edit_linker(linker_file, edit_linker):
+def _need_edit_linker(linker_file, edit_linker, patches):
     if edit_linker is AutoBoolType.ALWAYS:
         return True
 
     if edit_linker is AutoBoolType.AUTO:
-        return not _is_linker_editted(linker_file)
+        # The edits of the previous runs are re-derived from the pristine
+        return patches.is_applied(linker_file) or \
+            not _is_linker_editted(linker_file)
 
     if edit_linker is AutoBoolType.NEVER:
         return False
@@ -576,11 +1642,10 @@ def _need_edit_linker(linker_file, edit_linker):
     raise UnknownType(edit_linker, AutoBoolType)
 
 
-def _edit_linker(linker_file, expand_size):
-    "Edits the linker script"
-
-    output = fileinput.input(linker_file, inplace=True)
-    for line in output:
+def _expand_linker(text, expand_size):
+    "returns the linker script with the expanded memory regions"
+    lines = []
+    for line in text.splitlines(keepends=True):
         if "code (ARXL)" in line:
             current_size = line.split("=")[2].strip()
             expanded_size = "{0:X}".format(
@@ -595,40 +1660,79 @@ def _edit_linker(linker_file, expand_size):
             ).zfill(7)
 
             line = line.replace(current_size, "0x{0}".format(expanded_size))
-        print(line, end='')
-    output.close()
+        lines.append(line)
+    return ''.join(lines)
+
+
+def _enable_uart_debugging(text):
+    "returns the config file which uses UART for the debugger"
+    lines = []
+    for line in text.splitlines(keepends=True):
+        if "#define ADN_ADB_COMM_MODE" in line:
+            line = line.replace(
+                "ADN_ADB_COMM_MODE_SHM",
+                "ADN_ADB_COMM_MODE_UART"
+            )
+        if "#define ADN_ADB_SUPPORT_COMM_SHM" in line:
+            line = line.replace("YES", "NO")
+        lines.append(line)
+    return ''.join(lines)
+
+
+def _edit_linker(linker_file, expand_size, patches):
+    "Edits the linker script, returns True if the file is written"
+    return patches.apply(
+        linker_file,
+        "expand linker 0x{0:X}".format(expand_size),
+        lambda text: _expand_linker(text, expand_size)
+    )
 
 
-def do_unoptimized_modifications(compiler_config):
-    "Edits config file and linker"
+def do_unoptimized_modifications(compiler_config, root):
+    """Edits config file and linker. The edits are applied onto the
+    pristine files, the files are not touched if they are up to date."""
+    patches = PatchEngine()
     linker_file = os.path.join(
-        os.getcwd(),
+        root,
         LINKER_FILE_PATH.format(compiler_config.target_type.value)
     )
-    if _need_edit_linker(linker_file, compiler_config.edit_linker):
-        _edit_linker(linker_file, int(compiler_config.expand_size))
+    with span("linker check", mode=compiler_config.edit_linker.name):
+        need_edit_linker = _need_edit_linker(
+            linker_file, compiler_config.edit_linker, patches
+        )
+    if need_edit_linker:
+        with span("linker edit", file=linker_file) as record:
+            record["written"] = _edit_linker(
+                linker_file, int(compiler_config.expand_size), patches
+            )
 
     # Edit for debugging
     config_file = os.path.join(
-        os.getcwd(),
+        root,
         CONFIG_FILE_PATH.format(compiler_config.target_type.value)
     )
 
-    output = fileinput.input(config_file, inplace=True)
-    for line in output:
-        if "#define ADN_ADB_COMM_MODE" in line:
-            line = line.replace(
-                "ADN_ADB_COMM_MODE_SHM",
-                "ADN_ADB_COMM_MODE_UART"
-            )
-        if "#define ADN_ADB_SUPPORT_COMM_SHM" in line:
-            line = line.replace("YES", "NO")
-        print(line, end='')
-    output.close()
+    with span("config edit", file=config_file) as record:
+        record["written"] = patches.apply(
+            config_file, "uart debugging", _enable_uart_debugging
+        )
+
 
+def get_compile_string(compiler_config, root, jobs=None):
+    """Returns the compile string and its options.
+    jobs is the job count of the parallel builds."""
+    compile_param = _get_compile_param(compiler_config, jobs)
+
+    if  CompileTypes.is_unoptimized(compiler_config.compile_type):
+        # If unoptimized options selected,
+        # some modiffication might be needed
+        do_unoptimized_modifications(compiler_config, root)
 
-def get_compile_string(compiler_config):
-    "Returns the compile string and its options"
+    return compile_param
+
+
+def _get_compile_param(compiler_config, jobs=None):
+    "returns the compile string without modifying any file"
     if compiler_config.partial_compile:
         compile_param = compiler_config.target_type.value + \
             PARTIAL_COMPILE_POSTFIX + compiler_config.compile_type.value
@@ -638,10 +1742,7 @@ def get_compile_string(compiler_config):
 
     if compiler_config.parallel_compile:
         compile_param += " -Dbuild.parallel=true"
-
-    if  CompileTypes.is_unoptimized(compiler_config.compile_type):
-        # If unoptimized options selected,
-        # some modiffication might be needed
-        do_unoptimized_modifications(compiler_config)
+        if jobs:
+            compile_param += " -D{0}={1}".format(BUILD_JOBS_PROPERTY, jobs)
 
     return compile_param
@@ -2,9 +2,11 @@
 import sys
 import os
 import enum
-import subprocess
+
+from compiler_process import check_output
 
 LINKER_DFT_EXPAND_SIZE = 0x400000
+LOCK_TIMEOUT = 30
 try:
     WIDTH = int(os.environ['COLUMNS'])
 except (KeyError, ValueError):
@@ -18,6 +20,8 @@ EXECUTABLE_FILE_PATH = "s7p.cpu1500\\bin\\{0}"
 COMPILER_PATH = "s7p.cpu1500\\_gen"
 COMPILER_NAME = "antmake.bat"
 PARTIAL_COMPILE_POSTFIX = "_x86_0"
+DEFAULT_USERNAME = "pt1"
+DEFAULT_PASSWORD = "pt1"
 
 
 class _ConfigBase:
@@ -27,6 +31,28 @@ class _ConfigBase:
         else:
             raise UnknownType(value, expected_type)
 
+    @staticmethod
+    def _get_enum_fields():
+        return {}
+
+    def to_dict(self):
+        "returns the configurations as a JSON serializable dictionary"
+        return {
+            key: value.name if isinstance(value, enum.Enum) else value
+            for key, value in vars(self).items()
+        }
+
+    @classmethod
+    def from_dict(cls, config):
+        "creates the configurations from the output of to_dict"
+        config = dict(config)
+        for key, enumeration in cls._get_enum_fields().items():
+            try:
+                config[key] = enumeration[config[key]]
+            except KeyError:
+                raise UnknownType(config.get(key), enumeration)
+        return cls(**config)
+
     def __str__(self):
         string = "{\n"
         for key, value in vars(self).copy().items():
@@ -50,7 +76,12 @@ class CompilerConfig(_ConfigBase):
 
     def __init__(self, *, target_type, skip_build,
                  compile_type, parallel_compile,
-                 partial_compile, edit_linker, expand_size, output):
+                 partial_compile, edit_linker, expand_size, output,
+                 partial_jobs=1, skip_unchanged=False, use_cache=False,
+                 use_worktree=False, build_jobs=None, low_priority=True,
+                 batch_build=False,
+                 use_environment_cache=True, fail_fast=False,
+                 keep_going=False):
         self._set_attr("target_type", target_type, TargetTypes)
         self.skip_build = skip_build
         self._set_attr("compile_type", compile_type, CompileTypes)
@@ -59,6 +90,31 @@ class CompilerConfig(_ConfigBase):
         self._set_attr("edit_linker", edit_linker, AutoBoolType)
         self.expand_size = expand_size
         self.output = output
+        self.partial_jobs = partial_jobs
+        self.skip_unchanged = skip_unchanged
+        # A cache hit leaves the object files of the tree as they are
+        self.use_cache = use_cache
+        self.use_worktree = use_worktree
+        # None lets the governor choose the job count of parallel builds
+        self.build_jobs = build_jobs
+        self.low_priority = low_priority
+        # The partial builds and the final link run in one invocation
+        self.batch_build = batch_build
+        # Used only if the environment script and the build command are
+        # configured, see compiler_environment
+        self.use_environment_cache = use_environment_cache
+        # The builds are stopped on the first compiler error
+        self.fail_fast = fail_fast
+        # All the components are built even if some fail, not on fail fast
+        self.keep_going = keep_going and not fail_fast
+
+    @staticmethod
+    def _get_enum_fields():
+        return {
+            "target_type": TargetTypes,
+            "compile_type": CompileTypes,
+            "edit_linker": AutoBoolType,
+        }
 
 
 class TransferConfig(_ConfigBase):
@@ -79,6 +135,14 @@ class TransferConfig(_ConfigBase):
         self._set_attr("action", action, CopyActions)
         self.reboot = reboot
 
+    @staticmethod
+    def _get_enum_fields():
+        return {
+            "target_machine": TargetMachines,
+            "cpu_type": CPUTypes,
+            "action": CopyActions,
+        }
+
 
 class ExitCodes(enum.Enum):
     "The return codes and its means"
@@ -97,6 +161,7 @@ class ExitCodes(enum.Enum):
     LINUX_REBOOT_ERROR = enum.auto()
     GIT_ERROR = enum.auto()
     ALREADY_RUNNING = enum.auto()
+    CANCELED = enum.auto()
 
 
 class UnknownType(Exception):
@@ -124,9 +189,10 @@ class Lock:
 
     @classmethod
     def _get_process_list(cls, filter_on):
-        output = subprocess.check_output(["tasklist.exe", "-V"])
+        output = check_output(["tasklist.exe", "-V"], cwd=None,
+                              timeout=LOCK_TIMEOUT, errors="replace")
         instances = []
-        for out in output.decode(errors="replace").splitlines():
+        for out in output.splitlines():
             if filter_on in out:
                 process = out.split()
                 if "python" in " ".join(process[11:]):
@@ -155,8 +221,9 @@ class Lock:
             if pid == on_pid:
                 continue
 
-            subprocess.check_output(
-                ["taskkill.exe", "/F", "/PID", pid]
+            check_output(
+                ["taskkill.exe", "/F", "/PID", pid],
+                cwd=None, timeout=LOCK_TIMEOUT
             )
 
     @classmethod
@@ -0,0 +1,317 @@
+"""
+The build history.
+
+Durations of each run and its phases are stored in a local SQLite
+database. They are used for predicting the progress and the remaining
+time of the next builds, and for spotting the machines whose builds
+have become slower.
+"""
+import os
+import time
+import socket
+import sqlite3
+import statistics
+
+from compiler_timing import get_timeline
+
+HISTORY_FILE = os.path.join(
+    os.path.expanduser("~"),
+    ".compiler_history.db"
+)
+SAMPLE_SIZE = 10
+RECORDED_PHASES = (
+    "setup", "change detection", "partial compile", "component",
+    "final link", "full build", "compile", "transfer", "ssh connect",
+    "share access", "grant permissions", "copy action", "upload", "reboot",
+    "cache lookup", "cache restore", "cache store",
+    "remote cache fetch", "remote cache upload", "worktree sync",
+    "batch build",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    machine TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    target_type TEXT NOT NULL,
+    compile_type TEXT NOT NULL,
+    successful INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    name TEXT NOT NULL,
+    component TEXT NOT NULL DEFAULT '',
+    duration REAL NOT NULL,
+    filesets INTEGER,
+    successful INTEGER
+);
+CREATE INDEX IF NOT EXISTS phases_lookup ON phases(name, component);
+CREATE INDEX IF NOT EXISTS runs_lookup ON runs(machine, target_type, compile_type);
+CREATE TABLE IF NOT EXISTS parallelism (
+    machine TEXT NOT NULL,
+    started REAL NOT NULL,
+    target_type TEXT NOT NULL,
+    compile_type TEXT NOT NULL,
+    jobs INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    filesets INTEGER
+);
+CREATE INDEX IF NOT EXISTS parallelism_lookup
+    ON parallelism(machine, target_type, compile_type);
+"""
+
+
+class Estimate:
+    "Expected duration and fileset count of a phase"
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, duration=None, filesets=None, samples=0):
+        self.duration = duration
+        self.filesets = filesets
+        self.samples = samples
+
+    def __bool__(self):
+        return bool(self.samples)
+
+    def __repr__(self):
+        return "Estimate(duration={0!r}, filesets={1!r}, samples={2})".format(
+            self.duration, self.filesets, self.samples
+        )
+
+
+class BuildHistory:
+    "Stores the durations of the runs, predicts the next ones"
+
+    def __init__(self, filename=HISTORY_FILE, machine=None):
+        self.filename = filename
+        self.machine = machine or socket.gethostname()
+        with self._connect() as connection:
+            connection.executescript(_SCHEMA)
+            columns = [
+                row[1] for row in
+                connection.execute("PRAGMA table_info(parallelism)")
+            ]
+            if "filesets" not in columns:
+                # Created before the durations were normalized
+                connection.execute(
+                    "ALTER TABLE parallelism ADD COLUMN filesets INTEGER"
+                )
+
+    def _connect(self):
+        return sqlite3.connect(self.filename, timeout=10)
+
+    def record(self, timeline, target_type, compile_type, successful):
+        "stores the spans of given timeline as a run"
+        report = timeline.to_dict()
+        return self.record_spans(
+            report["spans"], report["start"], report["duration"],
+            target_type, compile_type, successful
+        )
+
+    def record_spans(self, spans, start, duration, target_type,
+                     compile_type, successful):
+        """stores given spans as a run, e.g., the ones of a variant of
+        a pipeline"""
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "INSERT INTO runs (machine, started, duration, target_type, "
+                "compile_type, successful) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.machine, start, duration,
+                 target_type.name, compile_type.name, int(bool(successful)))
+            )
+            run_id = cursor.lastrowid
+            connection.executemany(
+                "INSERT INTO phases (run_id, name, component, duration, "
+                "filesets, successful) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (run_id, span["name"], span.get("component") or '',
+                     span["duration"], span.get("filesets"),
+                     None if span.get("successful") is None
+                     else int(span["successful"]))
+                    for span in spans
+                    if span["name"] in RECORDED_PHASES
+                    and span["duration"] is not None
+                ]
+            )
+
+        return run_id
+
+    def estimate(self, name, target_type, compile_type, component=None):
+        "returns the expected duration and fileset count of given phase"
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT phases.duration, phases.filesets FROM phases "
+                "JOIN runs ON runs.id = phases.run_id "
+                "WHERE runs.machine = ? AND runs.target_type = ? "
+                "AND runs.compile_type = ? AND phases.name = ? "
+                "AND phases.component = ? "
+                "AND COALESCE(phases.successful, 1) = 1 "
+                "ORDER BY runs.started DESC LIMIT ?",
+                (self.machine, target_type.name, compile_type.name,
+                 name, component or '', SAMPLE_SIZE)
+            ).fetchall()
+
+        if not rows:
+            return Estimate()
+
+        filesets = [row[1] for row in rows if row[1]]
+        return Estimate(
+            duration=statistics.median(row[0] for row in rows),
+            filesets=int(statistics.median(filesets)) if filesets else None,
+            samples=len(rows)
+        )
+
+    def record_parallelism(self, target_type, compile_type, jobs, duration,
+                           filesets):
+        """stores the wall-clock time of a build with given job count and
+        the number of the filesets that it has compiled"""
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO parallelism (machine, started, target_type, "
+                "compile_type, jobs, duration, filesets) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.machine, time.time(), target_type.name,
+                 compile_type.name, jobs, duration, filesets)
+            )
+
+    def get_parallelism(self, target_type, compile_type):
+        """returns the expected duration per fileset of the builds per job
+        count, so the builds of the different changes are comparable"""
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT jobs, duration, filesets FROM parallelism "
+                "WHERE machine = ? AND target_type = ? AND compile_type = ? "
+                "AND filesets > 0 ORDER BY started DESC",
+                (self.machine, target_type.name, compile_type.name)
+            ).fetchall()
+
+        samples = {}
+        for jobs, duration, filesets in rows:
+            if len(samples.setdefault(jobs, [])) < SAMPLE_SIZE:
+                samples[jobs].append((duration / filesets, filesets))
+
+        return {
+            jobs: Estimate(
+                duration=statistics.median(value[0] for value in values),
+                filesets=int(statistics.median(value[1] for value in values)),
+                samples=len(values)
+            )
+            for jobs, values in samples.items()
+        }
+
+    def regressions(self, name="compile", threshold=1.2, recent=5):
+        """Returns the machines whose recent runs are slower than before.
+        Yields (machine, target type, compile type, before, recent)"""
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT runs.machine, runs.target_type, runs.compile_type, "
+                "phases.duration FROM phases "
+                "JOIN runs ON runs.id = phases.run_id "
+                "WHERE phases.name = ? AND runs.successful = 1 "
+                "ORDER BY runs.started DESC",
+                (name,)
+            ).fetchall()
+
+        groups = {}
+        for machine, target_type, compile_type, duration in rows:
+            groups.setdefault(
+                (machine, target_type, compile_type), []
+            ).append(duration)
+
+        for key, durations in groups.items():
+            if len(durations) <= recent:
+                continue
+            recent_median = statistics.median(durations[:recent])
+            before_median = statistics.median(durations[recent:])
+            if before_median and recent_median / before_median >= threshold:
+                yield key + (before_median, recent_median)
+
+
+def format_regressions(regressions):
+    "returns the report of given regressions, see BuildHistory.regressions"
+    lines = [
+        "{0} {1}/{2}: {3} before, {4} recently (+{5:.0%})".format(
+            machine, target_type, compile_type, format_duration(before),
+            format_duration(recent), recent / before - 1
+        )
+        for machine, target_type, compile_type, before, recent in regressions
+    ]
+    if not lines:
+        return "No build has become slower."
+    return "The builds which have become slower:\n" + '\n'.join(lines)
+
+
+def format_duration(seconds):
+    "returns given seconds as 1h02m03s"
+    seconds = int(max(seconds, 0))
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if hours:
+        return "{0}h{1:02}m{2:02}s".format(hours, minutes, seconds)
+    if minutes:
+        return "{0}m{1:02}s".format(minutes, seconds)
+    return "{0}s".format(seconds)
+
+
+class Progress:
+    """Predicts the percent complete and the remaining time of a phase
+    from its history, by counting the compiled filesets."""
+
+    def __init__(self, estimate, report, label=""):
+        self.estimate = estimate
+        self.label = label
+        self._report = report
+        self._started = time.time()
+        self._last_percent = None
+
+    def get_eta(self, filesets):
+        "returns the percent complete and the remaining seconds"
+        elapsed = time.time() - self._started
+        expected_filesets = self.estimate.filesets
+        expected_duration = self.estimate.duration
+
+        percent = None
+        remaining = []
+        if expected_filesets:
+            percent = min(99, int(100 * filesets / expected_filesets))
+            if filesets:
+                remaining.append(
+                    elapsed * max(expected_filesets - filesets, 0) / filesets
+                )
+        if expected_duration:
+            if percent is None:
+                percent = min(99, int(100 * elapsed / expected_duration))
+            remaining.append(max(expected_duration - elapsed, 0))
+
+        if not remaining:
+            return percent, None
+        return percent, sum(remaining) / len(remaining)
+
+    def update(self, filesets):
+        "reports the progress if the percent has changed"
+        if not self.estimate:
+            return
+
+        percent, remaining = self.get_eta(filesets)
+        if percent is None or percent == self._last_percent:
+            return
+        self._last_percent = percent
+
+        text = "[{0:>3}%]".format(percent)
+        if remaining is not None:
+            text += " ETA {0}".format(format_duration(remaining))
+        if self.label:
+            text += " {0}".format(self.label)
+        self._report(text)
+
+
+def record_current_run(target_type, compile_type, successful):
+    "stores the current timeline in the history, ignores the failures"
+    try:
+        BuildHistory().record(
+            get_timeline(), target_type, compile_type, successful
+        )
+    except sqlite3.Error:
+        return False
+    return True
@@ -0,0 +1,139 @@
+"""
+Writes the log file in the background.
+
+Messages are queued and written in batches by a worker thread,
+coloring is stripped once per batch. The file is rotated when it
+exceeds the size limit and the old files are gzip compressed.
+
+If the file cannot be written, the worker stops and keeps the error,
+the next write and the close raise it. So, nothing is queued anymore.
+"""
+import os
+import re
+import gzip
+import queue
+import shutil
+import threading
+
+from compiler_config import CONFIGURATIONS
+
+ANSI_ESCAPE = re.compile(r'\x1B[\(\[][0-?]*[ -/]*[@-~]')
+DEFAULT_MAX_SIZE = 50 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 3
+FLUSH_INTERVAL = 0.5
+BATCH_SIZE = 4096
+
+_CLOSE = object()
+
+
+class LogWriter:
+    "A file-like object that writes to the log file in the background"
+
+    def __init__(self, filename, *,
+                 max_size=None, backup_count=None, compress=None):
+        self.filename = os.path.abspath(filename)
+        self.max_size = int(CONFIGURATIONS.get(
+            "log_max_size", DEFAULT_MAX_SIZE
+        ) if max_size is None else max_size)
+        self.backup_count = int(CONFIGURATIONS.get(
+            "log_backup_count", DEFAULT_BACKUP_COUNT
+        ) if backup_count is None else backup_count)
+        self.compress = bool(CONFIGURATIONS.get(
+            "log_compress", True
+        ) if compress is None else compress)
+
+        self._queue = queue.SimpleQueue()
+        # The write error which has stopped the worker
+        self.error = None
+        self._file = open(self.filename, 'w', encoding="utf-8", errors="replace")
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"{__file__}::LogWriter",
+            daemon=True
+        )
+        self._thread.start()
+
+    def write(self, text):
+        "queues given text, never blocks. Raises the error of the worker"
+        if self.error is not None:
+            raise self.error
+        if text:
+            self._queue.put(text)
+        return len(text)
+
+    def flush(self):
+        "The worker flushes after each batch"
+
+    def close(self):
+        """writes the remaining messages and closes the file.
+        Raises the error of the worker if the log is incomplete."""
+        if self._thread.is_alive():
+            self._queue.put(_CLOSE)
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _get_batch(self):
+        "waits for the first message then collects the queued ones"
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=FLUSH_INTERVAL))
+            while len(batch) < BATCH_SIZE:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        return batch
+
+    def _run(self):
+        try:
+            self._write_batches()
+        except OSError as error:
+            self.error = error
+        finally:
+            try:
+                self._file.close()
+            except OSError as error:
+                self.error = self.error or error
+
+    def _write_batches(self):
+        is_active = True
+        while is_active:
+            batch = self._get_batch()
+            if _CLOSE in batch:
+                batch = batch[:batch.index(_CLOSE)]
+                is_active = False
+
+            if not batch:
+                continue
+
+            self._file.write(ANSI_ESCAPE.sub('', ''.join(batch)))
+            self._file.flush()
+
+            if self.max_size and self._file.tell() >= self.max_size:
+                self._rotate()
+
+    def _backup_name(self, index):
+        name = "{0}.{1}".format(self.filename, index)
+        if self.compress:
+            name += ".gz"
+        return name
+
+    def _rotate(self):
+        "moves the current file to the backups and opens a new one"
+        self._file.close()
+
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                source = self._backup_name(index)
+                if os.path.exists(source):
+                    os.replace(source, self._backup_name(index + 1))
+
+            if self.compress:
+                with open(self.filename, 'rb') as source, \
+                        gzip.open(self._backup_name(1), 'wb') as target:
+                    shutil.copyfileobj(source, target)
+            else:
+                os.replace(self.filename, self._backup_name(1))
+
+        self._file = open(self.filename, 'w', encoding="utf-8", errors="replace")
@@ -0,0 +1,222 @@
+"""
+The build manifest. Keeps the content hash of each component
+that has been built successfully, so that unchanged components
+can be skipped on partial compile.
+
+The content is hashed before the build, so the edits saved while it
+runs are built next time. A component is also built again if the
+compile string or the include directories change: the configured shared
+ones, and the ones out of the component which its build file refers to.
+Skipping is off by default, the headers of the other include directories
+are not known.
+"""
+import os
+import re
+import json
+import hashlib
+import threading
+import xml.etree.ElementTree as ElementTree
+
+from compiler_config import CONFIGURATIONS
+
+MANIFEST_FILE = os.path.join(
+    os.path.expanduser("~"),
+    ".compiler_manifest"
+)
+# The headers which the components share, relative to the git path
+SHARED_INCLUDE_DIRS = CONFIGURATIONS.get("shared_include_dirs", [])
+IGNORED_DIRECTORIES = (".git", ".svn")
+CHUNK_SIZE = 1024 * 1024
+BUILD_FILE = "build.xml"
+# The elements and the attributes of the include paths in the build files
+_INCLUDE_ELEMENTS = ("includepath", "sysincludepath")
+_INCLUDE_ATTRIBUTES = ("path", "location", "dir")
+# The include options of the compiler arguments, e.g., -I../common
+_INCLUDE_OPTION = re.compile(r'(?:^|\s)[-/]I\s*("[^"]+"|\S+)')
+
+
+def _hash_file(path):
+    "returns the hash of the content of given file"
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def hash_directory(path, known_files=None):
+    """Returns the content hash of given directory and the hashes of its files.
+    known_files is the result of a previous call, the files whose size and
+    modification time did not change are not read again."""
+    known_files = known_files or {}
+    files = {}
+
+    for directory, directories, filenames in os.walk(path):
+        directories[:] = sorted(
+            name for name in directories if name not in IGNORED_DIRECTORIES
+        )
+        for filename in filenames:
+            full_path = os.path.join(directory, filename)
+            relative_path = os.path.relpath(full_path, path).replace('\\', '/')
+            try:
+                stat = os.stat(full_path)
+            except OSError:
+                continue
+
+            known = known_files.get(relative_path)
+            if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+                files[relative_path] = known
+                continue
+
+            try:
+                files[relative_path] = [
+                    stat.st_size, stat.st_mtime_ns, _hash_file(full_path)
+                ]
+            except OSError:
+                continue
+
+    digest = hashlib.sha1()
+    for relative_path in sorted(files):
+        digest.update("{0}\0{1}\n".format(
+            relative_path, files[relative_path][2]
+        ).encode())
+
+    return digest.hexdigest(), files
+
+
+def _get_include_values(build_file):
+    "yields the include paths written in given build file"
+    tree = ElementTree.parse(build_file)
+    for element in tree.iter():
+        if element.tag in _INCLUDE_ELEMENTS:
+            for attribute in _INCLUDE_ATTRIBUTES:
+                if element.get(attribute):
+                    yield from element.get(attribute).split(';')
+        for attribute in ("value", "line"):
+            for match in _INCLUDE_OPTION.finditer(element.get(attribute, '')):
+                yield match.group(1).strip('"')
+
+
+def get_include_dirs(path):
+    """Returns the include directories out of given component which its
+    build file refers to. The ones with the Ant properties are not known."""
+    try:
+        values = list(_get_include_values(os.path.join(path, BUILD_FILE)))
+    except (OSError, ElementTree.ParseError):
+        return []
+
+    component = os.path.normcase(os.path.abspath(path))
+    directories = set()
+    for value in values:
+        value = value.strip()
+        if not value or "${" in value:
+            continue
+        directory = os.path.abspath(os.path.join(path, value))
+        try:
+            is_inside = os.path.commonpath(
+                [os.path.normcase(directory), component]
+            ) == component
+        except ValueError:
+            # On another drive
+            is_inside = False
+        if not is_inside and os.path.isdir(directory):
+            directories.add(directory)
+    return sorted(directories)
+
+
+class BuildManifest:
+    "Content hashes of the components which are built successfully"
+
+    def __init__(self, filename=MANIFEST_FILE):
+        self._filename = filename
+        self._lock = threading.Lock()
+        self._entries = self._read()
+
+    def _read(self):
+        try:
+            with open(self._filename) as manifest_file:
+                entries = json.loads(manifest_file.read())
+        except (FileNotFoundError, json.JSONDecodeError, OSError):
+            return {}
+
+        if not isinstance(entries, dict):
+            return {}
+        return entries
+
+    def save(self):
+        "writes the manifest to the file"
+        with self._lock:
+            content = json.dumps(self._entries)
+
+        temp_file = "{0}.{1}.tmp".format(self._filename, os.getpid())
+        with open(temp_file, 'w') as manifest_file:
+            manifest_file.write(content)
+        os.replace(temp_file, self._filename)
+
+    @staticmethod
+    def _key(path, target_type, compile_type):
+        return "|".join((
+            os.path.normcase(os.path.abspath(path)),
+            target_type.name,
+            compile_type.name
+        ))
+
+    def get_context(self, compile_string, directories=()):
+        """returns the digest of what all the components are built with,
+        the compile string and the shared include directories"""
+        digest = hashlib.sha1(compile_string.strip().encode())
+        for directory in directories:
+            key = "shared|" + os.path.normcase(os.path.abspath(directory))
+            with self._lock:
+                known_files = self._entries.get(key, {}).get("files")
+
+            directory_digest, files = hash_directory(directory, known_files)
+            with self._lock:
+                self._entries[key] = {"files": files}
+            digest.update("\0{0}".format(directory_digest).encode())
+
+        return digest.hexdigest()
+
+    def get_state(self, path, target_type, compile_type, context=""):
+        """returns the current content of given component, it is recorded
+        once the component is built from it"""
+        with self._lock:
+            known_files = self._entries.get(
+                self._key(path, target_type, compile_type), {}
+            ).get("files")
+
+        digest, files = hash_directory(path, known_files)
+        return {
+            "target_type": target_type.name,
+            "compile_type": compile_type.name,
+            "digest": digest,
+            "context": context,
+            "files": files,
+        }
+
+    def is_unchanged(self, path, target_type, compile_type, state):
+        """returns True if given state of the component, see get_state,
+        is the one of its last successful build"""
+        with self._lock:
+            entry = self._entries.get(
+                self._key(path, target_type, compile_type)
+            )
+
+        if entry is None or not os.path.isdir(path):
+            return False
+
+        return entry["digest"] == state["digest"] \
+            and entry.get("context") == state["context"]
+
+    def record(self, path, target_type, compile_type, state):
+        "records given state of the component, taken before its build"
+        with self._lock:
+            self._entries[self._key(path, target_type, compile_type)] = state
+
+    def forget(self, path, target_type, compile_type):
+        "removes given component, it will be built next time"
+        with self._lock:
+            self._entries.pop(
+                self._key(path, target_type, compile_type), None
+            )
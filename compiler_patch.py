@@ -0,0 +1,197 @@
+"""
+Patches the checked-in files, e.g., linker script and debug configuration.
+
+The desired content is always computed from the pristine content, and the
+file is written atomically only if the bytes differ. So, repeated runs are
+no-ops and the modification time, which triggers the rebuilds, is kept.
+The applied state is recorded, pristine files can be restored anytime.
+"""
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+PATCH_STATE_FILE = os.path.join(
+    os.path.expanduser("~"),
+    ".compiler_patches"
+)
+# Text is decoded byte by byte, so line endings and encoding are kept
+ENCODING = "latin-1"
+
+
+def _hash(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def _read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def write_atomic(path, content):
+    """Writes given content to a temporary file and moves it over given path.
+    So, the file is either pristine or patched, never half written."""
+    temp_file = "{0}.{1}.tmp".format(path, os.getpid())
+    with open(temp_file, 'wb') as file:
+        file.write(content)
+    if os.path.exists(path):
+        shutil.copymode(path, temp_file)
+    os.replace(temp_file, path)
+
+
+class PatchEngine:
+    "Applies the patches idempotently, restores the pristine files"
+
+    def __init__(self, state_file=PATCH_STATE_FILE):
+        self._state_file = state_file
+        self._pristine_dir = state_file + ".d"
+        self._lock = threading.Lock()
+        self._state = self._read_state()
+
+    def _read_state(self):
+        try:
+            with open(self._state_file) as state_file:
+                state = json.loads(state_file.read())
+        except (FileNotFoundError, json.JSONDecodeError, OSError):
+            return {}
+        return state if isinstance(state, dict) else {}
+
+    def _save_state(self):
+        content = json.dumps(self._state, indent=4).encode()
+        write_atomic(self._state_file, content)
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    def _pristine_path(self, key):
+        return os.path.join(
+            self._pristine_dir, _hash(key.encode()) + ".orig"
+        )
+
+    def _get_pristine(self, key, current):
+        "returns the pristine content, records it if the file changed outside"
+        entry = self._state.get(key)
+        current_hash = _hash(current)
+
+        if entry is not None:
+            if current_hash == entry["pristine_hash"]:
+                return current
+            if current_hash == entry["applied_hash"]:
+                try:
+                    pristine = _read(self._pristine_path(key))
+                except OSError:
+                    pristine = None
+                if pristine is not None \
+                        and _hash(pristine) == entry["pristine_hash"]:
+                    return pristine
+
+        # First patch, or the file has changed since the last patch,
+        # e.g., checkout. The current content is pristine.
+        os.makedirs(self._pristine_dir, exist_ok=True)
+        write_atomic(self._pristine_path(key), current)
+        self._state[key] = {
+            "path": key,
+            "pristine_hash": current_hash,
+            "applied_hash": current_hash,
+            "patch": None,
+        }
+        return current
+
+    def apply(self, path, patch, transform):
+        """Applies the transform onto the pristine content of given file.
+        transform takes and returns the text. patch names the applied state.
+        Returns True if the file is written, False if already up to date."""
+        key = self._key(path)
+        with self._lock:
+            current = _read(key)
+            pristine = self._get_pristine(key, current)
+
+            desired = transform(pristine.decode(ENCODING)).encode(ENCODING)
+            written = desired != current
+            if written:
+                write_atomic(key, desired)
+
+            self._state[key].update(applied_hash=_hash(desired), patch=patch)
+            self._save_state()
+
+        return written
+
+    def is_applied(self, path, patch=None):
+        """Returns True if the file still has the content written by us.
+        If patch is given, it should be the applied one too."""
+        key = self._key(path)
+        with self._lock:
+            entry = self._state.get(key)
+            if entry is None or entry["patch"] is None:
+                return False
+            if patch is not None and entry["patch"] != patch:
+                return False
+            try:
+                return _hash(_read(key)) == entry["applied_hash"]
+            except OSError:
+                return False
+
+    def get_pristine(self, path):
+        "returns the pristine content if the file has our patch, else None"
+        key = self._key(path)
+        if not self.is_applied(key):
+            return None
+        with self._lock:
+            entry = self._state.get(key)
+            try:
+                pristine = _read(self._pristine_path(key))
+            except OSError:
+                return None
+        if entry is None or _hash(pristine) != entry["pristine_hash"]:
+            return None
+        return pristine
+
+    def restore(self, path):
+        """Writes the pristine content back.
+        Returns False if the file has been changed by someone else."""
+        key = self._key(path)
+        with self._lock:
+            entry = self._state.get(key)
+            if entry is None:
+                return False
+
+            restored = False
+            try:
+                current = _read(key)
+                pristine = _read(self._pristine_path(key))
+            except OSError:
+                current = pristine = None
+
+            if current is not None and _hash(current) == entry["applied_hash"] \
+                    and _hash(pristine) == entry["pristine_hash"]:
+                if current != pristine:
+                    # A new modification time, so the builds which have
+                    # used the patched content are not taken as up to date
+                    write_atomic(key, pristine)
+                restored = True
+
+            del self._state[key]
+            try:
+                os.unlink(self._pristine_path(key))
+            except OSError:
+                pass
+            self._save_state()
+
+        return restored
+
+    def restore_all(self):
+        "restores all patched files, returns the paths and the results"
+        with self._lock:
+            paths = [entry["path"] for entry in self._state.values()]
+
+        return {path: self.restore(path) for path in paths}
+
+    def get_state(self):
+        "returns the applied patches"
+        with self._lock:
+            return {
+                entry["path"]: entry["patch"]
+                for entry in self._state.values()
+            }
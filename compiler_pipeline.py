@@ -0,0 +1,227 @@
+"""
+Builds several variants and transfers their executables in a pipeline.
+
+The variants, e.g., both target types, are built one after another.
+Each finished executable is copied to a staging directory and queued for
+the transfer stage, which uploads it while the next variant is compiling.
+So, the total time approaches the longer one of the builds and the
+transfers instead of their sum. The staged copies keep the executables
+safe from the next build, which may write to the same directory.
+
+A failed build or transfer stops the builds which have not started, the
+queued transfers of the finished builds are still done.
+
+Each variant is stored in the build history as a run of its own, with
+the spans of its build and its transfers.
+"""
+import sys
+import os
+import time
+import queue
+import shutil
+import sqlite3
+import tempfile
+import threading
+
+from compiler_timing import span, get_timeline
+from compiler_history import BuildHistory
+from compiler_helper import CompilerConfig, TransferConfig, UnknownType
+from compiler_gui_support import Colored, operation, get_build_root, \
+    start_compile, start_transfer
+
+
+class Variant:
+    "A build and the transfers of its executables"
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, compiler_config, transfer_configs=()):
+        if not isinstance(compiler_config, CompilerConfig):
+            raise UnknownType(compiler_config, CompilerConfig)
+        for transfer_config in transfer_configs:
+            if not isinstance(transfer_config, TransferConfig):
+                raise UnknownType(transfer_config, TransferConfig)
+
+        self.compiler_config = compiler_config
+        self.transfer_configs = [
+            transfer_config for transfer_config in transfer_configs
+            if not transfer_config.skip_transfer
+        ]
+
+    @property
+    def name(self):
+        "returns the name of the variant, e.g., IPC/OPTIMIZED_AND_LINK"
+        return "{0}/{1}".format(
+            self.compiler_config.target_type.name,
+            self.compiler_config.compile_type.name
+        )
+
+
+class Pipeline:
+    "Runs the build and the transfer stages, connected by a queue"
+
+    def __init__(self, variants, root):
+        self.variants = list(variants)
+        self.root = root
+        self.build_time = 0.0
+        self.transfer_time = 0.0
+
+        self._transfers = queue.Queue()
+        self._errors = []
+        self._failed = threading.Event()
+        self._staging = None
+
+    def _stage(self, transfer_config, build_root, index):
+        """returns a copy of the transfer configurations whose executable
+        is copied to the staging directory"""
+        transfer_config = TransferConfig.from_dict(transfer_config.to_dict())
+        source = os.path.join(build_root, transfer_config.target_file)
+        if not os.path.isfile(source):
+            # The transfer stage reports it
+            transfer_config.target_file = source
+            return transfer_config
+
+        directory = os.path.join(self._staging, str(index))
+        os.makedirs(directory, exist_ok=True)
+        transfer_config.target_file = os.path.join(
+            directory, os.path.basename(source)
+        )
+        shutil.copy2(source, transfer_config.target_file)
+        return transfer_config
+
+    def _build_stage(self):
+        for index, variant in enumerate(self.variants):
+            if self._failed.is_set():
+                Colored.warning("\nBuild skipped for {0}, the pipeline "
+                                "has failed.".format(variant.name))
+                continue
+
+            compiler_config = variant.compiler_config
+            started = time.time()
+            with span("compile", variant=variant.name, index=index):
+                build_root = get_build_root(compiler_config, self.root)
+                if compiler_config.skip_build:
+                    Colored.warning("\nBuild skipped for {0}.\n".format(
+                        variant.name
+                    ))
+                else:
+                    Colored.info("\nBuild started for {0}".format(
+                        variant.name
+                    ))
+                    start_compile(compiler_config, build_root)
+            self.build_time += time.time() - started
+
+            for transfer_config in variant.transfer_configs:
+                self._transfers.put((index, variant, self._stage(
+                    transfer_config, build_root, index
+                )))
+
+    def _transfer_stage(self):
+        # pylint: disable=broad-except
+        while True:
+            item = self._transfers.get()
+            if item is None:
+                return
+
+            index, variant, transfer_config = item
+            Colored.info("\nTransfer started for {0} to {1}".format(
+                variant.name, transfer_config.ip_address
+            ))
+            started = time.time()
+            try:
+                with span("transfer", variant=variant.name, index=index,
+                          target_ip=transfer_config.ip_address,
+                          target_machine=transfer_config.target_machine.name):
+                    start_transfer(transfer_config, self.root)
+            except Exception as error:
+                self._errors.append(error)
+                self._failed.set()
+            finally:
+                self.transfer_time += time.time() - started
+
+    def run(self):
+        "builds and transfers all variants, raises the first error"
+        # pylint: disable=broad-except
+        self._staging = tempfile.mkdtemp(prefix="compiler_pipeline_")
+        transfer_thread = threading.Thread(
+            target=self._transfer_stage, name="transfer-stage", daemon=True
+        )
+        transfer_thread.start()
+        started = time.time()
+        try:
+            self._build_stage()
+        except Exception as error:
+            self._errors.insert(0, error)
+            self._failed.set()
+        finally:
+            self._transfers.put(None)
+            transfer_thread.join()
+            shutil.rmtree(self._staging, ignore_errors=True)
+
+        Colored.info(
+            "\nPipeline: {0:.1f}s building, {1:.1f}s transferring, "
+            "{2:.1f}s in total".format(
+                self.build_time, self.transfer_time, time.time() - started
+            )
+        )
+        if self._errors:
+            raise self._errors[0]
+
+
+def _get_variant_spans(spans, index):
+    """returns the build and the transfer spans of the variant at given
+    index, then all of its spans, i.e., the ones started in them on the
+    same thread"""
+    stages = [
+        stage for stage in spans
+        if stage.get("index") == index and stage.get("variant")
+        and stage["duration"] is not None
+    ]
+    return stages, [
+        record for record in spans
+        if record["duration"] is not None and any(
+            record["thread"] == stage["thread"]
+            and stage["start"] <= record["start"] <= stage["end"]
+            for stage in stages
+        )
+    ]
+
+
+def _record_runs(variants):
+    "stores each built variant as a run, ignores the failures"
+    spans = get_timeline().get_spans()
+    try:
+        history = BuildHistory()
+        for index, variant in enumerate(variants):
+            stages, variant_spans = _get_variant_spans(spans, index)
+            if not any(stage["name"] == "compile" for stage in stages):
+                # Skipped after a failure
+                continue
+            start = min(stage["start"] for stage in stages)
+            history.record_spans(
+                variant_spans, start,
+                max(stage["end"] for stage in stages) - start,
+                variant.compiler_config.target_type,
+                variant.compiler_config.compile_type,
+                not any("error" in stage for stage in stages)
+            )
+    except sqlite3.Error:
+        return False
+    return True
+
+
+def start_pipeline(variants, stdout=sys.stdout, root=None, cancel_event=None):
+    """Builds the variants and transfers their executables in a pipeline.
+    root is the directory that contains the repositories, the commands
+    are stopped when cancel_event is set, as in start_operation."""
+    variants = list(variants)
+    if not variants:
+        return
+
+    with operation(
+            variants[0].compiler_config, stdout, root, cancel_event,
+            name="pipeline", record=False,
+            variants=[variant.name for variant in variants]) as root:
+        try:
+            Pipeline(variants, root).run()
+        finally:
+            _record_runs(variants)
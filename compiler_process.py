@@ -0,0 +1,429 @@
+"""
+Executes the commands on the system.
+
+Every command carries its own working directory and environment,
+the working directory of the process is never changed. So that,
+builds, git checks and transfers can run at the same time.
+
+The commands are given as argv lists and started without a shell. Each of
+them is recorded as a "command" span on the timeline with its spawn
+latency, duration, exit code and output size.
+
+The commands run in their own process groups and are tracked. On cancel,
+their whole process trees are stopped, gracefully first, forcefully
+after a timeout, so no compiler is left holding the cores and the files.
+"""
+import os
+import time
+import codecs
+import locale
+import signal
+import threading
+import subprocess
+
+from compiler_config import CONFIGURATIONS
+from compiler_timing import add_span
+
+CHUNK_SIZE = 64 * 1024
+CANCEL_TIMEOUT = CONFIGURATIONS.get("cancel_timeout", 10)
+# The default timeout of the short commands, e.g., git, transfer commands
+COMMAND_TIMEOUT = CONFIGURATIONS.get("command_timeout", 300)
+KILL_TIMEOUT = 5
+# Added to the niceness of the low priority commands on POSIX
+LOW_PRIORITY_NICENESS = CONFIGURATIONS.get("low_priority_niceness", 10)
+_POLL_INTERVAL = 0.1
+
+_RUNNING = set()
+_RUNNING_LOCK = threading.Lock()
+_CANCELED = threading.Event()
+
+
+class Canceled(Exception):
+    "raises when the operation is canceled"
+
+
+def get_environment(**overrides):
+    "returns a copy of the current environment with given overrides"
+    environment = os.environ.copy()
+    environment.update(overrides)
+
+    return environment
+
+
+def read_lines(stream, encoding=None, chunk_size=CHUNK_SIZE):
+    """Reads given binary stream in large chunks and decodes incrementally.
+    Yields the lines as soon as they are complete"""
+    decoder = codecs.getincrementaldecoder(
+        encoding or locale.getpreferredencoding(False)
+    )(errors="replace")
+    read = getattr(stream, "read1", stream.read)
+    pending = ''
+
+    while True:
+        chunk = read(chunk_size)
+        if not chunk:
+            break
+
+        text = pending + decoder.decode(chunk)
+        index = text.rfind('\n')
+        if index == -1:
+            pending = text
+            continue
+
+        pending = text[index + 1:]
+        lines = text[:index + 1].replace('\r\n', '\n').split('\n')
+        for line in lines[:-1]:
+            yield line + '\n'
+
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield pending
+
+
+def get_program(command):
+    "returns the name of the program, the arguments may contain secrets"
+    if isinstance(command, str):
+        command = command.split()
+    return os.path.basename(command[0]) if command else ''
+
+
+def _start(command, low_priority=False, **kwargs):
+    """starts the command in a new process group and tracks it.
+    An argv list is started directly, a string through the shell.
+    The children of a low priority command inherit its priority."""
+    if os.name == "nt":
+        kwargs["creationflags"] = kwargs.get("creationflags", 0) | \
+            subprocess.CREATE_NEW_PROCESS_GROUP
+        if low_priority:
+            kwargs["creationflags"] |= subprocess.BELOW_NORMAL_PRIORITY_CLASS
+    else:
+        kwargs["start_new_session"] = True
+
+    if _CANCELED.is_set():
+        raise Canceled
+    started = time.time()
+    spawning = time.perf_counter()
+    popen = subprocess.Popen(
+        command, shell=isinstance(command, str), **kwargs
+    )
+    popen.started = started
+    popen.spawn_latency = time.perf_counter() - spawning
+    if low_priority and os.name != "nt":
+        try:
+            os.setpriority(os.PRIO_PROCESS, popen.pid, min(
+                os.getpriority(os.PRIO_PROCESS, 0) + LOW_PRIORITY_NICENESS, 19
+            ))
+        except OSError:
+            pass
+    with _RUNNING_LOCK:
+        _RUNNING.add(popen)
+
+    if _CANCELED.is_set():
+        # Canceled while starting, it would not be stopped otherwise
+        _finish(popen, command)
+    return popen
+
+
+def _start_watchdog(popen, timeout):
+    "stops the command after given timeout, returns the expired event"
+    expired = threading.Event()
+    if timeout is None:
+        return expired, None
+
+    def expire():
+        expired.set()
+        terminate_tree(popen, KILL_TIMEOUT)
+
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    timer.start()
+    return expired, timer
+
+
+def _finish(popen, command, timer=None, output_size=0,
+            stop_timeout=CANCEL_TIMEOUT):
+    """stops the command if it is still running and tracking it,
+    records its metrics. Raises if it is canceled"""
+    if timer is not None:
+        timer.cancel()
+    if popen.poll() is None:
+        # Interrupted, e.g., by Ctrl+C which the new group does not get,
+        # or the output is not read to the end
+        terminate_tree(popen, stop_timeout)
+    with _RUNNING_LOCK:
+        _RUNNING.discard(popen)
+
+    add_span(
+        "command", popen.started, time.time() - popen.started,
+        program=get_program(command),
+        spawn_latency=round(popen.spawn_latency, 4),
+        exit_code=popen.returncode,
+        output_size=output_size
+    )
+    if _CANCELED.is_set():
+        raise Canceled
+
+
+def execute(command, *, cwd, env=None, encoding=None, timeout=None,
+            stop_timeout=CANCEL_TIMEOUT, **kwargs):
+    """Executes the given command in given directory. Yields the output.
+    Raises subprocess.TimeoutExpired if it does not finish in time.
+    If the output is not read to the end, the process tree is stopped,
+    forcefully after stop_timeout."""
+    popen = _start(
+        command,
+        cwd=cwd,
+        env=get_environment() if env is None else env,
+        stdout=subprocess.PIPE,
+        stdin=subprocess.PIPE,
+        stderr=kwargs.pop("stderr", subprocess.PIPE),
+        **kwargs
+    )
+    expired, timer = _start_watchdog(popen, timeout)
+    output_size = 0
+    try:
+        for stdout_line in read_lines(popen.stdout, encoding):
+            output_size += len(stdout_line)
+            yield stdout_line, None
+        popen.stdout.close()
+        popen.wait()
+    finally:
+        _finish(popen, command, timer, output_size, stop_timeout)
+
+    if expired.is_set():
+        raise subprocess.TimeoutExpired(get_program(command), timeout)
+    yield '', popen.returncode
+
+
+def check_output(command, *, cwd, env=None, timeout=None, **kwargs):
+    """Executes the given command in given directory. Returns the output.
+    Raises subprocess.CalledProcessError on failure,
+    subprocess.TimeoutExpired if it does not finish in time."""
+    popen = _start(
+        command,
+        cwd=cwd,
+        env=get_environment() if env is None else env,
+        stdout=subprocess.PIPE,
+        stdin=subprocess.PIPE,
+        stderr=kwargs.pop("stderr", subprocess.PIPE),
+        universal_newlines=True,
+        **kwargs
+    )
+    expired, timer = _start_watchdog(popen, timeout)
+    output, error = '', ''
+    try:
+        output, error = popen.communicate()
+    finally:
+        _finish(popen, command, timer, len(output or ''))
+
+    if expired.is_set():
+        raise subprocess.TimeoutExpired(get_program(command), timeout)
+    if popen.returncode:
+        raise subprocess.CalledProcessError(
+            popen.returncode, command, output, error
+        )
+    return output
+
+
+def _list_windows_processes():
+    "returns {pid: parent pid} of the processes, from a Toolhelp snapshot"
+    # pylint: disable=import-outside-toplevel,too-few-public-methods
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESSENTRY32(ctypes.Structure):
+        "The process entry of the snapshot"
+        _fields_ = [
+            ("dwSize", wintypes.DWORD),
+            ("cntUsage", wintypes.DWORD),
+            ("th32ProcessID", wintypes.DWORD),
+            ("th32DefaultHeapID", ctypes.c_void_p),
+            ("th32ModuleID", wintypes.DWORD),
+            ("cntThreads", wintypes.DWORD),
+            ("th32ParentProcessID", wintypes.DWORD),
+            ("pcPriClassBase", ctypes.c_long),
+            ("dwFlags", wintypes.DWORD),
+            ("szExeFile", ctypes.c_char * 260),
+        ]
+
+    kernel32 = ctypes.windll.kernel32
+    kernel32.CreateToolhelp32Snapshot.restype = ctypes.c_void_p
+    snapshot = kernel32.CreateToolhelp32Snapshot(0x2, 0)
+    if snapshot in (None, ctypes.c_void_p(-1).value):
+        raise OSError("Process snapshot cannot be taken")
+
+    processes = {}
+    try:
+        entry = PROCESSENTRY32()
+        entry.dwSize = ctypes.sizeof(PROCESSENTRY32)
+        found = kernel32.Process32First(ctypes.c_void_p(snapshot),
+                                        ctypes.byref(entry))
+        while found:
+            processes[entry.th32ProcessID] = entry.th32ParentProcessID
+            found = kernel32.Process32Next(ctypes.c_void_p(snapshot),
+                                           ctypes.byref(entry))
+    finally:
+        kernel32.CloseHandle(ctypes.c_void_p(snapshot))
+    return processes
+
+
+def _list_posix_processes():
+    "returns {pid: parent pid} of the processes which are not zombies"
+    processes = {}
+    if os.path.isdir("/proc"):
+        for name in os.listdir("/proc"):
+            if not name.isdigit():
+                continue
+            try:
+                with open("/proc/{0}/stat".format(name)) as stat_file:
+                    stat = stat_file.read()
+            except OSError:
+                continue
+            # The command name may contain spaces, it is in parentheses
+            fields = stat[stat.rfind(')') + 2:].split()
+            if fields[0] != 'Z':
+                processes[int(name)] = int(fields[1])
+        return processes
+
+    output = subprocess.check_output(
+        ["ps", "-A", "-o", "pid=", "-o", "ppid=", "-o", "stat="],
+        universal_newlines=True
+    )
+    for line in output.splitlines():
+        pid, parent, state = line.split()[:3]
+        if not state.startswith('Z'):
+            processes[int(pid)] = int(parent)
+    return processes
+
+
+def list_processes():
+    "returns {pid: parent pid} of the running processes"
+    if os.name == "nt":
+        return _list_windows_processes()
+    return _list_posix_processes()
+
+
+def get_descendants(pid, processes=None):
+    "returns the pids of the descendants of given process"
+    if processes is None:
+        processes = list_processes()
+
+    children = {}
+    for child, parent in processes.items():
+        children.setdefault(parent, []).append(child)
+
+    descendants = set()
+    pending = [pid]
+    while pending:
+        for child in children.get(pending.pop(), ()):
+            if child not in descendants and child != pid:
+                descendants.add(child)
+                pending.append(child)
+    return descendants
+
+
+def _signal_tree(popen, pids, force):
+    "asks the process tree to stop, kills it if force is True"
+    if os.name == "nt":
+        if not force:
+            # The console applications, e.g., ant, stop on Ctrl+Break.
+            # It is sent to the process group created for the command.
+            try:
+                os.kill(popen.pid, signal.CTRL_BREAK_EVENT)
+            except OSError:
+                pass
+            return
+
+        subprocess.run(
+            ["taskkill.exe", "/F", "/T", "/PID", str(popen.pid)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        # The orphans are not found through the parent any more
+        for pid in pids:
+            subprocess.run(
+                ["taskkill.exe", "/F", "/PID", str(pid)],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        return
+
+    signal_number = signal.SIGKILL if force else signal.SIGTERM
+    try:
+        os.killpg(popen.pid, signal_number)
+    except OSError:
+        pass
+    # Some descendants may have left the process group
+    for pid in pids:
+        try:
+            os.kill(pid, signal_number)
+        except OSError:
+            pass
+
+
+def _wait_for(popen, pids, timeout):
+    "waits until the processes are gone, returns the ones still alive"
+    deadline = time.monotonic() + timeout
+    while True:
+        popen.poll()
+        alive = pids.intersection(list_processes())
+        if popen.returncode is None:
+            alive.add(popen.pid)
+        else:
+            alive.discard(popen.pid)
+        if not alive or time.monotonic() >= deadline:
+            return alive
+        time.sleep(_POLL_INTERVAL)
+
+
+def terminate_tree(popen, timeout=CANCEL_TIMEOUT):
+    """Stops the process and all its descendants. They are asked to stop
+    first, killed after the timeout. Returns the pids still alive."""
+    pids = get_descendants(popen.pid)
+    _signal_tree(popen, pids, force=False)
+    alive = _wait_for(popen, pids, timeout)
+    if not alive:
+        return alive
+
+    # The processes started in the meantime are killed too
+    pids = alive.union(get_descendants(popen.pid))
+    _signal_tree(popen, pids, force=True)
+    return _wait_for(popen, pids, KILL_TIMEOUT)
+
+
+def cancel(timeout=CANCEL_TIMEOUT):
+    """Stops the running commands, the new ones are not started anymore.
+    Returns the pids which could not be stopped."""
+    _CANCELED.set()
+    with _RUNNING_LOCK:
+        running = list(_RUNNING)
+
+    alive = set()
+    for popen in running:
+        alive.update(terminate_tree(popen, timeout))
+    return alive
+
+
+def is_canceled():
+    "returns True if the commands are canceled"
+    return _CANCELED.is_set()
+
+
+def reset_cancel():
+    "allows the commands to start again, e.g., for the next operation"
+    _CANCELED.clear()
+
+
+def cancel_on(event, report=None, poll_interval=0.5):
+    """Cancels the commands when given event, e.g., a multiprocessing.Event,
+    is set. Returns an event which stops watching when set."""
+    done = threading.Event()
+
+    def watch():
+        while not done.is_set():
+            if event.wait(poll_interval):
+                alive = cancel()
+                if report is not None:
+                    report(alive)
+                return
+
+    threading.Thread(target=watch, name="cancel-watcher", daemon=True).start()
+    return done
@@ -0,0 +1,317 @@
+"""
+The shared artifact cache of the team.
+
+A simple HTTP store which keeps the executables of the builds by the
+same keys as the local artifact cache:
+    GET/PUT   /entries/<key>      the file names and their sha256, JSON
+    HEAD/GET/PUT /objects/<sha256>  the content of a file
+The files are streamed in both directions, their hashes are checked by
+the server on upload and by the client on download.
+
+The bundled server is enough for testing locally:
+    python compiler_remote_cache.py --directory D:\\cache --port 8080
+and for a team, it listens on the other addresses only with a token:
+    python compiler_remote_cache.py --directory D:\\cache --host 0.0.0.0 --token T
+"""
+import sys
+import os
+import re
+import hmac
+import json
+import hashlib
+import argparse
+import ipaddress
+import urllib.error
+import urllib.request
+from http import HTTPStatus
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from compiler_config import CONFIGURATIONS
+
+REMOTE_CACHE_URL = CONFIGURATIONS.get("remote_cache_url", None)
+REMOTE_CACHE_TOKEN = CONFIGURATIONS.get("remote_cache_token", None)
+REMOTE_CACHE_TIMEOUT = CONFIGURATIONS.get("remote_cache_timeout", 30)
+# Read only clients, e.g., the developer machines, may turn it off
+REMOTE_CACHE_UPLOAD = CONFIGURATIONS.get("remote_cache_upload", True)
+CHUNK_SIZE = 1024 * 1024
+_NAME = re.compile(r'^[0-9a-f]{64}$')
+
+
+class RemoteCacheError(Exception):
+    "raises when the shared cache cannot be used"
+
+
+class RemoteCache:
+    "Client of the shared artifact cache"
+
+    def __init__(self, url=REMOTE_CACHE_URL, token=REMOTE_CACHE_TOKEN,
+                 timeout=REMOTE_CACHE_TIMEOUT):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+
+    def _open(self, method, path, data=None, headers=None):
+        request = urllib.request.Request(
+            self.url + path, data=data, method=method,
+            headers=dict(headers or {})
+        )
+        if self.token:
+            request.add_header("Authorization", "Bearer " + self.token)
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as error:
+            if error.code == HTTPStatus.NOT_FOUND:
+                return None
+            raise RemoteCacheError("{0} {1}: {2}".format(
+                method, path, error
+            ))
+        except (urllib.error.URLError, OSError) as error:
+            raise RemoteCacheError("{0} {1}: {2}".format(
+                method, path, error
+            ))
+
+    def lookup(self, key):
+        "returns the entry of given key, None if it is not cached"
+        response = self._open("GET", "/entries/" + key)
+        if response is None:
+            return None
+        with response:
+            try:
+                return json.loads(response.read().decode())
+            except ValueError as error:
+                raise RemoteCacheError(
+                    "Invalid entry {0}: {1}".format(key, error)
+                )
+
+    def _download(self, digest, path):
+        "streams the object to given path, checks its hash"
+        response = self._open("GET", "/objects/" + digest)
+        if response is None:
+            raise RemoteCacheError("Missing object: {0}".format(digest))
+
+        hasher = hashlib.sha256()
+        temp_file = "{0}.{1}.tmp".format(path, os.getpid())
+        try:
+            with response, open(temp_file, 'wb') as file:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+                    file.write(chunk)
+            if hasher.hexdigest() != digest:
+                raise RemoteCacheError(
+                    "Corrupted object: {0}".format(digest)
+                )
+            os.replace(temp_file, path)
+        finally:
+            if os.path.exists(temp_file):
+                os.unlink(temp_file)
+
+    def fetch(self, key, destination):
+        """Downloads the files of given key to given directory.
+        Returns their paths, None if the key is not cached."""
+        entry = self.lookup(key)
+        if entry is None:
+            return None
+
+        os.makedirs(destination, exist_ok=True)
+        paths = []
+        for name, digest in entry["files"].items():
+            path = os.path.join(destination, os.path.basename(name))
+            self._download(digest, path)
+            paths.append(path)
+        return paths
+
+    def _upload(self, path, digest):
+        "streams the file unless the server has it already"
+        response = self._open("HEAD", "/objects/" + digest)
+        if response is not None:
+            response.close()
+            return False
+
+        with open(path, 'rb') as file:
+            response = self._open(
+                "PUT", "/objects/" + digest, data=file,
+                headers={
+                    "Content-Length": str(os.path.getsize(path)),
+                    "Content-Type": "application/octet-stream",
+                }
+            )
+        if response is None:
+            raise RemoteCacheError("Upload rejected: {0}".format(path))
+        response.close()
+        return True
+
+    def store(self, key, files, **metadata):
+        "uploads given files, then the entry which refers to them"
+        stored = {}
+        for path in files:
+            hasher = hashlib.sha256()
+            with open(path, 'rb') as file:
+                for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+            stored[os.path.basename(path)] = hasher.hexdigest()
+            self._upload(path, stored[os.path.basename(path)])
+
+        content = json.dumps({"files": stored, "metadata": metadata}).encode()
+        response = self._open(
+            "PUT", "/entries/" + key, data=content,
+            headers={"Content-Type": "application/json"}
+        )
+        if response is None:
+            raise RemoteCacheError("Entry rejected: {0}".format(key))
+        response.close()
+
+
+def get_remote_cache():
+    "returns the configured shared cache, None if it is not configured"
+    if not REMOTE_CACHE_URL:
+        return None
+    return RemoteCache()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    "Serves the entries and the objects from a directory"
+
+    def _get_path(self):
+        "returns the file of the request, None if the path is invalid"
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] not in ("entries", "objects") \
+                or not _NAME.match(parts[1]):
+            return None
+        return os.path.join(self.server.directory, parts[0], parts[1])
+
+    def _is_authorized(self):
+        if not self.server.token:
+            return True
+        # Compared in constant time, as bytes since they may not be ASCII
+        return hmac.compare_digest(
+            self.headers.get("Authorization", "").encode("utf-8", "replace"),
+            ("Bearer " + self.server.token).encode("utf-8", "replace")
+        )
+
+    def _reply(self, status, length=0):
+        self.send_response(status)
+        self.send_header("Content-Length", str(length))
+        self.end_headers()
+
+    def _check(self):
+        if not self._is_authorized():
+            self._reply(HTTPStatus.UNAUTHORIZED)
+            return None
+        path = self._get_path()
+        if path is None:
+            self._reply(HTTPStatus.BAD_REQUEST)
+        return path
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        "whether the file exists"
+        path = self._check()
+        if path is None:
+            return
+        if os.path.isfile(path):
+            self._reply(HTTPStatus.OK, os.path.getsize(path))
+        else:
+            self._reply(HTTPStatus.NOT_FOUND)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        "streams the file"
+        path = self._check()
+        if path is None:
+            return
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            self._reply(HTTPStatus.NOT_FOUND)
+            return
+
+        with file:
+            self._reply(HTTPStatus.OK, os.fstat(file.fileno()).st_size)
+            for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+                self.wfile.write(chunk)
+
+    def do_PUT(self):  # pylint: disable=invalid-name
+        "streams the body to a file, objects are checked by their hash"
+        path = self._check()
+        if path is None:
+            return
+        try:
+            remaining = int(self.headers["Content-Length"])
+        except (TypeError, ValueError):
+            self._reply(HTTPStatus.LENGTH_REQUIRED)
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        hasher = hashlib.sha256()
+        temp_file = "{0}.{1}.tmp".format(path, id(self))
+        try:
+            with open(temp_file, 'wb') as file:
+                while remaining:
+                    chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    hasher.update(chunk)
+                    file.write(chunk)
+
+            is_object = os.path.basename(os.path.dirname(path)) == "objects"
+            if remaining or (is_object and
+                             hasher.hexdigest() != os.path.basename(path)):
+                self._reply(HTTPStatus.BAD_REQUEST)
+                return
+            os.replace(temp_file, path)
+        finally:
+            if os.path.exists(temp_file):
+                os.unlink(temp_file)
+
+        self._reply(HTTPStatus.CREATED)
+
+
+class CacheServer(ThreadingHTTPServer):
+    "The bundled server of the shared cache"
+    daemon_threads = True
+
+    def __init__(self, address, directory, token=None):
+        super().__init__(address, _RequestHandler)
+        self.directory = os.path.abspath(directory)
+        self.token = token
+
+
+def _is_loopback(host):
+    "returns True if given host is only reachable from this machine"
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def main(argv=None):
+    "runs the bundled server"
+    parser = argparse.ArgumentParser(
+        description="The shared artifact cache server."
+    )
+    parser.add_argument("--directory", required=True)
+    parser.add_argument(
+        "--host", default="127.0.0.1",
+        help="the other addresses than the loopback require --token"
+    )
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--token", default=os.environ.get("COMPILER_CACHE_TOKEN"),
+        help="the clients should send it as a bearer token"
+    )
+    args = parser.parse_args(argv)
+    if not args.token and not _is_loopback(args.host):
+        parser.error("--token is required to listen on {0}".format(args.host))
+
+    with CacheServer((args.host, args.port), args.directory,
+                     args.token) as server:
+        print("Serving {0} on {1}:{2}".format(
+            server.directory, args.host, args.port
+        ))
+        server.serve_forever()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Timing instrumentation for the operations.
+
+The phases of an operation are recorded as spans with their start and
+end times and some metadata, e.g., component path, bytes sent, target IP.
+The spans are reported as JSON at the end of each operation.
+"""
+import os
+import json
+import time
+import socket
+import threading
+import contextlib
+
+
+class Timeline:
+    "Collects the timed spans of an operation"
+
+    def __init__(self, name, **metadata):
+        self.name = name
+        self.metadata = metadata
+        self.start = time.time()
+        self.end = None
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    @contextlib.contextmanager
+    def span(self, name, **metadata):
+        """Records the time spent in the block. The yielded dictionary
+        can be used for adding metadata which is known at the end."""
+        stack = self._stack()
+        record = {
+            "name": name,
+            "parent": stack[-1]["name"] if stack else None,
+            "thread": threading.current_thread().name,
+            "start": time.time(),
+            "end": None,
+            "duration": None,
+        }
+        record.update(metadata)
+        with self._lock:
+            self.spans.append(record)
+
+        stack.append(record)
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException as error:
+            record["error"] = type(error).__name__
+            raise
+        finally:
+            record["duration"] = round(time.perf_counter() - started, 3)
+            record["end"] = record["start"] + record["duration"]
+            stack.pop()
+
+    def add(self, name, start, duration, **metadata):
+        """Records a span which has already finished, e.g., the ones whose
+        blocks cannot be wrapped by span"""
+        stack = self._stack()
+        record = {
+            "name": name,
+            "parent": stack[-1]["name"] if stack else None,
+            "thread": threading.current_thread().name,
+            "start": start,
+            "end": start + round(duration, 3),
+            "duration": round(duration, 3),
+        }
+        record.update(metadata)
+        with self._lock:
+            self.spans.append(record)
+        return record
+
+    def finish(self):
+        "marks the end of the operation"
+        self.end = time.time()
+
+    def get_spans(self, name=None):
+        "returns the spans with given name, all spans if not given"
+        with self._lock:
+            return [
+                span for span in self.spans
+                if name is None or span["name"] == name
+            ]
+
+    def to_dict(self):
+        "returns the report as a dictionary"
+        end = self.end if self.end is not None else time.time()
+        return {
+            "operation": self.name,
+            "machine": socket.gethostname(),
+            "start": self.start,
+            "end": end,
+            "duration": round(end - self.start, 3),
+            "metadata": self.metadata,
+            "spans": self.get_spans(),
+        }
+
+    def to_json(self):
+        "returns the report as JSON"
+        return json.dumps(self.to_dict(), indent=4, default=str)
+
+    def save(self, filename):
+        "writes the JSON report to given file"
+        with open(filename, 'w') as report_file:
+            report_file.write(self.to_json())
+
+
+_CURRENT = Timeline("idle")
+
+
+def start_timeline(name, **metadata):
+    "starts a new timeline, the spans are recorded on it from now on"
+    global _CURRENT  # pylint: disable=global-statement
+    _CURRENT = Timeline(name, **metadata)
+    return _CURRENT
+
+
+def get_timeline():
+    "returns the current timeline"
+    return _CURRENT
+
+
+def span(name, **metadata):
+    "records a span on the current timeline"
+    return _CURRENT.span(name, **metadata)
+
+
+def add_span(name, start, duration, **metadata):
+    "records a finished span on the current timeline"
+    return _CURRENT.add(name, start, duration, **metadata)
+
+
+def get_report_path(log_file):
+    "returns the path of the timing report next to given log file"
+    return os.path.splitext(log_file)[0] + "_timing.json"
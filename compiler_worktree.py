@@ -0,0 +1,187 @@
+"""
+Keeps a git worktree per build variant.
+
+Optimized and unoptimized builds patch different files and produce
+different object files. Building them in the same tree invalidates the
+other variant each time. So, every (target type, optimization) variant
+is built in its own persistent worktree, next to the root by default.
+
+Before each build, the worktrees are synchronized with the repositories
+of the root: the same commit is checked out, then the modified and the
+staged files are mirrored. Only the files whose content differs are
+written, so the intermediate outputs of the variant stay valid.
+Untracked files are not mirrored, they should be staged.
+"""
+import os
+import json
+import subprocess
+
+from compiler_config import CONFIGURATIONS
+from compiler_process import check_output, COMMAND_TIMEOUT
+from compiler_git import find_git_dir, find_repositories, get_head, \
+    iter_index, iter_modified_entries, GitError
+from compiler_helper import CompileTypes
+from compiler_patch import write_atomic
+
+WORKTREE_DIR = CONFIGURATIONS.get("worktree_dir", None)
+_MODE_GITLINK = 0o160000
+
+
+def _read(path):
+    try:
+        with open(path, 'rb') as file:
+            return file.read()
+    except (FileNotFoundError, IsADirectoryError):
+        return None
+
+
+class WorktreeManager:
+    "Creates and synchronizes the worktrees of the build variants"
+
+    def __init__(self, root, directory=WORKTREE_DIR, patches=None):
+        self.root = os.path.abspath(root)
+        self.directory = os.path.abspath(
+            directory or self.root + "_variants"
+        )
+        self.patches = patches
+
+    @staticmethod
+    def get_variant(target_type, compile_type):
+        "returns the name of the variant, e.g., ipc_unoptimized"
+        optimization = "unoptimized" \
+            if CompileTypes.is_unoptimized(compile_type) else "optimized"
+        return "{0}_{1}".format(target_type.name.lower(), optimization)
+
+    def get_path(self, variant):
+        "returns the root of given variant"
+        return os.path.join(self.directory, variant)
+
+    def _state_file(self, variant):
+        return os.path.join(self.directory, variant + ".json")
+
+    def _read_state(self, variant):
+        try:
+            with open(self._state_file(variant)) as state_file:
+                return json.loads(state_file.read())
+        except (FileNotFoundError, json.JSONDecodeError, OSError):
+            return {}
+
+    def _write_state(self, variant, state):
+        write_atomic(
+            self._state_file(variant),
+            json.dumps(state, indent=4).encode()
+        )
+
+    def prepare(self, target_type, compile_type):
+        "creates or synchronizes the worktrees, returns the variant root"
+        variant = self.get_variant(target_type, compile_type)
+        variant_root = self.get_path(variant)
+        os.makedirs(self.directory, exist_ok=True)
+
+        repositories = find_repositories(self.root)
+        if not repositories:
+            raise GitError("No git repository in {0}".format(self.root))
+
+        state = self._read_state(variant)
+        for repository in repositories:
+            relative = os.path.relpath(repository, self.root)
+            worktree = os.path.normpath(os.path.join(variant_root, relative))
+            if not os.path.exists(os.path.join(worktree, ".git")):
+                self._add(repository, worktree)
+            state[relative] = self._sync(
+                repository, worktree, state.get(relative, [])
+            )
+
+        self._write_state(variant, state)
+        return variant_root
+
+    @staticmethod
+    def _git(*args, cwd):
+        try:
+            return check_output(("git",) + args, cwd=cwd,
+                                timeout=COMMAND_TIMEOUT)
+        except subprocess.CalledProcessError as error:
+            raise GitError("git {0} failed in {1}: {2}".format(
+                ' '.join(args), cwd, error.stderr or error.output
+            ))
+        except (subprocess.TimeoutExpired, OSError) as error:
+            raise GitError(error)
+
+    def _add(self, repository, worktree):
+        "creates a detached worktree of given repository"
+        os.makedirs(os.path.dirname(worktree), exist_ok=True)
+        self._git("worktree", "add", "--detach", worktree, "HEAD",
+                  cwd=repository)
+
+    def _sync(self, repository, worktree, mirrored_before):
+        """Checks out the commit of the repository, mirrors the files which
+        differ from it. Returns the mirrored files."""
+        _, source_git = find_git_dir(repository)
+        _, target_git = find_git_dir(worktree)
+
+        head = get_head(source_git)
+        if head is not None and get_head(target_git) != head:
+            self._git("checkout", "--force", "--detach", head, cwd=worktree)
+
+        source = {entry.name: entry for entry in iter_index(source_git)}
+        target = {entry.name: entry for entry in iter_index(target_git)}
+
+        # Staged, modified and deleted files of the repository
+        mirrored = {
+            name for name, entry in source.items()
+            if entry.mode != _MODE_GITLINK and (
+                name not in target
+                or target[name].object_id != entry.object_id
+            )
+        }
+        mirrored.update(entry.name for entry in iter_modified_entries(
+            repository
+        ))
+        mirrored.update(name for name in target if name not in source)
+
+        # Files mirrored before may have been reverted in the repository
+        for name in mirrored.union(mirrored_before):
+            self._mirror(
+                os.path.join(repository, *name.split('/')),
+                os.path.join(worktree, *name.split('/'))
+            )
+
+        return sorted(mirrored)
+
+    def _mirror(self, source_path, target_path):
+        "writes the content of the source if it differs"
+        content = None
+        if self.patches is not None:
+            # The patches of the repository belong to the other builds
+            content = self.patches.get_pristine(source_path)
+        if content is None:
+            content = _read(source_path)
+
+        if content is None:
+            if os.path.isfile(target_path):
+                os.unlink(target_path)
+            return
+
+        if self.patches is not None \
+                and self.patches.get_pristine(target_path) == content:
+            # Already patched for this variant
+            return
+
+        if _read(target_path) != content:
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            write_atomic(target_path, content)
+
+    def remove(self, variant):
+        "removes the worktrees of given variant"
+        variant_root = self.get_path(variant)
+        for repository in reversed(find_repositories(self.root)):
+            worktree = os.path.normpath(os.path.join(
+                variant_root, os.path.relpath(repository, self.root)
+            ))
+            if os.path.exists(os.path.join(worktree, ".git")):
+                self._git("worktree", "remove", "--force", worktree,
+                          cwd=repository)
+        try:
+            os.unlink(self._state_file(variant))
+        except FileNotFoundError:
+            pass
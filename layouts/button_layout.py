@@ -4,13 +4,16 @@ import os
 import time
 import threading
 import tempfile
-from multiprocessing import Process, active_children
+from multiprocessing import Process, Event, active_children
 
 import tkinter as tk
 from tkinter import ttk
 
+from compiler_config import CONFIGURATIONS
+from compiler_process import CANCEL_TIMEOUT, KILL_TIMEOUT
 from compiler_helper import ExitCodes
 from compiler_gui_support import start_operation, CompilerError
+from compiler_daemon import DaemonClient, DaemonError
 from layouts.layout_base import PAD, Fore
 
 COMPILER_PROCESS_NAME = "compiler_process"
@@ -27,7 +30,10 @@ class ButtonLayout:
         self._context = context
         self._start_button = None
         self._cancel_button = None
-        self._main_dir = os.getcwd()
+        self._daemon_thread = None
+        self._daemon_job = None
+        self._detach = threading.Event()
+        self._cancel_event = None
 
     def start_button(self):
         "returns the start button"
@@ -47,13 +53,14 @@ class ButtonLayout:
         return None
 
     @staticmethod
-    def _start_operation(compiler_config, transfer_config):
+    def _start_operation(compiler_config, transfer_config, root,
+                         cancel_event):
         # pylint: disable=broad-except
         file = open(TEMPORY_FILE, 'w')
         try:
             start_operation(
                 compiler_config, transfer_config,
-                stdout=file
+                stdout=file, root=root, cancel_event=cancel_event
             )
         except CompilerError as error:
             file.write(
@@ -82,6 +89,54 @@ class ButtonLayout:
         finally:
             file.close()
 
+    def _start_operation_on_daemon(self, compiler_config,
+                                   transfer_config, root):
+        "submits the operation to the build daemon and follows its output"
+        with open(TEMPORY_FILE, 'w') as file:
+            try:
+                responses = DaemonClient().submit(
+                    compiler_config, transfer_config, root, attach=True
+                )
+                summary = next(responses)
+                self._daemon_job = summary["job"]
+                file.write("{0}Submitted to the build daemon as job {1}, "
+                           "{2} job(s) ahead.\n".format(
+                               Fore.GREEN, summary["job"], summary["position"]
+                           ))
+                file.flush()
+
+                for response in responses:
+                    if self._detach.is_set():
+                        return
+                    if "output" in response:
+                        file.write(response["output"])
+                        file.flush()
+                    else:
+                        summary = response
+            except DaemonError as error:
+                file.write("{0}{1}".format(Fore.RED, error))
+                summary = {"exit_code": ExitCodes.UNKNOWN.value}
+
+            if summary.get("exit_code") == ExitCodes.SUCCESS.value:
+                file.write(
+                    "\n{GREEN}Operation finished successfully.".format(
+                        **Fore.to_dict()
+                    )
+                )
+            else:
+                file.write(
+                    "\n{0}Operation finished with error code "
+                    "{1}\n".format(Fore.RED, summary.get("exit_code"))
+                )
+            file.flush()
+
+    def _is_operation_running(self):
+        process = self._get_process()
+        if process is not None and process.is_alive():
+            return True
+        return self._daemon_thread is not None and \
+            self._daemon_thread.is_alive() and not self._detach.is_set()
+
     def _process_file_watcher(self, filename):
         need_break = False
         with open(filename, 'r') as file:
@@ -91,8 +146,7 @@ class ButtonLayout:
                     self._context.console_layout.write(line)
                 else:
                     time.sleep(0.5)
-                process = self._get_process()
-                if (process is None or not process.is_alive()) and not line:
+                if not self._is_operation_running() and not line:
                     # Wait a while
                     if need_break:
                         break
@@ -123,18 +177,34 @@ class ButtonLayout:
                 os.path.dirname(sys.argv[0]),
                 output_file
             ))
+        compiler_config.output = output_file
 
         self._context.console_layout.clear_console()
 
         with open(TEMPORY_FILE, 'w'):
             pass
 
-        Process(
-            target=self._start_operation,
-            args=(compiler_config, transfer_config,),
-            name=COMPILER_PROCESS_NAME,
-            daemon=True
-        ).start()
+        if CONFIGURATIONS.get("use_build_daemon", False) and \
+                DaemonClient().is_running():
+            # The daemon has everything imported already
+            self._detach.clear()
+            self._daemon_job = None
+            self._daemon_thread = threading.Thread(
+                target=self._start_operation_on_daemon,
+                args=(compiler_config, transfer_config, git_config["git_path"],),
+                name=COMPILER_PROCESS_NAME,
+                daemon=True
+            )
+            self._daemon_thread.start()
+        else:
+            self._cancel_event = Event()
+            Process(
+                target=self._start_operation,
+                args=(compiler_config, transfer_config, git_config["git_path"],
+                      self._cancel_event,),
+                name=COMPILER_PROCESS_NAME,
+                daemon=True
+            ).start()
 
         threading.Thread(
             target=self._process_file_watcher,
@@ -143,19 +213,53 @@ class ButtonLayout:
             daemon=True
         ).start()
 
-    def _cancel_operation(self, is_user=False):
-        process = self._get_process()
-        if process is not None:
+    def _cancel_daemon_job(self):
+        "cancels the job, stops following it if it cannot be canceled"
+        try:
+            canceled = DaemonClient().cancel(self._daemon_job)["canceled"]
+        except DaemonError:
+            canceled = False
+        if not canceled:
+            self._detach.set()
+            self._context.console_layout.write_after_ready(
+                "{0}\nDetached, job {1} keeps running on the build daemon."
+                "\n".format(Fore.YELLOW, self._daemon_job),
+                timeout=5
+            )
+
+    @staticmethod
+    def _stop_process(process, cancel_event):
+        """Lets the operation stop its build processes,
+        kills it if it does not finish in time"""
+        cancel_event.set()
+        process.join(CANCEL_TIMEOUT + KILL_TIMEOUT + 1)
+        if process.is_alive():
             process.kill()
             process.join()
-        self._start_button.configure(state=tk.NORMAL)
+
+    def _cancel_operation(self, is_user=False):
         self._cancel_button.configure(state=tk.DISABLED)
+        if not is_user:
+            # The operation has finished
+            self._start_button.configure(state=tk.NORMAL)
+            return
 
-        if is_user:
-            self._context.console_layout.write_after_ready(
-                "{0}\nOperation canceled by user!\n".format(Fore.RED),
-                timeout=5
-            )
+        self._context.console_layout.write_after_ready(
+            "{0}\nOperation canceled by user!\n".format(Fore.RED),
+            timeout=5
+        )
+        process = self._get_process()
+        if process is not None and self._cancel_event is not None:
+            # The watcher enables the start button once it is stopped
+            threading.Thread(
+                target=self._stop_process,
+                args=(process, self._cancel_event,),
+                daemon=True
+            ).start()
+        elif self._daemon_job is not None and self._is_operation_running():
+            self._cancel_daemon_job()
+        else:
+            self._start_button.configure(state=tk.NORMAL)
 
     def render(self, parent, **grid_options):
         "Renders the frame"
@@ -15,12 +15,21 @@ Target Type: Select the type of target.
                      links. Stops on error.
         Compile List: Opens a new window for partial
                       compile paths. New line seperated.
+        Jobs: The number of components that will be
+              built at the same time.
+        Skip Unchanged: Skips the components which did
+                        not change since their last build.
+                        Off by default, the headers out of
+                        the component are only tracked if
+                        its build file or shared_include_dirs
+                        refers to them.
 """
 import os
 
 import tkinter as tk
 from tkinter import ttk, messagebox
 
+from compiler_config import CONFIGURATIONS
 from compiler_helper import EXECUTABLE_FILE_PATH, \
     TargetTypes, CompileTypes, \
     AutoBoolType, CPUTypes, \
@@ -50,6 +59,8 @@ class CompileLayout(LayoutBase):
         self.expand_size = None
         self.partial_compile = None
         self.partial_compile_text = []
+        self.partial_jobs = None
+        self.skip_unchanged = None
         self.output = None
         self._context = context
         self.parent = None
@@ -84,25 +95,46 @@ class CompileLayout(LayoutBase):
         label.configure(state=state)
         entry.configure(state=state)
 
-    def _partial_compile_trace(self, button):
+    def _partial_compile_trace(self, *widgets):
         if self.partial_compile.get():
             state = tk.NORMAL
         else:
             state = tk.DISABLED
 
-        button.configure(state=state)
+        for widget in widgets:
+            widget.configure(state=state)
+
+    def _get_component_path(self, path):
+        "component paths are relative to the git path"
+        try:
+            root = self._context.git_layout.git_path.get()
+        except AttributeError:
+            # Not rendered yet
+            root = ''
+
+        return os.path.join(root, path)
 
     def _partial_compile_validate(self):
         if not self.partial_compile.get():
             return True
 
+        if not self._number_validator(self.partial_jobs) \
+                or int(self.partial_jobs.get()) < 1:
+            messagebox.showerror(
+                "Invalid Value",
+                "Jobs should be a positive number"
+            )
+            return False
+
         non_empty_path_count = 0
 
         for path in self.partial_compile_text:
             if not path or path.strip().startswith('#'):
                 continue
 
-            build_xml_path = os.path.join(path, "build.xml")
+            build_xml_path = os.path.join(
+                self._get_component_path(path), "build.xml"
+            )
             if not os.path.isfile(build_xml_path):
                 messagebox.showerror(
                     "Invalid component path",
@@ -158,7 +190,9 @@ class CompileLayout(LayoutBase):
         if not self.validate():
             return None
 
-        command_line = "--target {0} ".format(self.target_type.get())
+        command_line = '--git-path "{0}" '.format(
+            self._get_component_path(''))
+        command_line += "--target {0} ".format(self.target_type.get())
         if self.skip_build.get():
             command_line += "--skip-build "
         else:
@@ -166,17 +200,35 @@ class CompileLayout(LayoutBase):
                 self.compile_type.get())
             if self.parallel_compile.get():
                 command_line += "--parallel "
+                if CONFIGURATIONS.get("build_jobs"):
+                    command_line += "--build-jobs {0} ".format(
+                        CONFIGURATIONS["build_jobs"])
+            if not CONFIGURATIONS.get("low_priority_builds", True):
+                command_line += "--normal-priority "
+            if not CONFIGURATIONS.get("environment_cache", True):
+                command_line += "--no-environment-cache "
+            if CONFIGURATIONS.get("artifact_cache", False):
+                command_line += "--cache "
+            if CONFIGURATIONS.get("fail_fast", False):
+                command_line += "--fail-fast "
+            elif CONFIGURATIONS.get("keep_going", False):
+                command_line += "--keep-going "
             if self.partial_compile.get():
+                command_line += "--jobs {0} ".format(self.partial_jobs.get())
+                if CONFIGURATIONS.get("batch_builds", False):
+                    command_line += "--batch "
+                if self.skip_unchanged.get():
+                    command_line += "--skip-unchanged "
                 command_line += "--partial-compile "
                 for path in set(self.partial_compile_text):
                     if not path.strip().startswith('#'):
                         command_line += "{0} ".format(path)
 
             command_line += "--edit-linker {0} ".format(self.edit_linker.get())
-            if self.edit_linker.get() in (AutoBoolType.ALWAYS,):
+            if self.edit_linker.get() in (AutoBoolType.ALWAYS.name,):
                 command_line += "--linker-expand-size {0} ".format(
                     self.expand_size.get())
-            command_line += "--output {0} ".format(self.output.get())
+            command_line += '--output "{0}" '.format(self.output.get())
         return command_line + " --non-interactive --force "
 
     def get_current_config(self):
@@ -201,7 +253,17 @@ class CompileLayout(LayoutBase):
             edit_linker=self._name_to_enum(
                 self.edit_linker.get(), AutoBoolType),
             expand_size=self.expand_size.get(),
-            output=self.output.get()
+            output=self.output.get(),
+            partial_jobs=int(self.partial_jobs.get()) if self.partial_compile.get() else 1,
+            skip_unchanged=self.skip_unchanged.get(),
+            use_cache=CONFIGURATIONS.get("artifact_cache", False),
+            use_worktree=CONFIGURATIONS.get("use_worktrees", False),
+            build_jobs=CONFIGURATIONS.get("build_jobs", None),
+            low_priority=CONFIGURATIONS.get("low_priority_builds", True),
+            batch_build=CONFIGURATIONS.get("batch_builds", False),
+            use_environment_cache=CONFIGURATIONS.get("environment_cache", True),
+            fail_fast=CONFIGURATIONS.get("fail_fast", False),
+            keep_going=CONFIGURATIONS.get("keep_going", False)
         )
 
     def render(self, parent, **grid_options):
@@ -354,11 +416,39 @@ class CompileLayout(LayoutBase):
             row=False, column=False, inner=7
         ))
 
+        self.partial_jobs = tk.StringVar(parent, value="1")
+        jobs_label = ttk.Label(parent, text="Jobs")
+        jobs_label.grid(**self.get_next_position(
+            row=True, column=False, inner=4
+        ))
+
+        jobs_entry = tk.Entry(
+            parent, textvariable=self.partial_jobs,
+            **ENTRY_CONFIG
+        )
+        jobs_entry.grid(**self.get_next_position(
+            row=False, column=False, inner=7
+        ))
+        self.partial_jobs.trace("w", lambda x, y, z: self._number_validator(
+            self.partial_jobs, jobs_entry
+        ))
+        self._number_validator(self.partial_jobs, jobs_entry)
+
+        self.skip_unchanged = tk.BooleanVar(parent, value=False)
+        skip_unchanged = ttk.Checkbutton(
+            parent, text="Skip Unchanged",
+            variable=self.skip_unchanged
+        )
+        skip_unchanged.grid(**self.get_next_position(
+            row=True, column=False, inner=4
+        ))
+
+        widgets = [button, jobs_label, jobs_entry, skip_unchanged]
         self.partial_compile.trace(
-            "w", lambda x, y, z: self._partial_compile_trace(button)
+            "w", lambda x, y, z: self._partial_compile_trace(*widgets)
         )
-        self._partial_compile_trace(button)
-        self._bind[self._partial_compile_trace] = [button]
+        self._partial_compile_trace(*widgets)
+        self._bind[self._partial_compile_trace] = widgets
 
     def destroy(self):
         "closes open windows"
@@ -426,7 +516,8 @@ class CompileLayout(LayoutBase):
                         f"{idx+1}.0",
                         f"{idx+1}.{tk.END}"
                     )
-                elif os.path.isfile(os.path.join(line, "build.xml")):
+                elif os.path.isfile(os.path.join(
+                        self._get_component_path(line), "build.xml")):
                     text_widget.tag_add(
                         valid_tag,
                         f"{idx+1}.0",
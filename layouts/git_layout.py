@@ -5,11 +5,14 @@ import subprocess
 import tkinter as tk
 from tkinter import ttk, messagebox
 
+from compiler_process import check_output
 from layouts.layout_base import LayoutBase, \
     ENTRY_CONFIG, INNER, PAD
 
 PADDING = int(PAD/2)
 WINAC_GIT = "WinAC_Plus"
+# The path is validated while it is typed
+GIT_TIMEOUT = 10
 
 
 class GitConfigLayout(LayoutBase):
@@ -23,37 +26,25 @@ class GitConfigLayout(LayoutBase):
     @staticmethod
     def is_valid_git_path(path):
         "checks the given path is valid for WinAC"
-        current_path = os.getcwd()
         winac_path = os.path.join(path, WINAC_GIT)
-        try:
-            os.chdir(winac_path)
-        except (FileNotFoundError, OSError):
+        if not os.path.isdir(winac_path):
             return False
 
         try:
-            output = subprocess.check_output(
-                "git ls-remote --get-url",
-                stdin=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                shell=True,
-                universal_newlines=True,
+            output = check_output(
+                ["git", "ls-remote", "--get-url"],
+                cwd=winac_path,
+                timeout=GIT_TIMEOUT
             ).strip()
-        except subprocess.CalledProcessError:
-            return False
-        else:
-            if output.endswith(WINAC_GIT + ".git"):
-                return True
+        except (subprocess.SubprocessError, OSError):
             return False
-        finally:
-            os.chdir(current_path)
+
+        return output.endswith(WINAC_GIT + ".git")
 
     def _git_path_validator(self, variable, entry=None):
         is_valid_folder = self.is_valid_git_path(variable.get())
         self._entry_config_on_variable(is_valid_folder, entry)
-        if is_valid_folder:
-            os.chdir(variable.get())
-        else:
-            os.chdir(os.getenv("tmp"))
+        # Target file is relative to the git path, validate it again
         self._context.transfer_layout.target_file.set(
             self._context.transfer_layout.target_file.get()
         )
@@ -9,7 +9,9 @@ import threading
 import tkinter as tk
 from tkinter import ttk
 
-from compiler_helper import UnknownType
+from compiler_helper import UnknownType, \
+    DEFAULT_USERNAME, DEFAULT_PASSWORD
+from compiler_log import LogWriter
 
 
 MAIN_PATH = getattr(sys, "_MEIPASS", os.path.dirname(sys.argv[0]))
@@ -86,9 +88,6 @@ class Fore:
         return ansi_escape.sub('', text)
 
 
-DEFAULT_USERNAME = "pt1"
-DEFAULT_PASSWORD = "pt1"
-
 PAD = 25
 INNER = int(PAD * 1.5)
 
@@ -478,16 +477,18 @@ class Output(TextWidgetWrapper):
     @stream.setter
     def stream(self, value):
         "the setter of the file path"
+        try:
+            self._stream.close()
+        except AttributeError:
+            pass
+
         if value is None:
             # streaming disable
-            try:
-                self._stream.close()
-            except AttributeError:
-                pass
             self._stream = None
             return
 
-        self._stream = open(value, 'w')
+        # Coloring is stripped and written in the background
+        self._stream = LogWriter(value)
 
     def _write(self, message):
         color = self._color
@@ -530,8 +531,7 @@ class Output(TextWidgetWrapper):
             return
 
         if self.stream is not None:
-            self.stream.write(self._no_color(message))
-            self.stream.flush()
+            self.stream.write(message)
 
         if self._read_only:
             self.text_widget.config(state=tk.NORMAL)
@@ -2,12 +2,16 @@
 import sys
 import os
 import json
+import sqlite3
 
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import pyperclip
 
 from compiler_config import CONFIG_FILE
+from compiler_patch import PatchEngine
+from compiler_history import BuildHistory, format_regressions
+from compiler_gui_support import plan_operation, format_plan
 from compiler_helper import TargetTypes, \
     CompileTypes, LINKER_DFT_EXPAND_SIZE, \
     AutoBoolType, TargetMachines, EXECUTABLE_FILE_PATH, \
@@ -163,7 +167,9 @@ class Menu(LayoutBase):
                 "expand_size": LINKER_DFT_EXPAND_SIZE,
                 "output": "build_out.txt",
                 "partial_compile": False,
-                "partial_compile_text": []
+                "partial_compile_text": [],
+                "partial_jobs": 1,
+                "skip_unchanged": False
             },
             "transfer": {
                 "skip_transfer": False,
@@ -195,11 +201,6 @@ class Menu(LayoutBase):
             )
             return {}
 
-        try:
-            os.chdir(config["git_config"]["git_path"])
-        except (FileNotFoundError, OSError, KeyError):
-            pass
-
         try:
             self._load(config)
         except KeyError:
@@ -291,6 +292,73 @@ class Menu(LayoutBase):
             "Configurations exported successfully!"
         )
 
+    def _restore_patches(self):
+        "restores the linker and the config files which are patched"
+        results = PatchEngine().restore_all()
+        if not results:
+            messagebox.showinfo(
+                "Nothing to restore",
+                "There is no patched file."
+            )
+            return
+
+        changed = [path for path, restored in results.items() if not restored]
+        if changed:
+            messagebox.showwarning(
+                "Some files are not restored",
+                "Following files have been changed after the patch:\n" +
+                '\n'.join(changed)
+            )
+        else:
+            messagebox.showinfo(
+                "Operation success",
+                "Patched files have been restored!"
+            )
+
+    def _copy_command_line(self):
+        "copies the command line which runs the operation without the GUI"
+        compile_command = self._context.compile_layout.get_command_line_string()
+        if compile_command is None:
+            return
+        transfer_command = \
+            self._context.transfer_layout.get_command_line_string()
+        if transfer_command is None:
+            return
+
+        pyperclip.copy("python compiler_cli.py {0}{1}".format(
+            compile_command, transfer_command
+        ).strip())
+
+    def _show_plan(self):
+        "prints what the operation would do, nothing is run"
+        compiler_config = self._context.compile_layout.get_current_config()
+        if compiler_config is None:
+            return
+        transfer_config = self._context.transfer_layout.get_current_config()
+        if transfer_config is None:
+            return
+        git_config = self._context.git_layout.get_current_config()
+        if git_config is None:
+            return
+
+        plan = plan_operation(
+            compiler_config, transfer_config, git_config["git_path"]
+        )
+        self._to_console("{0}{1}\n".format(Fore.GREEN, format_plan(plan)))
+
+    def _show_regressions(self):
+        "prints the builds which have become slower than before"
+        try:
+            regressions = list(BuildHistory().regressions())
+        except sqlite3.Error as error:
+            self._to_console("{0}Build history cannot be read: {1}\n".format(
+                Fore.RED, error
+            ))
+            return
+        self._to_console("{0}{1}\n".format(
+            Fore.GREEN, format_regressions(regressions)
+        ))
+
     def _copy_output(self):
         # set clipboard data
         console_text = self._context.console_layout.text_widget.get(
@@ -385,12 +453,28 @@ class Menu(LayoutBase):
             label="Import", foreground="white",
             command=self._import,
         )
+        menu.add_command(
+            label="Copy Command Line", foreground="white",
+            command=self._copy_command_line,
+        )
+        menu.add_command(
+            label="Show Plan", foreground="white",
+            command=self._show_plan,
+        )
+        menu.add_command(
+            label="Show Slower Builds", foreground="white",
+            command=self._show_regressions,
+        )
 
         menu.add_separator()
         menu.add_command(
             label="Reset", foreground="white",
             command=self._reset
         )
+        menu.add_command(
+            label="Restore Patched Files", foreground="white",
+            command=self._restore_patches
+        )
 
         file_menu.menu = menu
 
@@ -16,6 +16,8 @@ Skip Transfer: Skips transfer if checked.
   Reboot: Reboots the target after transfer
           is done, if checked.
 """
+import os
+
 import tkinter as tk
 from tkinter import ttk, messagebox
 
@@ -70,6 +72,18 @@ class TransferLayout(LayoutBase):
 
         self.target_file.set('\\'.join(current_value))
 
+    def _target_file_validator(self, variable, entry=None):
+        "target file is relative to the git path"
+        try:
+            root = self.context.git_layout.git_path.get()
+        except AttributeError:
+            # Not rendered yet
+            root = ''
+
+        is_valid_file = os.path.isfile(os.path.join(root, variable.get()))
+        self._entry_config_on_variable(is_valid_file, entry)
+        return is_valid_file
+
     def _destination_validator(self, variable, entry=None):
         if not bool(variable.get()):
             self._entry_config_on_variable(False, entry)
@@ -117,11 +131,13 @@ class TransferLayout(LayoutBase):
 
         command_line = "transfer "
         command_line += "--target-type {0} ".format(self.target_machine.get())
+        command_line += "--cpu-type {0} ".format(self.cpu_type.get())
         command_line += "--ip-address {0} ".format(self.ip_address.get())
         command_line += "--username {0} ".format(self.username.get())
         command_line += "--password {0} ".format(self.password.get())
         command_line += "--destination {0} ".format(self.destination.get())
-        command_line += "--executable-file {0} ".format(self.target_file.get())
+        command_line += '--executable-file "{0}" '.format(
+            self.target_file.get())
         command_line += "--action {0} ".format(self.action.get())
         if self.reboot.get():
             command_line += "--reboot "
@@ -221,7 +237,7 @@ class TransferLayout(LayoutBase):
             [self.username, "Username", self._text_validator],
             [self.password, "Password", self._text_validator],
             [self.destination, "Destination", self._destination_validator],
-            [self.target_file, "Target File", self._file_validator],
+            [self.target_file, "Target File", self._target_file_validator],
         ]
 
         for inp in self.inputs: